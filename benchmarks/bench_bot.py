@@ -0,0 +1,297 @@
+"""
+Load test of the whole bot: synthetic Telegram traffic is replayed through the real
+dispatcher and handlers, with the local Wialon stub behind the worker and a fake
+aiogram session recording the Bot API calls instead of sending them.
+
+Reports throughput, latency percentiles, Wialon round trips and Bot API calls
+per action and the process RSS for every scenario. `--save` writes the results
+as JSON, `--compare` checks them against a saved baseline and exits with an error
+when the round trips grow or the p95 latency regresses beyond `--tolerance`.
+
+    python benchmarks/bench_bot.py --units 2000 --actions 200 --concurrency 20
+    python benchmarks/bench_bot.py --save baseline.json
+    python benchmarks/bench_bot.py --compare baseline.json
+"""
+
+import asyncio
+import json
+import logging
+import random
+import resource
+import sys
+import time
+from argparse import ArgumentParser
+from dataclasses import dataclass, asdict
+from functools import partial
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from aiogram.client.default import DefaultBotProperties
+
+from wialonblock import keyboards as kb
+from wialonblock.bot import WialonBlockBot, setup_dispatcher, dp
+from wialonblock.config import TelegramGroup
+from wialonblock.middlewares import FloodControlMiddleware
+from wialonblock.worker import WialonWorker, WialonWorkerRegistry, WialonSession
+
+from telegram_fake import FakeTelegramSession, UpdateFactory, callback_data_of
+from wialon_stub import WialonStub, Fleet, bench_groups, percentile, CHAT_ID, LOCKED_GROUP, UNLOCKED_GROUP
+
+BOT_TOKEN = "1000000001:AAbenchbenchbenchbenchbenchbenchben"
+SCENARIOS = ("list", "search", "paging", "refresh", "show", "lock-storm")
+# p95 changes below this many seconds are noise, not regressions
+P95_NOISE_FLOOR = 0.002
+SEARCH_PATTERNS = ("AA00", "AA01*", "*unit 1000*", "*BB unit 1001*", "AA0001BB*|AA0002BB*")
+
+
+@dataclass
+class Result:
+    scenario: str
+    actions: int
+    elapsed: float
+    throughput: float
+    p50: float
+    p95: float
+    p99: float
+    max: float
+    wialon_round_trips: float
+    telegram_calls: float
+    error_logs: int
+    rss_mib: float
+    wialon_calls: Dict[str, int]
+
+
+class ErrorCounter(logging.Handler):
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+
+    def emit(self, record: logging.LogRecord):
+        self.count += 1
+
+
+def rss_mib() -> float:
+    try:
+        with open("/proc/self/status") as fp:
+            for line in fp:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # peak, not current, where /proc is not available
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / (1024 if sys.platform == "darwin" else 1)
+
+
+class Harness:
+    def __init__(self, bot: WialonBlockBot, telegram: FakeTelegramSession, stub: WialonStub,
+                 concurrency: int, errors: ErrorCounter):
+        self.bot = bot
+        self.telegram = telegram
+        self.stub = stub
+        self.concurrency = concurrency
+        self.errors = errors
+        self.updates = UpdateFactory(int(CHAT_ID), bot.id)
+
+    async def feed(self, update: Dict[str, Any]):
+        await dp.feed_raw_update(self.bot, update)
+
+    async def replay(self, scenario: str, updates: List[Dict[str, Any]]) -> Result:
+        semaphore = asyncio.Semaphore(self.concurrency)
+        latencies: List[float] = []
+
+        async def one(update):
+            async with semaphore:
+                start = time.perf_counter()
+                await self.feed(update)
+                latencies.append(time.perf_counter() - start)
+
+        self.stub.reset_counters()
+        self.telegram.reset_counters()
+        errors_before = self.errors.count
+        start = time.perf_counter()
+        await asyncio.gather(*(one(update) for update in updates))
+        elapsed = time.perf_counter() - start
+
+        wialon_calls = {svc: count for svc, count in self.stub.calls.items() if svc != "avl_evts"}
+        actions = len(updates)
+        return Result(
+            scenario=scenario,
+            actions=actions,
+            elapsed=elapsed,
+            throughput=actions / elapsed if elapsed else 0.0,
+            p50=percentile(latencies, 50),
+            p95=percentile(latencies, 95),
+            p99=percentile(latencies, 99),
+            max=max(latencies, default=0.0),
+            wialon_round_trips=(self.stub.round_trips - self.stub.calls["avl_evts"]) / actions,
+            telegram_calls=sum(self.telegram.calls.values()) / actions,
+            error_logs=self.errors.count - errors_before,
+            rss_mib=rss_mib(),
+            wialon_calls=wialon_calls,
+        )
+
+    async def list_markup(self):
+        """Keyboard of a fresh `/list` answer, the starting point of the callbacks"""
+        await self.feed(self.updates.message("/list"))
+        markup = self.telegram.last_markup()
+        if markup is None:
+            raise RuntimeError("`/list` sent no keyboard")
+        return markup
+
+    async def page_data(self, action: kb.PagesAction) -> str:
+        for data in callback_data_of(await self.list_markup()):
+            if data.startswith(kb.PagesCallback.__prefix__) and kb.PagesCallback.unpack(data).action == action:
+                return data
+        raise RuntimeError(f"No `{action}` button, add more units")
+
+    async def scenario_list(self, actions: int) -> List[Dict[str, Any]]:
+        return [self.updates.message("/list", user_id=i) for i in range(actions)]
+
+    async def scenario_search(self, actions: int) -> List[Dict[str, Any]]:
+        return [self.updates.message(SEARCH_PATTERNS[i % len(SEARCH_PATTERNS)], user_id=i) for i in range(actions)]
+
+    async def scenario_paging(self, actions: int) -> List[Dict[str, Any]]:
+        data = await self.page_data(kb.PagesAction.NEXT)
+        return [self.updates.callback(data, user_id=i) for i in range(actions)]
+
+    async def scenario_refresh(self, actions: int) -> List[Dict[str, Any]]:
+        data = await self.page_data(kb.PagesAction.REFRESH)
+        return [self.updates.callback(data, user_id=i) for i in range(actions)]
+
+    async def scenario_show(self, actions: int) -> List[Dict[str, Any]]:
+        uids = random.Random(0).choices(list(self.stub.fleet.units), k=actions)
+        return [self.updates.callback(kb.GetUnitCallback(unit_id=uid).pack(), user_id=i)
+                for i, uid in enumerate(uids)]
+
+    async def scenario_lock_storm(self, actions: int) -> List[Dict[str, Any]]:
+        fleet = self.stub.fleet
+        half = actions // 2
+        to_lock = fleet.group_by_name(UNLOCKED_GROUP)["u"][:half]
+        to_unlock = fleet.group_by_name(LOCKED_GROUP)["u"][:actions - half]
+        if len(to_lock) + len(to_unlock) < actions:
+            raise RuntimeError("Not enough units for the lock storm")
+        self._storm = (set(fleet.group_by_name(LOCKED_GROUP)["u"]), set(to_lock), set(to_unlock))
+        updates = [self.updates.callback(kb.LockUnitCallback(unit_id=uid).pack()) for uid in to_lock]
+        updates += [self.updates.callback(kb.UnlockUnitCallback(unit_id=uid).pack()) for uid in to_unlock]
+        random.Random(0).shuffle(updates)
+        return updates
+
+    def check_lock_storm(self):
+        locked_before, to_lock, to_unlock = self._storm
+        fleet = self.stub.fleet
+        locked = fleet.group_by_name(LOCKED_GROUP)["u"]
+        unlocked = fleet.group_by_name(UNLOCKED_GROUP)["u"]
+        expected = locked_before - to_unlock | to_lock
+        if set(locked) != expected or len(locked) != len(set(locked)) or set(locked) & set(unlocked):
+            raise SystemExit("lock storm: lost or duplicated group members")
+
+    async def run(self, scenario: str, actions: int) -> Result:
+        build: Callable = getattr(self, "scenario_" + scenario.replace("-", "_"))
+        result = await self.replay(scenario, await build(actions))
+        if scenario == "lock-storm":
+            self.check_lock_storm()
+        return result
+
+
+def print_result(result: Result):
+    print(f"{result.scenario:>10}: {result.actions} actions in {result.elapsed * 1000:.0f} ms, "
+          f"{result.throughput:.1f}/s, p50 {result.p50 * 1000:.2f} ms, p95 {result.p95 * 1000:.2f} ms, "
+          f"p99 {result.p99 * 1000:.2f} ms, max {result.max * 1000:.2f} ms")
+    print(f"{'':>10}  wialon round trips/action {result.wialon_round_trips:.2f} {result.wialon_calls}, "
+          f"bot api calls/action {result.telegram_calls:.2f}, error logs {result.error_logs}, "
+          f"rss {result.rss_mib:.1f} MiB")
+
+
+def compare(results: List[Result], baseline_path: Path, tolerance: float) -> List[str]:
+    baseline = {entry["scenario"]: entry for entry in json.loads(baseline_path.read_text())["results"]}
+    regressions = []
+    for result in results:
+        base = baseline.get(result.scenario)
+        if base is None:
+            continue
+        # round trips are deterministic, any growth is a regression
+        if result.wialon_round_trips > base["wialon_round_trips"] + 0.01:
+            regressions.append(f"{result.scenario}: wialon round trips/action "
+                               f"{base['wialon_round_trips']:.2f} -> {result.wialon_round_trips:.2f}")
+        if result.telegram_calls > base["telegram_calls"] + 0.01:
+            regressions.append(f"{result.scenario}: bot api calls/action "
+                               f"{base['telegram_calls']:.2f} -> {result.telegram_calls:.2f}")
+        if result.p95 > base["p95"] * (1 + tolerance) and result.p95 - base["p95"] > P95_NOISE_FLOOR:
+            regressions.append(f"{result.scenario}: p95 {base['p95'] * 1000:.2f} ms -> {result.p95 * 1000:.2f} ms")
+    return regressions
+
+
+async def run(args) -> List[Result]:
+    random.seed(0)
+    errors = ErrorCounter()
+    root = logging.getLogger()
+    root.setLevel(logging.WARNING)
+    # the errors are counted, printed only on demand
+    root.handlers = [errors]
+    if args.verbose:
+        root.addHandler(logging.StreamHandler(sys.stderr))
+
+    fleet = Fleet.generate(args.units, ignored=args.units // 10)
+    async with WialonStub(fleet, latency=args.wialon_latency) as stub:
+        group = TelegramGroup(**bench_groups())
+        worker = WialonWorker(
+            "127.0.0.1", "token", {group.chat_id: group},
+            # lift aiowialon's client-side rps limiter to measure round trips, not throttling
+            session=partial(WialonSession, scheme="http", port=stub.port, rps=10_000),
+        )
+        telegram = FakeTelegramSession(latency=args.telegram_latency)
+        bot = WialonBlockBot(BOT_TOKEN, wialon_worker=WialonWorkerRegistry({"default": worker}),
+                             session=telegram, default=DefaultBotProperties(parse_mode="MarkdownV2"))
+        flood_control: Optional[FloodControlMiddleware] = None
+        if args.flood_control:
+            flood_control = FloodControlMiddleware()
+            bot.session.middleware(flood_control)
+        # the cold `/list` is measured, not the startup prefetch
+        setup_dispatcher(set_commands=False, prewarm=False)
+
+        harness = Harness(bot, telegram, stub, args.concurrency, errors)
+        results = []
+        await dp.emit_startup(bot=bot)
+        try:
+            if not args.warm:
+                results.append(await harness.replay("cold-list", [harness.updates.message("/list")]))
+                print_result(results[-1])
+            for scenario in args.scenarios:
+                results.append(await harness.run(scenario, args.actions))
+                print_result(results[-1])
+        finally:
+            await dp.emit_shutdown(bot=bot)
+            if flood_control is not None:
+                await flood_control.close()
+    return results
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--units", type=int, default=2000)
+    parser.add_argument("--actions", type=int, default=200, help="updates per scenario")
+    parser.add_argument("--concurrency", type=int, default=20, help="updates handled at once")
+    parser.add_argument("--wialon-latency", type=float, default=0.02, help="stub latency per HTTP request, seconds")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="fake Bot API latency, seconds")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--flood-control", action="store_true", help="send through the flood control")
+    parser.add_argument("--warm", action="store_true", help="skip the cold `/list`")
+    parser.add_argument("--verbose", action="store_true", help="print the warnings and errors logged by the bot")
+    parser.add_argument("--save", type=Path, help="write the results to a JSON file")
+    parser.add_argument("--compare", type=Path, help="baseline JSON to check the results against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95 growth over the baseline")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.save:
+        args.save.write_text(json.dumps({"args": {k: str(v) for k, v in vars(args).items()},
+                                         "results": [asdict(result) for result in results]}, indent=2))
+    if args.compare:
+        if regressions := compare(results, args.compare, args.tolerance):
+            raise SystemExit("regressions:\n" + "\n".join(regressions))
+        print("no regressions against", args.compare)
+
+
+if __name__ == "__main__":
+    main()
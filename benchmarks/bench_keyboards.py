@@ -0,0 +1,52 @@
+"""
+Render time of the pages keyboard, built from scratch (`--cold`, caches cleared
+before every render) or from the memoized unit buttons and navigation rows.
+
+    python benchmarks/bench_keyboards.py --units 2000 --renders 2000
+    python benchmarks/bench_keyboards.py --units 2000 --renders 2000 --cold
+"""
+
+import random
+import time
+from argparse import ArgumentParser
+
+from wialonblock import keyboards as kb
+from wialonblock.worker import ObjState, Unit
+
+from wialon_stub import Fleet, percentile
+
+
+def run(units: int, renders: int, cold: bool):
+    fleet = Fleet.generate(units)
+    rnd = random.Random(0)
+    states = (ObjState.LOCKED, ObjState.UNLOCKED)
+    items = [Unit(uid, name, rnd.choice(states)) for uid, name in sorted(fleet.units.items(), key=lambda i: i[1])]
+    pages = range(0, units, kb.ITEMS_PER_PAGE)
+
+    samples = []
+    for i in range(renders):
+        start = rnd.choice(pages)
+        data = kb.PagesCallback(start=start, end=start + kb.ITEMS_PER_PAGE, action=kb.PagesAction.NEXT, key="bench")
+        if cold:
+            kb.unit_buttons.clear()
+            kb.pages_navigation.cache_clear()
+        begin = time.perf_counter()
+        kb.pages_result(items, data)
+        samples.append(time.perf_counter() - begin)
+
+    print(f"units: {units}, renders: {renders}, {'cold' if cold else 'memoized'}")
+    print(f"mean: {sum(samples) / len(samples) * 1e6:.1f} us, p50: {percentile(samples, 50) * 1e6:.1f} us, "
+          f"p95: {percentile(samples, 95) * 1e6:.1f} us, cached buttons: {len(kb.unit_buttons)}")
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--units", type=int, default=2000)
+    parser.add_argument("--renders", type=int, default=2000)
+    parser.add_argument("--cold", action="store_true")
+    args = parser.parse_args()
+    run(args.units, args.renders, args.cold)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Round trips and latency of `WialonWorker.list_by_tg_group_id` (the `/list` command)
+against the local Wialon stub, then checks that the groups named in Wialon
+in a different case than in the config are still found.
+
+    python benchmarks/bench_list.py --units 2000 --latency 0.02 --requests 50
+"""
+
+import asyncio
+import time
+from argparse import ArgumentParser
+from functools import partial
+
+from wialonblock.config import TelegramGroup
+from wialonblock.worker import WialonWorker, WialonSession
+
+from wialon_stub import WialonStub, Fleet, bench_groups, percentile, CHAT_ID, LOCKED_GROUP, UNLOCKED_GROUP
+
+
+async def run(units: int, latency: float, requests: int, pattern: str):
+    async with WialonStub(Fleet.generate(units, ignored=units // 10), latency=latency) as stub:
+        group = TelegramGroup(**bench_groups())
+        worker = WialonWorker(
+            "127.0.0.1", "token", {group.chat_id: group},
+            # lift aiowialon's client-side rps limiter to measure round trips, not throttling
+            session=partial(WialonSession, scheme="http", port=stub.port, rps=10_000),
+        )
+        try:
+            # login is paid once per process, keep it out of the measurements
+            await worker._sessions.open()
+            stub.reset_counters()
+            start = time.perf_counter()
+            await worker.list_by_tg_group_id(CHAT_ID, pattern)
+            cold = time.perf_counter() - start
+            cold_calls = dict(stub.calls)
+            stub.reset_counters()
+
+            samples = []
+            for _ in range(requests):
+                start = time.perf_counter()
+                objects = await worker.list_by_tg_group_id(CHAT_ID, pattern)
+                samples.append(time.perf_counter() - start)
+            round_trips, calls = stub.round_trips, dict(stub.calls)
+        finally:
+            await worker.close()
+
+        print(f"units: {units}, listed: {len(objects)}, stub latency: {latency * 1000:.1f} ms")
+        print(f"cold /list: {cold * 1000:.2f} ms {cold_calls}")
+        print(f"round trips per /list: {round_trips / requests:.2f} {calls}")
+        print(f"p50: {percentile(samples, 50) * 1000:.2f} ms, p95: {percentile(samples, 95) * 1000:.2f} ms")
+
+
+async def case_mismatch(units: int):
+    fleet = Fleet.generate(units)
+    # Wialon matches the names case-insensitively
+    fleet.group_by_name(LOCKED_GROUP)["nm"] = LOCKED_GROUP.lower()
+    fleet.group_by_name(UNLOCKED_GROUP)["nm"] = UNLOCKED_GROUP.upper()
+    async with WialonStub(fleet) as stub:
+        group = TelegramGroup(**bench_groups())
+        worker = WialonWorker(
+            "127.0.0.1", "token", {group.chat_id: group},
+            session=partial(WialonSession, scheme="http", port=stub.port, rps=10_000),
+        )
+        try:
+            objects = await worker.list_by_tg_group_id(CHAT_ID)
+        finally:
+            await worker.close()
+
+    print(f"groups named in another case: listed {len(objects)} of {units}")
+    if len(objects) != units:
+        raise SystemExit("case-insensitive group check failed")
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--units", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.02, help="stub latency per HTTP request, seconds")
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--pattern", default="*")
+    args = parser.parse_args()
+    asyncio.run(run(args.units, args.latency, args.requests, args.pattern))
+    asyncio.run(case_mismatch(args.units))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Lock state classification: members lists scans (as `_check_is_locked` used to do)
+against the `LockIndex` built once per members update.
+
+    python benchmarks/bench_lock_index.py --units 4000
+"""
+
+import logging
+import random
+import timeit
+from argparse import ArgumentParser
+
+from wialonblock.worker import LockIndex, ObjState
+
+
+def classify_by_scan(uids, locked_uids, unlocked_uids):
+    states = []
+    for uid in uids:
+        if uid in locked_uids and uid in unlocked_uids:
+            states.append(ObjState.UNKNOWN)
+        elif uid in locked_uids:
+            states.append(ObjState.LOCKED)
+        elif uid in unlocked_uids:
+            states.append(ObjState.UNLOCKED)
+        else:
+            states.append(ObjState.UNKNOWN)
+    return states
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--units", type=int, default=4000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    logging.disable(logging.ERROR)
+
+    uids = list(range(100_000, 100_000 + args.units))
+    random.shuffle(uids)
+    locked_uids = tuple(uids[:args.units // 2])
+    unlocked_uids = tuple(uids[args.units // 2:])
+    listed = sorted(uids)
+
+    index = LockIndex(locked_uids, unlocked_uids)
+    assert index.classify_many(listed) == classify_by_scan(listed, locked_uids, unlocked_uids)
+
+    scan = min(timeit.repeat(lambda: classify_by_scan(listed, locked_uids, unlocked_uids),
+                             number=1, repeat=args.repeat))
+    build = min(timeit.repeat(lambda: LockIndex(locked_uids, unlocked_uids), number=1, repeat=args.repeat))
+    lookup = min(timeit.repeat(lambda: index.classify_many(listed), number=1, repeat=args.repeat))
+
+    print(f"units: {args.units}")
+    print(f"list scans:            {scan * 1000:9.3f} ms")
+    print(f"index build:           {build * 1000:9.3f} ms")
+    print(f"index classify_many:   {lookup * 1000:9.3f} ms")
+    print(f"speedup (with build):  {scan / (build + lookup):9.1f}x")
+    print(f"speedup (cached):      {scan / lookup:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
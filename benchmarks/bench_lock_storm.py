@@ -0,0 +1,154 @@
+"""
+Concurrent lock/unlock storm against the local Wialon stub.
+
+Locks and unlocks `--units` different units of the same chat at once
+and checks that no update was lost. `--naive` replays the previous
+unserialized read-modify-write of the groups for comparison.
+Then checks that a group read started before a lock and answered after it
+doesn't bring back the members from before the lock, neither to the cache
+nor to a listing sent after the lock.
+
+    python benchmarks/bench_lock_storm.py --units 50 --latency 0.01
+    python benchmarks/bench_lock_storm.py --units 50 --latency 0.01 --naive
+"""
+
+import asyncio
+import json
+import time
+from argparse import ArgumentParser
+from functools import partial
+
+from aiowialon.types import flags
+
+from wialonblock.config import TelegramGroup
+from wialonblock.worker import WialonWorker, WialonSession, ObjState
+
+from wialon_stub import WialonStub, Fleet, bench_groups, json_response, CHAT_ID, LOCKED_GROUP, UNLOCKED_GROUP
+
+
+class SlowReadStub(WialonStub):
+    """Answers the group searches with the members at the time of the request, `read_delay` seconds later"""
+
+    read_delay = 0.0
+
+    async def _ajax(self, request):
+        form = await request.post()
+        params = json.loads(form.get("params") or "{}")
+        if (self.read_delay and form["svc"] == "core/search_items"
+                and params["spec"]["itemsType"] == "avl_unit_group"):
+            response = self.dispatch(form["svc"], params, form.get("sid"))
+            await asyncio.sleep(self.read_delay)
+            return json_response(response)
+        return await super()._ajax(request)
+
+
+async def naive_swap(session: WialonSession, stub: WialonStub, uid, from_name, to_name):
+    """Read both groups, edit, write back: what `_swap_groups` used to do"""
+    from_group = stub.fleet.group_by_name(from_name)
+    to_group = stub.fleet.group_by_name(to_name)
+    response = await session.core_search_items(
+        spec={"itemsType": "avl_unit_group", "propName": "sys_name",
+              "propValueMask": f"{from_name}|{to_name}", "sortType": "sys_name", "propType": ""},
+        force=1, flags=1, **{"from": 0, "to": 0},
+    )
+    members = {item["nm"]: item["u"] for item in response["items"]}
+    from_uids, to_uids = members[from_name], members[to_name]
+    from_uids.remove(uid)
+    to_uids.append(uid)
+    await session.batch(
+        session.unit_group_update_units(itemId=from_group["id"], units=from_uids),
+        session.unit_group_update_units(itemId=to_group["id"], units=to_uids),
+        flags_=flags.BatchFlag.STOP_ON_ERROR,
+    )
+
+
+async def run(units: int, latency: float, naive: bool):
+    fleet = Fleet.generate(units * 2)
+    locked_before = list(fleet.group_by_name(LOCKED_GROUP)["u"])
+    unlocked_before = list(fleet.group_by_name(UNLOCKED_GROUP)["u"])
+    to_lock = unlocked_before[:units]
+    to_unlock = locked_before[:units]
+
+    async with WialonStub(fleet, latency=latency) as stub:
+        group = TelegramGroup(**bench_groups())
+        worker = WialonWorker(
+            "127.0.0.1", "token", {group.chat_id: group},
+            session=partial(WialonSession, scheme="http", port=stub.port, rps=10_000),
+        )
+        try:
+            await worker.list_by_tg_group_id(CHAT_ID)
+            stub.reset_counters()
+            start = time.perf_counter()
+            if naive:
+                session = await worker._sessions.open()
+                calls = [naive_swap(session, stub, uid, UNLOCKED_GROUP, LOCKED_GROUP) for uid in to_lock]
+                calls += [naive_swap(session, stub, uid, LOCKED_GROUP, UNLOCKED_GROUP) for uid in to_unlock]
+            else:
+                calls = [worker.lock(CHAT_ID, uid) for uid in to_lock]
+                calls += [worker.unlock(CHAT_ID, uid) for uid in to_unlock]
+            results = await asyncio.gather(*calls, return_exceptions=True)
+            elapsed = time.perf_counter() - start
+            calls = dict(stub.calls)
+        finally:
+            await worker.close()
+
+    errors = [r for r in results if isinstance(r, Exception)]
+    locked_after = fleet.group_by_name(LOCKED_GROUP)["u"]
+    unlocked_after = fleet.group_by_name(UNLOCKED_GROUP)["u"]
+    expected_locked = set(locked_before) - set(to_unlock) | set(to_lock)
+    expected_unlocked = set(unlocked_before) - set(to_lock) | set(to_unlock)
+    lost = len(expected_locked ^ set(locked_after)) + len(expected_unlocked ^ set(unlocked_after))
+    duplicates = len(locked_after) - len(set(locked_after)) + len(unlocked_after) - len(set(unlocked_after))
+
+    print(f"mode: {'naive' if naive else 'coalesced'}, swaps: {len(results)}, stub latency: {latency * 1000:.1f} ms")
+    print(f"elapsed: {elapsed * 1000:.1f} ms, throughput: {len(results) / elapsed:.1f} swaps/s, errors: {len(errors)}")
+    print(f"wialon calls: {calls}")
+    print(f"lost updates: {lost}, duplicated members: {duplicates}")
+    if not naive and (lost or duplicates or errors):
+        raise SystemExit("consistency check failed")
+
+
+async def stale_read(latency: float):
+    fleet = Fleet.generate(10)
+    uid = fleet.group_by_name(UNLOCKED_GROUP)["u"][0]
+    async with SlowReadStub(fleet, latency=latency) as stub:
+        group = TelegramGroup(**bench_groups())
+        worker = WialonWorker(
+            "127.0.0.1", "token", {group.chat_id: group},
+            session=partial(WialonSession, scheme="http", port=stub.port, rps=10_000),
+        )
+        try:
+            await worker._sessions.open()
+            stub.read_delay = 0.3
+            listing = asyncio.create_task(worker.list_by_tg_group_id(CHAT_ID))
+            await asyncio.sleep(0.05)
+            stub.read_delay = 0.0
+            await worker.lock(CHAT_ID, uid)
+            # sent while the listing from before the lock is still in flight
+            joined = asyncio.create_task(worker.list_by_tg_group_id(CHAT_ID))
+            listed = {unit.id: unit.lock for unit in await listing}
+            joined = {unit.id: unit.lock for unit in await joined}
+            unit = await worker.get_unit_and_lock_state(CHAT_ID, uid)
+            relisted = {unit.id: unit.lock for unit in await worker.list_by_tg_group_id(CHAT_ID)}
+        finally:
+            await worker.close()
+
+    print(f"read across a lock: listing {listed.get(uid)}, listing after the lock {joined.get(uid)}, "
+          f"unit {unit.lock}, next listing {relisted.get(uid)}")
+    if ObjState.LOCKED != unit.lock or {joined.get(uid), relisted.get(uid)} != {ObjState.LOCKED}:
+        raise SystemExit("stale read check failed")
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--units", type=int, default=50, help="units to lock and units to unlock")
+    parser.add_argument("--latency", type=float, default=0.01)
+    parser.add_argument("--naive", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(run(args.units, args.latency, args.naive))
+    if not args.naive:
+        asyncio.run(stale_read(args.latency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Startup prefetch of the chats against the local Wialon stub: the first `/list` of every chat
+after a cold start, and the time the prefetch takes with a different number of chats at once.
+
+    python benchmarks/bench_prewarm.py --chats 20 --units 500 --latency 0.05
+"""
+
+import asyncio
+import logging
+import time
+from argparse import ArgumentParser
+from functools import partial
+
+from wialonblock.config import TelegramGroup
+from wialonblock.worker import WialonWorker, WialonSession
+
+from wialon_stub import WialonStub, Fleet, percentile
+
+
+def chats_fleet(chats: int, units: int) -> Fleet:
+    """`units` per chat, half of them locked"""
+    fleet = Fleet()
+    uid = 100_000
+    for chat in range(chats):
+        uids = list(range(uid, uid + units))
+        uid += units
+        fleet.units.update({unit: f"AA{unit % 10_000:04d}BB unit {unit}" for unit in uids})
+        fleet.groups[2 * chat + 1] = {"id": 2 * chat + 1, "nm": f"locked {chat}", "u": uids[:units // 2]}
+        fleet.groups[2 * chat + 2] = {"id": 2 * chat + 2, "nm": f"unlocked {chat}", "u": uids[units // 2:]}
+    return fleet
+
+
+def make_worker(port: int, chats: int) -> WialonWorker:
+    groups = {
+        str(-1000000000000 - chat): TelegramGroup(
+            tag=f"chat {chat}", chat_name=f"Chat {chat}", chat_id=str(-1000000000000 - chat),
+            wln_group_locked=f"locked {chat}", wln_group_unlocked=f"unlocked {chat}",
+        )
+        for chat in range(chats)
+    }
+    return WialonWorker(
+        "127.0.0.1", "token", groups,
+        session=partial(WialonSession, scheme="http", port=port, rps=10_000),
+    )
+
+
+async def first_lists(worker: WialonWorker) -> list:
+    samples = []
+    for chat_id in worker.tg_groups:
+        start = time.perf_counter()
+        await worker.list_by_tg_group_id(chat_id)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def print_lists(label: str, samples: list):
+    print(f"{label}: first /list p50 {percentile(samples, 50) * 1000:.2f} ms, "
+          f"max {max(samples) * 1000:.2f} ms")
+
+
+async def run(chats: int, units: int, latency: float, concurrency: list):
+    async with WialonStub(chats_fleet(chats, units), latency=latency) as stub:
+        worker = make_worker(stub.port, chats)
+        try:
+            print_lists("no prefetch", await first_lists(worker))
+        finally:
+            await worker.close()
+
+        for limit in concurrency:
+            worker = make_worker(stub.port, chats)
+            try:
+                login, prefetch = await worker.prewarm(limit)
+                print(f"prefetch, {limit} chats at once: login {login * 1000:.1f} ms, "
+                      f"prefetch {prefetch * 1000:.1f} ms")
+                print_lists(f"prefetched, {limit} chats at once", await first_lists(worker))
+            finally:
+                await worker.close()
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--units", type=int, default=500, help="units per chat")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub latency per HTTP request, seconds")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8], help="chats prefetched at once")
+    args = parser.parse_args()
+    # aiowialon logs every login and logout
+    logging.disable(logging.INFO)
+    asyncio.run(run(args.chats, args.units, args.latency, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Cost of the unit search responses and of the records kept from them:
+`BASE | BILLING_PROPS` (the flags the bot used to request) against `BASE` alone,
+raw item dicts against the `Unit` records, on a fleet of the Wialon stub.
+
+    python benchmarks/bench_records.py --units 20000
+"""
+
+import gc
+import json
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+from aiowialon.types.flags import UnitsDataFlag
+
+from wialonblock.worker import Unit, ObjState, UNIT_FLAGS
+
+from wialon_stub import WialonStub, Fleet, percentile
+
+
+def search_response(stub: WialonStub, flags: int) -> bytes:
+    spec = {"itemsType": "avl_unit", "propName": "sys_name", "propValueMask": "*",
+            "sortType": "sys_name", "propType": ""}
+    response = stub.dispatch("core/search_items", {"spec": spec, "force": 1, "flags": flags, "from": 0, "to": 0})
+    return json.dumps(response).encode()
+
+
+def decode_time(payload: bytes, repeat: int) -> float:
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        json.loads(payload)
+        samples.append(time.perf_counter() - start)
+    return percentile(samples, 50)
+
+
+def retained(build) -> int:
+    """Bytes still allocated by the result of `build`"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def run(units: int, repeat: int):
+    stub = WialonStub(Fleet.generate(units))
+    legacy = search_response(stub, UnitsDataFlag.BASE | UnitsDataFlag.BILLING_PROPS)
+    minimal = search_response(stub, UNIT_FLAGS)
+
+    print(f"units: {units}")
+    for label, payload in (("BASE|BILLING_PROPS", legacy), ("BASE", minimal)):
+        print(f"{label:20} response: {len(payload) / 1024:8.1f} KiB, "
+              f"json decode p50: {decode_time(payload, repeat) * 1000:7.2f} ms")
+
+    def raw_items():
+        items = json.loads(legacy)["items"]
+        for item in items:
+            item["_lock_"] = ObjState.LOCKED
+        return items
+
+    def records():
+        return [Unit.from_item(item, ObjState.LOCKED) for item in json.loads(minimal)["items"]]
+
+    raw, compact = retained(raw_items), retained(records)
+    print(f"raw dicts + _lock_: {raw / units:6.0f} B/unit, Unit records: {compact / units:6.0f} B/unit "
+          f"({raw / compact:.1f}x)")
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--units", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    run(args.units, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
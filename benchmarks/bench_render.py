@@ -0,0 +1,154 @@
+"""
+Message rendering: checks that the regex escaping, the converted templates and the cached
+timestamps give the same bytes as the `str.replace` escapers `util` had, `str.format` and
+`datetime.now().strftime` on random inputs, then times both ways.
+
+    python benchmarks/bench_render.py --checks 20000 --number 100000
+"""
+
+import html
+import random
+import timeit
+from argparse import ArgumentParser
+from datetime import datetime
+
+from wialonblock import bot
+from wialonblock.render import Renderer, Template, ESCAPERS, TIMESTAMP_FORMAT
+from wialonblock.util import MARKDOWN_V2_SPECIAL
+
+
+def escape_markdown_v2(text: str) -> str:
+    """`util.escape_markdown_v2` as it was, a replace per character"""
+    text = text.replace("\\", "\\\\")
+    for char in "_*[]()~`>#+-=|{}.!":
+        text = text.replace(char, "\\" + char)
+    return text
+
+
+def escape_markdown_legacy(text: str) -> str:
+    """`util.escape_markdown_legacy` as it was, a replace per character"""
+    for char in "_*[]()`":
+        text = text.replace(char, "\\" + char)
+    return text
+
+
+# The special characters, doubled backslashes, markup lookalikes and multi-byte text
+ALPHABET = MARKDOWN_V2_SPECIAL + "\\\\&<>\"' \n\tAaZz09юЇїєҐ🤷‍♂️⛔️🟢"
+
+REFERENCE = {
+    "MarkdownV2": escape_markdown_v2,
+    "Markdown": escape_markdown_legacy,
+    "HTML": lambda text: html.escape(text, quote=False),
+}
+
+# Unit names, usernames and patterns as they come to the handlers
+NAMES = ["AA1234BB unit 100123", "some_user", "Камаз 45-12 (Київ)", "AA*", "ivan.petrenko",
+         "Трактор John Deere 8R", "ВІ 7788 АК", "Причіп [резерв] #3"]
+
+
+def random_text(max_length: int = 40) -> str:
+    return "".join(random.choices(ALPHABET, k=random.randint(0, max_length)))
+
+
+def templates():
+    return {name: value for name, value in vars(bot).items() if isinstance(value, Template)}
+
+
+def check(checks: int):
+    for mode, reference in REFERENCE.items():
+        escape = ESCAPERS[mode]
+        for _ in range(checks):
+            text = random_text()
+            assert escape(text) == reference(text), (mode, text)
+        print(f"escape {mode}: {checks} random strings identical")
+
+    for name, template in templates().items():
+        for _ in range(checks // 10):
+            fields = {field: random_text() for field in template.fields}
+            assert template.render("MarkdownV2", **fields) == template.source.format(**fields), (name, fields)
+        # the other modes compile and render
+        for mode in REFERENCE:
+            template.render(mode, **{field: "x" for field in template.fields})
+    print(f"templates: {len(templates())} identical to `str.format` for MarkdownV2")
+
+    # a search pattern is user text inside a code span
+    pattern = "*AA_1* `<&>`\\"
+    expected = {
+        "MarkdownV2": "`*AA_1* \\`<&>\\`\\\\`",
+        "Markdown": "`*AA_1* <&>\\`",
+        "HTML": "<code>*AA_1* `&lt;&amp;&gt;`\\</code>",
+    }
+    for mode, span in expected.items():
+        render = Renderer(mode)
+        message = render(bot.PAGES_RESULT_MESSAGE_FORMAT, pattern=render.code(pattern), total=1, start=1, end=1,
+                         stale="", datetime=render.now(), user=render.escape("some_user"))
+        assert span in message, (mode, message)
+    print(f"patterns in code spans: {', '.join(expected)}")
+
+    render = Renderer("MarkdownV2")
+    for _ in range(checks // 100):
+        expected = escape_markdown_v2(datetime.now().strftime(TIMESTAMP_FORMAT))
+        # a second may tick between the two
+        assert render.now() in (expected, escape_markdown_v2(datetime.now().strftime(TIMESTAMP_FORMAT)))
+        timestamp = random.uniform(0, 2_000_000_000)
+        assert render.timestamp(timestamp) == escape_markdown_v2(
+            datetime.fromtimestamp(timestamp).strftime(TIMESTAMP_FORMAT))
+    print("timestamps identical to `datetime.strftime`")
+
+
+def report(label: str, before: float, after: float, number: int):
+    print(f"{label}: {before / number * 1e6:.2f} -> {after / number * 1e6:.2f} us, x{before / after:.1f}")
+
+
+def bench(number: int):
+    for mode, reference in (("MarkdownV2", escape_markdown_v2), ("Markdown", escape_markdown_legacy)):
+        escape = ESCAPERS[mode]
+        before = timeit.timeit(lambda: [reference(name) for name in NAMES], number=number // len(NAMES))
+        after = timeit.timeit(lambda: [escape(name) for name in NAMES], number=number // len(NAMES))
+        report(f"escape {mode}", before, after, number)
+
+    render = Renderer("MarkdownV2")
+    before = timeit.timeit(lambda: escape_markdown_v2(datetime.now().strftime(TIMESTAMP_FORMAT)), number=number)
+    after = timeit.timeit(render.now, number=number)
+    report("timestamp", before, after, number)
+
+    template = bot.PAGES_RESULT_MESSAGE_FORMAT
+    fields = dict(pattern="AA*", total=1234, start=1, end=20, stale="", datetime="17\\.10\\.2026 12:00:00",
+                  user="some\\_user")
+    before = timeit.timeit(lambda: template.source.format(**fields), number=number)
+    after = timeit.timeit(lambda: render(template, **fields), number=number)
+    report("template", before, after, number)
+
+    # a listing message as the handlers build it
+    source = template.source
+
+    def old():
+        return source.format(
+            pattern="AA*", total=1234, start=1, end=20, stale="",
+            datetime=escape_markdown_v2(datetime.now().strftime(TIMESTAMP_FORMAT)),
+            user=escape_markdown_v2("some_user"),
+        )
+
+    def new():
+        return render(
+            template, pattern=render.code("AA*"), total=1234, start=1, end=20, stale="",
+            datetime=render.now(), user=render.escape("some_user"),
+        )
+
+    # a second may tick between the two
+    assert old() == new() or old() == new()
+    report("listing message", timeit.timeit(old, number=number), timeit.timeit(new, number=number), number)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--checks", type=int, default=20000, help="random inputs per escaper")
+    parser.add_argument("--number", type=int, default=100000, help="renders per measurement")
+    args = parser.parse_args()
+    random.seed(0)
+    check(args.checks)
+    bench(args.number)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Wialon calls under trouble, against the local Wialon stub:
+
+- tail: unit reads with a slow tail of responses, with and without the hedged reads
+- outage: the stub is stopped, listings fall back to the last known data and the breaker fails fast
+- hang: the stub stops answering, the reads are cut off by their deadline
+- recovery: the stub is back, the breaker probe closes the circuit
+
+    python benchmarks/bench_resilience.py --reads 400 --tail 0.03 --tail-latency 0.3
+"""
+
+import asyncio
+import logging
+import random
+import time
+from argparse import ArgumentParser
+from functools import partial
+
+from wialonblock.config import TelegramGroup
+from wialonblock.metrics import WIALON_HEDGED, WIALON_BREAKER_REJECTED
+from wialonblock.resilience import BreakerState, CircuitOpenError
+from wialonblock.worker import WialonWorker, WialonSession
+
+from wialon_stub import WialonStub, Fleet, bench_groups, percentile, CHAT_ID
+
+
+class TroubleStub(WialonStub):
+    """Stub answering `tail` of the requests after `tail_latency` seconds, or never while `hanging`"""
+
+    def __init__(self, *args, tail: float = 0.0, tail_latency: float = 0.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tail = tail
+        self.tail_latency = tail_latency
+        self.hanging = False
+
+    async def _delay(self):
+        await super()._delay()
+        if self.hanging:
+            await asyncio.sleep(3600)
+        if random.random() < self.tail:
+            await asyncio.sleep(self.tail_latency)
+
+
+def make_worker(port: int) -> WialonWorker:
+    group = TelegramGroup(**bench_groups())
+    return WialonWorker(
+        "127.0.0.1", "token", {group.chat_id: group},
+        session=partial(WialonSession, scheme="http", port=port, rps=10_000),
+    )
+
+
+async def timed(coroutine):
+    start = time.perf_counter()
+    try:
+        result = await coroutine
+    except Exception as e:
+        result = e
+    return time.perf_counter() - start, result
+
+
+async def tail(fleet: Fleet, reads: int, latency: float, tail_ratio: float, tail_latency: float):
+    uids = list(fleet.units)
+    for hedging in (False, True):
+        random.seed(1)
+        async with TroubleStub(fleet, latency=latency, tail=tail_ratio, tail_latency=tail_latency) as stub:
+            worker = make_worker(stub.port)
+            if not hedging:
+                worker._calls.hedge_delay = lambda method: None
+            try:
+                hedged = WIALON_HEDGED.value(worker._calls.host, "core_search_item")
+                samples = []
+                for uid in random.sample(uids, reads):
+                    # the names are not indexed, every read is a `core/search_item`
+                    elapsed, _ = await timed(worker.get_unit_and_lock_state(CHAT_ID, uid))
+                    samples.append(elapsed)
+                hedged = WIALON_HEDGED.value(worker._calls.host, "core_search_item") - hedged
+            finally:
+                await worker.close()
+        print(f"tail, hedging {'on ' if hedging else 'off'}: p50 {percentile(samples, 50) * 1000:.1f} ms, "
+              f"p95 {percentile(samples, 95) * 1000:.1f} ms, p99 {percentile(samples, 99) * 1000:.1f} ms, "
+              f"max {max(samples) * 1000:.1f} ms, hedged {hedged:.0f}")
+
+
+async def trouble(fleet: Fleet, latency: float):
+    stub = await TroubleStub(fleet, latency=latency).start()
+    port = stub.port
+    worker = make_worker(port)
+    breaker = worker._calls.breaker
+    breaker.reset_timeout = 1
+    worker._calls.read_deadline = 1
+    try:
+        elapsed, units = await timed(worker.list_by_tg_group_id(CHAT_ID))
+        print(f"healthy /list: {elapsed * 1000:.1f} ms, {len(units)} units")
+
+        await stub.stop()
+        # the cached members have expired
+        worker._members.ttl = 0
+        elapsed, units = await timed(worker.list_by_tg_group_id(CHAT_ID))
+        print(f"outage /list: {elapsed * 1000:.1f} ms, {len(units)} units, "
+              f"stale: {units.stale_since is not None}, circuit {breaker.state.name}")
+        while breaker.state is BreakerState.CLOSED:
+            await timed(worker.get_unit_and_lock_state(CHAT_ID, next(iter(fleet.units))))
+        rejected = WIALON_BREAKER_REJECTED.value(worker._calls.host, "core_search_items")
+        elapsed, units = await timed(worker.list_by_tg_group_id(CHAT_ID))
+        print(f"open circuit /list: {elapsed * 1000:.1f} ms, {len(units)} units, stale: {units.stale_since is not None}, "
+              f"rejected {WIALON_BREAKER_REJECTED.value(worker._calls.host, 'core_search_items') - rejected:.0f}")
+        elapsed, error = await timed(worker.get_unit_and_lock_state(CHAT_ID, next(iter(fleet.units))))
+        print(f"open circuit unit read: {elapsed * 1000:.2f} ms, {type(error).__name__}")
+
+        stub = await TroubleStub(fleet, latency=latency, port=port).start()
+        stub.hanging = True
+        await asyncio.sleep(breaker.reset_timeout)
+        elapsed, error = await timed(worker.get_unit_and_lock_state(CHAT_ID, list(fleet.units)[1]))
+        print(f"hanging host unit read: {elapsed * 1000:.1f} ms, {type(error).__name__}, circuit {breaker.state.name}")
+
+        stub.hanging = False
+        await asyncio.sleep(breaker.reset_timeout)
+        elapsed, unit = await timed(worker.get_unit_and_lock_state(CHAT_ID, list(fleet.units)[2]))
+        assert not isinstance(unit, Exception) and not isinstance(unit, CircuitOpenError), unit
+        print(f"recovered unit read: {elapsed * 1000:.1f} ms, circuit {breaker.state.name}")
+    finally:
+        await worker.close()
+        await stub.stop()
+
+
+async def run(units: int, reads: int, latency: float, tail_ratio: float, tail_latency: float):
+    fleet = Fleet.generate(units, ignored=units // 10)
+    await tail(fleet, reads, latency, tail_ratio, tail_latency)
+    await trouble(fleet, latency)
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--units", type=int, default=2000)
+    parser.add_argument("--reads", type=int, default=400)
+    parser.add_argument("--latency", type=float, default=0.01, help="stub latency per HTTP request, seconds")
+    parser.add_argument("--tail", type=float, default=0.03, help="share of the slow responses")
+    parser.add_argument("--tail-latency", type=float, default=0.3, help="extra latency of a slow response, seconds")
+    args = parser.parse_args()
+    # the failures are expected here
+    logging.disable(logging.CRITICAL)
+    asyncio.run(run(args.units, args.reads, args.latency, args.tail, args.tail_latency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Free-text unit search: the local names index against the Wialon id-mask search
+it replaced, both over the same fleet of the local Wialon stub.
+Also checks that a rename in Wialon reaches the index through `avl_evts`.
+
+    python benchmarks/bench_search.py --units 5000 --latency 0.02
+"""
+
+import asyncio
+import time
+from argparse import ArgumentParser
+from functools import partial
+
+from aiowialon.types.flags import UnitsDataFlag
+
+from wialonblock.config import TelegramGroup
+from wialonblock.worker import WialonWorker, WialonSession
+
+from wialon_stub import WialonStub, Fleet, bench_groups, percentile, CHAT_ID
+
+PATTERNS = ("12", "unit 1003", "aa01*", "*bb unit 1004*|*bb unit 1005*", ">AA4000", "!*unit 100*")
+
+
+async def wialon_search(session: WialonSession, ids, pattern: str):
+    """What `_get_objects_by_ids` used to send for every message"""
+    if not WialonWorker.has_special_character_loop(pattern):
+        pattern = f"*{pattern}*"
+    response = await session.core_search_items(
+        spec={"itemsType": "avl_unit", "propName": "sys_id,sys_name",
+              "propValueMask": f"{'|'.join(map(str, ids))},{pattern}",
+              "sortType": "sys_name", "propType": ""},
+        force=1, flags=UnitsDataFlag.BASE, **{"from": 0, "to": 0},
+    )
+    return response.get("items", [])
+
+
+async def run(units: int, latency: float, requests: int):
+    async with WialonStub(Fleet.generate(units), latency=latency) as stub:
+        group = TelegramGroup(**bench_groups())
+        worker = WialonWorker(
+            "127.0.0.1", "token", {group.chat_id: group},
+            session=partial(WialonSession, scheme="http", port=stub.port, rps=10_000),
+            keepalive_interval=0.1,
+        )
+        try:
+            await worker.list_by_tg_group_id(CHAT_ID)
+            session = await worker._sessions.open()
+            uids = list(stub.fleet.units)
+            uids_set = set(uids)
+
+            for pattern in PATTERNS:
+                local = [unit.id for unit in await worker.list_by_tg_group_id(CHAT_ID, pattern)]
+                remote_samples, local_samples = [], []
+                for _ in range(requests):
+                    start = time.perf_counter()
+                    remote = await wialon_search(session, uids, pattern)
+                    remote_samples.append(time.perf_counter() - start)
+                    start = time.perf_counter()
+                    worker._names.search(pattern, uids_set)
+                    local_samples.append(time.perf_counter() - start)
+                print(f"{pattern!r:28} found: {len(local):5} "
+                      f"wialon p50: {percentile(remote_samples, 50) * 1000:7.2f} ms, "
+                      f"index p50: {percentile(local_samples, 50) * 1e6:8.1f} us")
+                # the stub sorts case-sensitively, compare the sets
+                if set(local) != {item["id"] for item in remote}:
+                    raise SystemExit(f"results differ for {pattern!r}")
+
+            uid = uids[0]
+            stub.rename_unit(uid, "Renamed bench unit")
+            for _ in range(50):
+                await asyncio.sleep(0.1)
+                if [unit.id for unit in await worker.list_by_tg_group_id(CHAT_ID, "renamed")] == [uid]:
+                    print("rename delivered by avl_evts")
+                    break
+            else:
+                raise SystemExit("rename was not delivered")
+        finally:
+            await worker.close()
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--units", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--requests", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.units, args.latency, args.requests))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+First `/list` after a restart: cold, warm from the local fleet snapshot and warm with Wialon unreachable,
+against the local Wialon stub.
+
+    python benchmarks/bench_warm_start.py --units 5000 --latency 0.05
+"""
+
+import asyncio
+import logging
+import tempfile
+import time
+from argparse import ArgumentParser
+from functools import partial
+from pathlib import Path
+
+from wialonblock.config import TelegramGroup
+from wialonblock.snapshot import SnapshotStore
+from wialonblock.worker import WialonWorker, WialonSession
+
+from wialon_stub import WialonStub, Fleet, bench_groups, CHAT_ID
+
+
+def make_worker(port: int, store: SnapshotStore) -> WialonWorker:
+    group = TelegramGroup(**bench_groups())
+    return WialonWorker(
+        "127.0.0.1", "token", {group.chat_id: group},
+        session=partial(WialonSession, scheme="http", port=port, rps=10_000),
+        snapshot=store,
+    )
+
+
+async def first_list(worker: WialonWorker, label: str):
+    start = time.perf_counter()
+    await worker.warm_start()
+    worker.prewarm()
+    objects = await worker.list_by_tg_group_id(CHAT_ID)
+    elapsed = time.perf_counter() - start
+    stale = "from snapshot" if objects.stale_since is not None else "from Wialon"
+    print(f"{label}: {elapsed * 1000:.2f} ms, {len(objects)} units {stale}")
+    return objects
+
+
+async def run(units: int, latency: float):
+    with tempfile.TemporaryDirectory() as directory:
+        store = SnapshotStore(Path(directory) / "snapshot.sqlite3")
+        async with WialonStub(Fleet.generate(units, ignored=units // 10), latency=latency) as stub:
+            worker = make_worker(stub.port, store)
+            try:
+                cold = await first_list(worker, "cold start")
+            finally:
+                # saves the snapshot
+                await worker.close()
+
+            worker = make_worker(stub.port, store)
+            try:
+                warm = await first_list(worker, "warm start")
+                assert [(u.id, u.name, u.lock) for u in warm] == [(u.id, u.name, u.lock) for u in cold]
+                while worker._stale is not None:
+                    await asyncio.sleep(0.01)
+                start = time.perf_counter()
+                objects = await worker.list_by_tg_group_id(CHAT_ID)
+                print(f"after refresh: {(time.perf_counter() - start) * 1000:.2f} ms, {len(objects)} units, "
+                      f"stale: {objects.stale_since is not None}")
+            finally:
+                await worker.close()
+            port = stub.port
+
+        # the stub is stopped, nothing listens on its port
+        worker = make_worker(port, store)
+        try:
+            await first_list(worker, "Wialon unreachable")
+        finally:
+            await worker.close()
+
+
+def main():
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--units", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.05, help="stub latency per HTTP request, seconds")
+    args = parser.parse_args()
+    # the prefetch retries against the stopped stub are logged as errors
+    logging.disable(logging.CRITICAL)
+    asyncio.run(run(args.units, args.latency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Fake aiogram session for benchmarks: records the outgoing Bot API calls
+instead of sending them and answers with plausible results, plus helpers
+building the raw updates the harness feeds to the dispatcher.
+"""
+
+import asyncio
+import itertools
+import time
+from collections import Counter, deque
+from typing import Any, AsyncGenerator, Deque, Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import Message
+
+BENCH_USERNAME = "bench_user"
+
+
+class FakeTelegramSession(BaseSession):
+    """
+    Answers every method locally after `latency` seconds: `True` for the boolean ones,
+    a `Message` for the ones sending or editing a message. The last `keep` methods are
+    kept in `sent` for inspection.
+    """
+
+    def __init__(self, latency: float = 0.0, keep: int = 1000):
+        super().__init__()
+        self.latency = latency
+        self.calls = Counter()
+        self.sent: Deque[TelegramMethod] = deque(maxlen=keep)
+        self._message_ids = itertools.count(1_000_000)
+
+    def reset_counters(self):
+        self.calls.clear()
+        self.sent.clear()
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None) -> Any:
+        self.calls[method.__api_method__] += 1
+        self.sent.append(method)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method.__returning__ is bool:
+            return True
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            # inline message edits
+            return True
+        return Message.model_validate({
+            "message_id": getattr(method, "message_id", None) or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "supergroup", "title": "Bench"},
+            "from": {"id": bot.id, "is_bot": True, "first_name": "Bench bot"},
+            "text": getattr(method, "text", None),
+            "reply_markup": getattr(method, "reply_markup", None),
+        }, context={"bot": bot})
+
+    async def stream_content(self, url: str, headers: Optional[Dict[str, Any]] = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True) -> AsyncGenerator[bytes, None]:
+        raise NotImplementedError
+        yield b""
+
+    async def close(self):
+        pass
+
+    def last_markup(self, api_method: str = "sendMessage"):
+        """Reply markup of the last recorded call of the method"""
+        for method in reversed(self.sent):
+            if method.__api_method__ == api_method and getattr(method, "reply_markup", None) is not None:
+                return method.reply_markup
+        return None
+
+
+class UpdateFactory:
+    """Raw updates of a chat, as Telegram sends them"""
+
+    def __init__(self, chat_id: int, bot_id: int):
+        self.chat_id = chat_id
+        self.bot_id = bot_id
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _chat(self) -> Dict[str, Any]:
+        return {"id": self.chat_id, "type": "supergroup", "title": "Bench"}
+
+    @staticmethod
+    def _user(user_id: int) -> Dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": "Bench", "username": BENCH_USERNAME}
+
+    def message(self, text: str, user_id: int = 1) -> Dict[str, Any]:
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": self._chat(),
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def callback(self, data: str, message_id: Optional[int] = None, user_id: int = 1) -> Dict[str, Any]:
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._update_ids)),
+                "from": self._user(user_id),
+                "chat_instance": "bench",
+                "data": data,
+                "message": {
+                    "message_id": message_id or next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": self._chat(),
+                    "from": {"id": self.bot_id, "is_bot": True, "first_name": "Bench bot",
+                             "username": BENCH_USERNAME},
+                    "text": "bench",
+                },
+            },
+        }
+
+
+def callback_data_of(markup) -> List[str]:
+    """Callback data of all the buttons of an inline keyboard"""
+    if markup is None:
+        return []
+    return [button.callback_data for row in markup.inline_keyboard for button in row if button.callback_data]
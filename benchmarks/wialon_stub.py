@@ -0,0 +1,304 @@
+"""
+Local stub of the Wialon Remote API for benchmarks.
+
+Implements just the part of the API that wialonblock uses:
+`token/login`, `core/logout`, `core/search_items`, `core/search_item`,
+`unit_group/update_units`, `core/update_data_flags`, `core/batch` and `avl_evts`,
+with configurable per-request latency and fleet size.
+"""
+
+import asyncio
+import json
+import operator
+import re
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+LOCKED_GROUP = "Autoblock_Bench_ON"
+UNLOCKED_GROUP = "Autoblock_Bench_OFF"
+IGNORED_GROUP = "Autoblock_Bench_IGNORED"
+CHAT_ID = "-1000000000001"
+
+
+class Mask:
+    """
+    Wialon `propValueMask` matcher: `*` wildcard, `|` alternatives,
+    `>`, `<`, `>=`, `<=`, `=` comparisons and `!` negation, case-insensitive
+    """
+
+    OPERATORS = {">=": operator.ge, "<=": operator.le, ">": operator.gt, "<": operator.lt, "=": operator.eq}
+
+    def __init__(self, mask: str):
+        alternatives = mask.split("|")
+        plain = [alt for alt in alternatives if not alt or alt[0] not in "!<>="]
+        self.exact = {alt.casefold() for alt in plain if "*" not in alt}
+        wildcards = [".*".join(re.escape(part) for part in alt.split("*")) for alt in plain if "*" in alt]
+        self.regex = re.compile("|".join(wildcards), re.IGNORECASE | re.DOTALL) if wildcards else None
+        self.others = [alt for alt in alternatives if alt and alt[0] in "!<>="]
+
+    @staticmethod
+    def _key(value: str):
+        try:
+            return 0, float(value)
+        except ValueError:
+            return 1, value.casefold()
+
+    def _match_other(self, alt: str, value: str) -> bool:
+        if alt.startswith("!"):
+            return not Mask(alt[1:]).match(value)
+        op = ">=" if alt.startswith(">=") else "<=" if alt.startswith("<=") else alt[0]
+        return self.OPERATORS[op](self._key(value), self._key(alt[len(op):]))
+
+    def match(self, value: str) -> bool:
+        if value.casefold() in self.exact:
+            return True
+        if self.regex is not None and self.regex.fullmatch(value) is not None:
+            return True
+        return any(self._match_other(alt, value) for alt in self.others)
+
+
+BILLING_PROPS = 0x4
+
+
+def json_response(data) -> web.Response:
+    # aiowialon warns on anything but the bare content type
+    return web.Response(body=json.dumps(data).encode(), headers={"Content-Type": "application/json"})
+
+
+@dataclass
+class Fleet:
+    units: Dict[int, str] = field(default_factory=dict)
+    groups: Dict[int, Dict] = field(default_factory=dict)
+
+    @classmethod
+    def generate(cls, size: int = 1000, ignored: int = 0) -> "Fleet":
+        """
+        Creates `size` units, the first half locked, the rest unlocked,
+        and the last `ignored` of them also in the ignored group
+        """
+        fleet = cls()
+        uids = list(range(100_000, 100_000 + size))
+        fleet.units = {uid: f"AA{uid % 10_000:04d}BB unit {uid}" for uid in uids}
+        half = size // 2
+        fleet.groups = {
+            1: {"id": 1, "nm": LOCKED_GROUP, "u": uids[:half]},
+            2: {"id": 2, "nm": UNLOCKED_GROUP, "u": uids[half:]},
+            3: {"id": 3, "nm": IGNORED_GROUP, "u": uids[size - ignored:] if ignored else []},
+        }
+        return fleet
+
+    def group_by_name(self, name: str) -> Optional[Dict]:
+        for group in self.groups.values():
+            if group["nm"] == name:
+                return group
+        return None
+
+
+class WialonStub:
+    """aiohttp server, counts HTTP round trips and called services"""
+
+    def __init__(self, fleet: Fleet, latency: float = 0.0, host: str = "127.0.0.1", port: int = 0):
+        self.fleet = fleet
+        self.latency = latency
+        self.host = host
+        self.port = port
+        # sid -> subscribed item ids and pending events
+        self.sessions: Dict[str, set] = {}
+        self.events: Dict[str, List[Dict]] = {}
+        self.round_trips = 0
+        self.calls = Counter()
+        self._runner: Optional[web.AppRunner] = None
+
+    def reset_counters(self):
+        self.round_trips = 0
+        self.calls.clear()
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/wialon/ajax.html", self._ajax)
+        app.router.add_route("*", "/avl_evts", self._avl_evts)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def _delay(self):
+        self.round_trips += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def _avl_evts(self, request: web.Request):
+        await self._delay()
+        self.calls["avl_evts"] += 1
+        sid = request.query.get("sid") or (await request.post()).get("sid")
+        if sid not in self.sessions:
+            return json_response({"error": 1})
+        events, self.events[sid] = self.events[sid], []
+        return json_response({"tm": int(time.time()), "events": events})
+
+    async def _ajax(self, request: web.Request):
+        await self._delay()
+        form = await request.post()
+        svc = form["svc"]
+        params = json.loads(form.get("params") or "{}")
+        sid = form.get("sid")
+        if svc != "token/login" and sid not in self.sessions:
+            return json_response({"error": 1})
+        return json_response(self.dispatch(svc, params, sid))
+
+    def expire_sessions(self):
+        self.sessions.clear()
+        self.events.clear()
+
+    def dispatch(self, svc: str, params: Dict, sid: Optional[str] = None):
+        self.calls[svc] += 1
+        handler = getattr(self, "svc_" + svc.replace("/", "_"), None)
+        if handler is None:
+            return {"error": 2}
+        return handler(params, sid)
+
+    def _notify(self, item_id: int, data: Dict):
+        for sid, subscribed in self.sessions.items():
+            if item_id in subscribed:
+                self.events[sid].append({"i": item_id, "t": "u", "d": data})
+
+    def svc_token_login(self, params, sid):
+        sid = uuid.uuid4().hex
+        self.sessions[sid] = set()
+        self.events[sid] = []
+        return {"eid": sid, "user": {"nm": "bench"}}
+
+    def svc_core_logout(self, params, sid):
+        self.sessions.pop(sid, None)
+        self.events.pop(sid, None)
+        return {"error": 0}
+
+    def svc_core_update_data_flags(self, params, sid):
+        result = []
+        for spec in params.get("spec", []):
+            ids = spec["data"] if spec["type"] == "col" else [spec["data"]]
+            for item_id in map(int, ids):
+                if spec.get("mode") == 2:
+                    self.sessions[sid].discard(item_id)
+                else:
+                    self.sessions[sid].add(item_id)
+                    result.append({"i": item_id, "d": self.svc_core_search_item({"id": item_id}, sid).get("item")})
+        return result
+
+    def svc_core_batch(self, params, sid):
+        results = []
+        for call in params.get("params", []):
+            result = self.dispatch(call["svc"], call.get("params", {}), sid)
+            results.append(result)
+            if params.get("flags") == 1 and isinstance(result, dict) and result.get("error"):
+                break
+        return results
+
+    @staticmethod
+    def _billing_props(item: Dict, flags: int) -> Dict:
+        # roughly what the billing properties flag adds to an item
+        if flags & BILLING_PROPS:
+            item.update({"ct": 1_600_000_000 + item["id"], "ftp": {"ch": 0, "tp": 0, "fl": 0},
+                         "bact": 1000, "crt": 1001, "hw": 9, "uid": f"86{item['id']:013d}"})
+        return item
+
+    def _unit(self, uid, flags: int = 1):
+        return self._billing_props({"nm": self.fleet.units[uid], "cls": 2, "id": uid, "mu": 0, "uacl": -1}, flags)
+
+    def _group(self, group, flags: int = 1):
+        return self._billing_props(
+            {"nm": group["nm"], "cls": 5, "id": group["id"], "u": list(group["u"]), "uacl": -1}, flags
+        )
+
+    def svc_core_search_items(self, params, sid):
+        spec = params["spec"]
+        prop_names = spec["propName"].split(",")
+        masks = spec["propValueMask"].split(",")
+        matchers = [(prop, Mask(mask)) for prop, mask in zip(prop_names, masks)]
+
+        if spec["itemsType"] == "avl_unit_group":
+            candidates = [self._group(g, params.get("flags", 1)) for g in self.fleet.groups.values()]
+        else:
+            candidates = [self._unit(uid, params.get("flags", 1)) for uid in self.fleet.units]
+
+        def matches(item):
+            for prop, mask in matchers:
+                value = str(item["id"]) if prop == "sys_id" else item["nm"]
+                if not mask.match(value):
+                    return False
+            return True
+
+        items = sorted((i for i in candidates if matches(i)), key=lambda i: i["nm"])
+        return {
+            "searchSpec": spec,
+            "dataFlags": params.get("flags", 1),
+            "totalItemsCount": len(items),
+            "indexFrom": 0,
+            "indexTo": len(items),
+            "items": items,
+        }
+
+    def svc_core_search_item(self, params, sid):
+        uid = int(params["id"])
+        if uid in self.fleet.units:
+            return {"item": self._unit(uid, params.get("flags", 1)), "flags": params.get("flags", 1)}
+        if uid in self.fleet.groups:
+            return {"item": self._group(self.fleet.groups[uid], params.get("flags", 1)), "flags": params.get("flags", 1)}
+        return {"error": 7}
+
+    def svc_unit_group_update_units(self, params, sid):
+        group = self.fleet.groups.get(int(params["itemId"]))
+        if group is None:
+            return {"error": 7}
+        group["u"] = [int(uid) for uid in params["units"]]
+        self._notify(group["id"], {"u": list(group["u"])})
+        return {"u": list(group["u"])}
+
+    def move_units(self, uids, from_group: str, to_group: str):
+        """Changes membership behind the bot's back, like a Wialon operator would"""
+        source, target = self.fleet.group_by_name(from_group), self.fleet.group_by_name(to_group)
+        source["u"] = [uid for uid in source["u"] if uid not in uids]
+        target["u"] = target["u"] + [uid for uid in uids if uid not in target["u"]]
+        self._notify(source["id"], {"u": list(source["u"])})
+        self._notify(target["id"], {"u": list(target["u"])})
+
+    def rename_unit(self, uid: int, name: str):
+        self.fleet.units[uid] = name
+        self._notify(uid, {"nm": name})
+
+
+def bench_groups() -> Dict:
+    """`TelegramGroup` kwargs for the benchmark chat"""
+    return dict(
+        tag="bench",
+        chat_name="Bench",
+        chat_id=CHAT_ID,
+        wln_group_locked=LOCKED_GROUP,
+        wln_group_unlocked=UNLOCKED_GROUP,
+        wln_group_ignored=IGNORED_GROUP,
+    )
+
+
+def percentile(samples: List[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
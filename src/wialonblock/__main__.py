@@ -1,3 +1,6 @@
+# first, the startup time is measured from its import
+from wialonblock.startup import STARTUP
+
 import asyncio
 import logging
 import sys
@@ -5,8 +8,12 @@ from argparse import ArgumentParser
 from pathlib import Path
 
 from wialonblock.bot import run_bot
-from wialonblock.config import DEFAULT_CONFIG_PATH
+from wialonblock.config import DEFAULT_CONFIG_PATH, load_config
+from wialonblock.logs import setup_logging
+
+STARTUP.mark("imports")
 
+# until the configured logging is set up
 logging.basicConfig(level=logging.INFO, stream=sys.stdout, encoding="utf-8")
 
 
@@ -18,8 +25,23 @@ async def run():
     parser.add_argument("config", type=Path, action="store", nargs='?',
                         help="Path to the TOML configuration file for WialonBlock bot.",
                         metavar="FILE_PATH", default=DEFAULT_CONFIG_PATH)
+    parser.add_argument("-w", "--workers", type=int, default=None,
+                        help="Number of worker processes, overrides `sharding.workers` of the config.")
     args = parser.parse_args()
-    await run_bot(config_path=args.config)
+    config = load_config(args.config)
+    listener = setup_logging(config.logging)
+    STARTUP.mark("config")
+    try:
+        workers = args.workers or config.sharding.workers
+        if workers > 1:
+            # imported here, the single process mode doesn't need multiprocessing
+            from wialonblock.shards import run_supervisor
+            await run_supervisor(config_path=args.config, workers=workers)
+        else:
+            await run_bot(config_path=args.config)
+    finally:
+        # writes out the queued records
+        listener.stop()
 
 
 def main():
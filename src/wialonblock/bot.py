@@ -1,10 +1,9 @@
 import asyncio
 import logging
+import signal
 import sys
-import uuid
-from datetime import datetime
 from pathlib import Path
-from typing import Any, Optional
+from typing import Any, Optional, List, Dict
 
 from aiogram import Bot, Dispatcher
 from aiogram import F
@@ -12,26 +11,40 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.client.session.base import BaseSession
 from aiogram.enums import ContentType
 from aiogram.exceptions import TelegramBadRequest
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.types import Message, BotCommand, CallbackQuery, InlineQuery
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 from aiowialon import WialonError
 
 from wialonblock import keyboards as kb
-from wialonblock.config import Config, DEFAULT_CONFIG_PATH, load_config
-from wialonblock.keyboards import PagesAction
-from wialonblock.util import escape_markdown_v2
-from wialonblock.worker import WialonWorker, ObjState
+from wialonblock.cache import PagesCache
+from wialonblock.config import Config, DEFAULT_CONFIG_PATH, load_config, WebhookConfig, TelegramGroup, MetricsConfig
+from wialonblock.expiry import ExpiryScheduler, ExpiryAction, Expiry
+from wialonblock.keyboards import PagesAction, BulkAction
+from wialonblock.logs import CorrelationMiddleware, correlation_id, new_correlation_id, sample
+from wialonblock.metrics import HandlerMetricsMiddleware, record_handler_error, start_metrics_server
+from wialonblock.middlewares import InFlightLimitMiddleware, FloodControlMiddleware
+from wialonblock.render import Renderer, Template
+from wialonblock.resilience import CircuitOpenError
+from wialonblock.snapshot import SnapshotStore
+from wialonblock.startup import STARTUP, FirstUpdatesMiddleware
+from wialonblock.worker import WialonWorker, WialonWorkerRegistry, ObjState, Unit
 
 dp = Dispatcher()
 OUTDATED_MESSAGE_TIMEOUT = 600
 DELETE_MESSAGE_TIMEOUT = 86400
+# Only every n-th unknown callback is logged, stale buttons of old messages are pressed a lot
+UNKNOWN_CALL_LOG_SAMPLING = 20
 
-UNIT_MESSAGE_FORMAT = """*{name}*
+UNIT_MESSAGE_FORMAT = Template("""*{name}*
 
 *Стан*: {lock}: {state}
 *Оновлено*: {datetime}
 *Користувач*: @{user}
-"""
+""")
+
+UNKNOWN_UNIT_NAME = "Невідомий об'єкт"
 
 STATE_STRING_MAP = {
     ObjState.LOCKED: "Виїзд заборонено",
@@ -39,58 +52,102 @@ STATE_STRING_MAP = {
     ObjState.UNKNOWN: "Невідомо"
 }
 
-LIST_RESULT_MESSAGE_FORMAT = """
+LIST_RESULT_MESSAGE_FORMAT = Template("""
 *Результат пошуку:*
 
 *Останнє оновлення*: {datetime}
 *Користувач*: @{user}
-"""
+""")
 
-PAGES_RESULT_MESSAGE_FORMAT = """
+PAGES_RESULT_MESSAGE_FORMAT = Template("""
 *Пошуковий запит:* `{pattern}`
 *Результат пошуку:*
 
 *Всього*: {total}
 *Відображено*: {start} \\- {end}
-
+{stale}
 *Останнє оновлення*: {datetime}
 *Користувач*: @{user}
-"""
+""")
 
-SEARCH_RESULT_MESSAGE_FORMAT = """
+STALE_RESULT_FORMAT = Template("""⚠️ *Дані з локальної копії від*: {datetime}
+_Wialon ще не відповів, стан може бути неактуальним_
+""")
+
+SEARCH_RESULT_MESSAGE_FORMAT = Template("""
 *Пошуковий запит:* `{pattern}`
 *Результат пошуку:*
 
 *Останнє оновлення*: {datetime}
 *Користувач*: @{user}
-"""
+""")
+
+BULK_CONFIRM_MESSAGE_FORMAT = Template("""
+*Пошуковий запит:* `{pattern}`
+*{action}*: {total} об'єктів
+
+Підтвердіть дію
+""")
+
+BULK_RESULT_MESSAGE_FORMAT = Template("""
+*Пошуковий запит:* `{pattern}`
+*{state}*: {done} з {total}
+{failed}
+*Оновлено*: {datetime}
+*Користувач*: @{user}
+""")
+
+BULK_FAILED_FORMAT = Template("""*Не вдалося*: {names}
+""")
+
+BULK_USAGE_MESSAGE = Template("""
+Вкажіть пошуковий запит, наприклад: `/{command} AA*`
+""")
+
+BULK_NOTHING_MESSAGE = Template("""
+*🤷‍♂️ Немає об'єктів, стан яких потрібно змінити*
+""")
 
-ERROR_ANSWER_FORMAT = """
+BULK_OUTDATED_ANSWER = "Запит застарів, повторіть команду"
+PAGES_OUTDATED_ANSWER = "Запит застарів, повторіть пошук"
+
+OUTDATED_MESSAGE_FORMAT = Template("*Повідомлення застаріло:* {datetime}")
+
+ERROR_ANSWER_FORMAT = Template("""
 Сталась помилка, зверніться до адміністратора групи
 ID помилки: `{uuid}`
-"""
-ERROR_LOG_MSG_FORMAT = """
-{uuid}: {msg}
-"""
+""")
+ERROR_LOG_MSG_FORMAT = "%s: %s"
+
+WIALON_UNAVAILABLE_MESSAGE = Template("""
+*Wialon тимчасово недоступний*, спробуйте пізніше
+""")
 
-NO_OBJECTS_MESSAGE = """
+NO_OBJECTS_MESSAGE = Template("""
 *🤷‍♂️ Об'єкти за вашим запитом не знайдені*
 
 _Якщо ви впевнені що це помилка, зверніться до адміністратора групи_
-"""
+""")
 
 
 class WialonBlockBot(Bot):
     def __init__(
             self,
             token: str,
-            wialon_worker: WialonWorker = None,
+            wialon_worker: WialonWorkerRegistry = None,
             session: Optional[BaseSession] = None,
             default: Optional[DefaultBotProperties] = None,
+            pages_cache: Optional[PagesCache] = None,
+            expiry: Optional[ExpiryScheduler] = None,
+            render: Optional[Renderer] = None,
             **kwargs: Any,
     ) -> None:
         super().__init__(token, session, default, **kwargs)
         self.wialon_worker = wialon_worker
+        # the templates and the escaping follow the parse mode of `tg.bot_props`
+        self.render = render if render is not None else Renderer(default.parse_mode if default else None)
+        self.pages_cache = pages_cache if pages_cache is not None else PagesCache()
+        self.expiry = expiry if expiry is not None else ExpiryScheduler()
 
 
 class WialonBlockMessage(Message):
@@ -121,23 +178,62 @@ async def kill_switch(message: WialonBlockMessage):
         sys.exit(0)
 
 
-async def outdated_message(message: WialonBlockMessage):
-    try:
-        await asyncio.sleep(OUTDATED_MESSAGE_TIMEOUT)
-        await message.edit_text(
-            "*Повідомлення застаріло:* %s" % datetime.now().strftime("%d.%m.%Y %H:%M:%S"),
-            reply_markup=kb.refresh()
-        )
-    except TelegramBadRequest as e:
-        logging.error(e)
+def stale_note(render: Renderer, objects: List[Unit]) -> str:
+    """Warning line of a listing served from the local snapshot, empty for the fresh one"""
+    stale_since = getattr(objects, "stale_since", None)
+    if stale_since is None:
+        return ""
+    return render(STALE_RESULT_FORMAT, datetime=render.timestamp(stale_since))
 
 
-async def delete_message(message: WialonBlockMessage):
-    try:
-        await asyncio.sleep(DELETE_MESSAGE_TIMEOUT)
-        await message.delete()
-    except TelegramBadRequest as e:
-        logging.exception(e)
+def outdated_message(message: WialonBlockMessage):
+    message.bot.expiry.schedule(
+        message.chat.id, message.message_id, OUTDATED_MESSAGE_TIMEOUT, ExpiryAction.OUTDATE
+    )
+
+
+def delete_message(message: WialonBlockMessage):
+    message.bot.expiry.schedule(
+        message.chat.id, message.message_id, DELETE_MESSAGE_TIMEOUT, ExpiryAction.DELETE
+    )
+
+
+async def expire_messages(bot: WialonBlockBot, expired: List[Expiry]):
+    """
+    Handles the due expiries in a batch, deletions of a chat go with a single request
+    """
+    deletions: Dict[int, List[int]] = {}
+    calls = []
+    for expiry in expired:
+        if expiry.action == ExpiryAction.DELETE:
+            deletions.setdefault(expiry.chat_id, []).append(expiry.message_id)
+        else:
+            calls.append(bot.edit_message_text(
+                bot.render(OUTDATED_MESSAGE_FORMAT, datetime=bot.render.now()),
+                chat_id=expiry.chat_id,
+                message_id=expiry.message_id,
+                reply_markup=kb.refresh()
+            ))
+    for chat_id, message_ids in deletions.items():
+        # up to 100 messages per request
+        for i in range(0, len(message_ids), 100):
+            calls.append(bot.delete_messages(chat_id, message_ids[i:i + 100]))
+
+    for result in await asyncio.gather(*calls, return_exceptions=True):
+        if isinstance(result, TelegramBadRequest):
+            logging.error(result)
+        elif isinstance(result, Exception):
+            logging.exception(result)
+
+
+async def start_expiry_scheduler(bot: WialonBlockBot):
+    bot.expiry.start(lambda expired: expire_messages(bot, expired))
+    logging.info("Message expiry scheduler started, pending: %d", len(bot.expiry))
+
+
+async def stop_expiry_scheduler(bot: WialonBlockBot):
+    await bot.expiry.stop()
+    logging.info("Message expiry scheduler stopped, pending: %d", len(bot.expiry))
 
 
 async def set_default_commands(bot: Bot):
@@ -148,30 +244,66 @@ async def set_default_commands(bot: Bot):
     commands = [
         # BotCommand(command="start", description="Start the bot"),
         BotCommand(command="list", description="Відобразити список трекерів"),
+        BotCommand(command="lock_all", description="Заборонити виїзд об'єктам за запитом"),
+        BotCommand(command="unlock_all", description="Дозволити виїзд об'єктам за запитом"),
         # BotCommand(command="get_group_id", description="Отримати ID групи"),
     ]
     await bot.set_my_commands(commands)
     logging.info("Default commands set.")
 
 
+def record_prewarm(prewarm: asyncio.Future):
+    if prewarm.cancelled():
+        return
+    if (error := prewarm.exception()) is not None:
+        logging.error("Wialon prefetch failed: %s", error)
+        return
+    logging.info("Wialon chats prefetched.")
+    timings = prewarm.result()
+    # the workers log in and prefetch side by side, the slowest one is waited for
+    STARTUP.record("wialon login", max((login for login, _ in timings), default=0))
+    STARTUP.record("prefetch", max((prefetch for _, prefetch in timings), default=0))
+
+
+async def prewarm_wialon_worker(bot: WialonBlockBot):
+    """
+    Logs in to Wialon and loads the groups and the units of every chat in the background,
+    so the first user of a chat doesn't wait for them, the updates are received meanwhile.
+    """
+    bot.wialon_worker.prewarm().add_done_callback(record_prewarm)
+
+
+async def close_wialon_worker(bot: WialonBlockBot):
+    """
+    Closes the long-lived Wialon sessions on dispatcher shutdown.
+    """
+    await bot.wialon_worker.close()
+    logging.info("Wialon worker closed.")
+
+
 async def on_message_error(message: WialonBlockMessage, exception: Exception):
-    error_uuid = uuid.uuid4()
-    await message.answer(ERROR_ANSWER_FORMAT.format(uuid=error_uuid))
-    logging.error(ERROR_LOG_MSG_FORMAT.format(
-        uuid=error_uuid,
-        msg=str(exception)
-    ))
+    # the handlers catch everything, the middleware never sees these
+    record_handler_error()
+    if isinstance(exception, CircuitOpenError):
+        # not a bug, the breaker has rejected the call without waiting for the host
+        await message.answer(message.bot.render(WIALON_UNAVAILABLE_MESSAGE))
+        logging.warning("Message `%s` not served: %s", message.text, exception)
+        return
+    # the correlation id of the update, so the error id finds all of its log records
+    error_uuid = correlation_id.get() or new_correlation_id()
+    await message.answer(message.bot.render(ERROR_ANSWER_FORMAT, uuid=error_uuid))
+    logging.error(ERROR_LOG_MSG_FORMAT, error_uuid, exception)
     if isinstance(exception, WialonError):
         logging.error(exception.reason)
         logging.exception(exception)
     else:
         logging.exception(exception)
-    logging.error("MSG: {}".format(message))
+    logging.error("MSG: %s", message)
 
 
 async def on_call_error(call: WialonBlockCallbackQuery, exception: Exception):
     await on_message_error(call.message, exception)
-    logging.error("CALL: {}".format(call))
+    logging.error("CALL: %s", call)
     await call.answer()
 
 
@@ -215,40 +347,39 @@ async def command_get_group_id_handler(message: WialonBlockMessage) -> None:
 
 async def command_pages_handler(message: WialonBlockMessage) -> None:
     try:
-        logging.info("Received command: `%s`, from chat `%s`" % (message.text, message.chat.id))
+        logging.info("Received command: `%s`, from chat `%s`", message.text, message.chat.id)
         pattern = "*"
         objects = await message.bot.wialon_worker.list_by_tg_group_id(
             message.chat.id, pattern
         )
         if not objects:
-            logging.error("No objects found for `%s`" % message.text)
-            await message.answer(NO_OBJECTS_MESSAGE)
+            logging.error("No objects found for `%s`", message.text)
+            await message.answer(message.bot.render(NO_OBJECTS_MESSAGE))
             return
 
-        # Escape the dynamic parts before formatting
-        current_datetime_str = escape_markdown_v2(datetime.now().strftime("%d.%m.%Y %H:%M:%S"))
-        username_escaped = escape_markdown_v2(message.from_user.username)
-
+        render = message.bot.render
+        key = message.bot.pages_cache.store(message.chat.id, pattern, objects)
         callback_data = kb.PagesCallback(
-            start=0, end=kb.ITEMS_PER_PAGE, pattern=pattern, action=PagesAction.REFRESH
+            start=0, end=kb.ITEMS_PER_PAGE, action=PagesAction.REFRESH, key=key
         )
-        await message.answer(
-            PAGES_RESULT_MESSAGE_FORMAT.format(
-                pattern=escape_markdown_v2(pattern),
+        answer = await message.answer(
+            render(
+                PAGES_RESULT_MESSAGE_FORMAT,
+                pattern=render.code(pattern),
                 total=len(objects),
                 start=callback_data.start + 1,
                 end=callback_data.end,
-                datetime=current_datetime_str,
-                user=username_escaped,
+                stale=stale_note(render, objects),
+                datetime=render.now(),
+                user=render.escape(message.from_user.username),
             ),
             reply_markup=kb.pages_result(objects, callback_data)
         )
+        outdated_message(answer)
 
     except Exception as e:
         await on_message_error(message, e)
 
-    await outdated_message(message)
-
 
 ALL_SERVICE_CONTENT_TYPES = {
     ContentType.NEW_CHAT_MEMBERS,
@@ -304,7 +435,7 @@ SKIP_ALL_SERVICE_UPDATES = ~F.content_type.in_(ALL_SERVICE_CONTENT_TYPES)
 
 async def search_avl_units(message: WialonBlockMessage):
     try:
-        logging.info("Received message: `%s`, from chat `%s`" % (message.text, message.chat.id))
+        logging.info("Received message: `%s`, from chat `%s`", message.text, message.chat.id)
 
         objects = await message.bot.wialon_worker.list_by_tg_group_id(
             message.chat.id,
@@ -312,60 +443,71 @@ async def search_avl_units(message: WialonBlockMessage):
         )
 
         if not objects:
-            logging.error("No objects found for `%s`" % message.text)
-            await message.answer(NO_OBJECTS_MESSAGE)
+            logging.error("No objects found for `%s`", message.text)
+            await message.answer(message.bot.render(NO_OBJECTS_MESSAGE))
             return
 
-        # Escape the dynamic parts before formatting
-        current_datetime_str = escape_markdown_v2(datetime.now().strftime("%d.%m.%Y %H:%M:%S"))
-        username_escaped = escape_markdown_v2(message.from_user.username)
-
+        render = message.bot.render
+        key = message.bot.pages_cache.store(message.chat.id, message.text, objects)
         callback_data = kb.PagesCallback(
-            start=0, end=kb.ITEMS_PER_PAGE, pattern=message.text, action=PagesAction.REFRESH
+            start=0, end=kb.ITEMS_PER_PAGE, action=PagesAction.REFRESH, key=key
         )
         total = len(objects)
-        await message.answer(
-            PAGES_RESULT_MESSAGE_FORMAT.format(
-                pattern=message.text,
+        answer = await message.answer(
+            render(
+                PAGES_RESULT_MESSAGE_FORMAT,
+                pattern=render.code(message.text),
                 total=total,
                 start=min(callback_data.start + 1, total),
                 end=min(callback_data.end, total),
-                datetime=current_datetime_str,
-                user=username_escaped,
+                stale=stale_note(render, objects),
+                datetime=render.now(),
+                user=render.escape(message.from_user.username),
             ),
             reply_markup=kb.pages_result(objects, callback_data)
         )
+        outdated_message(answer)
     except Exception as e:
         await on_message_error(message, e)
 
-    await outdated_message(message)
-
 
 async def pages_call_handler(call: WialonBlockCallbackQuery, callback_data: kb.PagesCallback) -> None:
     try:
-        logging.info("Received call: `%s`, from chat `%s`" % (callback_data, call.message.chat.id))
-        pattern = callback_data.pattern
-        objects = await call.message.bot.wialon_worker.list_by_tg_group_id(
-            call.message.chat.id, pattern
-        )
+        logging.info("Received call: `%s`, from chat `%s`", callback_data, call.message.chat.id)
+        pages_cache = call.message.bot.pages_cache
+        snapshot = pages_cache.lookup(callback_data.key, call.message.chat.id)
+        if snapshot is None:
+            # the pattern is kept only in the evicted snapshot
+            await call.answer(PAGES_OUTDATED_ANSWER)
+            return
+        pattern = snapshot.pattern
+        if callback_data.action != PagesAction.REFRESH:
+            # page flips go through the stored result, only refresh hits Wialon
+            objects = snapshot.items
+        else:
+            objects = await call.message.bot.wialon_worker.list_by_tg_group_id(
+                call.message.chat.id, pattern
+            )
+            if objects:
+                pages_cache.store(call.message.chat.id, pattern, objects, key=callback_data.key)
         if not objects:
-            logging.error("No objects found for `%s`" % callback_data.pattern)
-            await call.answer(NO_OBJECTS_MESSAGE)
+            logging.error("No objects found for `%s`", pattern)
+            # the alert text is not parsed
+            await call.answer(NO_OBJECTS_MESSAGE.source)
             return
 
-        # Escape the dynamic parts before formatting
-        current_datetime_str = escape_markdown_v2(datetime.now().strftime("%d.%m.%Y %H:%M:%S"))
-        username_escaped = escape_markdown_v2(call.from_user.username)
-
+        render = call.bot.render
         total = len(objects)
         await call.message.answer(
-            PAGES_RESULT_MESSAGE_FORMAT.format(
-                pattern=pattern,
+            render(
+                PAGES_RESULT_MESSAGE_FORMAT,
+                pattern=render.code(pattern),
                 total=total,
                 start=min(callback_data.start + 1, total),
                 end=min(callback_data.end, total),
-                datetime=current_datetime_str,
-                user=username_escaped,
+                stale=stale_note(render, objects),
+                datetime=render.now(),
+                user=render.escape(call.from_user.username),
             ),
             reply_markup=kb.pages_result(objects, callback_data)
         )
@@ -386,6 +528,85 @@ async def command_ignore_handler(message: WialonBlockMessage) -> None:
     pass
 
 
+async def command_bulk_handler(message: WialonBlockMessage, command: CommandObject) -> None:
+    try:
+        logging.info("Received command: `%s`, from chat `%s`", message.text, message.chat.id)
+        action = BulkAction.LOCK if command.command == "lock_all" else BulkAction.UNLOCK
+        pattern = (command.args or "").strip()
+        if not pattern:
+            await message.answer(message.bot.render(BULK_USAGE_MESSAGE, command=command.command))
+            return
+
+        objects = await message.bot.wialon_worker.list_by_tg_group_id(message.chat.id, pattern)
+        # only the units that will actually change their state
+        source_state = ObjState.UNLOCKED if action == BulkAction.LOCK else ObjState.LOCKED
+        objects = [unit for unit in objects if unit.lock == source_state]
+        if not objects:
+            await message.answer(message.bot.render(BULK_NOTHING_MESSAGE))
+            return
+
+        key = message.bot.pages_cache.store(message.chat.id, pattern, objects)
+        render = message.bot.render
+        await message.answer(
+            render(
+                BULK_CONFIRM_MESSAGE_FORMAT,
+                pattern=render.code(pattern),
+                action="Заборонити виїзд" if action == BulkAction.LOCK else "Дозволити виїзд",
+                total=len(objects),
+            ),
+            reply_markup=kb.bulk_confirm(action, key)
+        )
+    except Exception as e:
+        await on_message_error(message, e)
+
+
+async def bulk_move_call_handler(call: WialonBlockCallbackQuery, callback_data: kb.BulkMoveCallback) -> None:
+    try:
+        logging.info("Received call: `%s`, from chat `%s`", callback_data, call.message.chat.id)
+        # pop, so the double click doesn't repeat the action
+        snapshot = call.bot.pages_cache.pop(callback_data.key)
+        if snapshot is None or snapshot.chat_id != call.message.chat.id:
+            await call.answer(BULK_OUTDATED_ANSWER)
+            return
+        if callback_data.action == BulkAction.CANCEL:
+            await call.message.delete()
+            await call.answer()
+            return
+
+        uids = [unit.id for unit in snapshot.items]
+        if callback_data.action == BulkAction.LOCK:
+            errors = await call.bot.wialon_worker.lock_many(call.message.chat.id, uids)
+            state = ObjState.LOCKED
+        else:
+            errors = await call.bot.wialon_worker.unlock_many(call.message.chat.id, uids)
+            state = ObjState.UNLOCKED
+
+        failed = [unit.name for unit in snapshot.items if errors.get(unit.id) is not None]
+        for uid, error in errors.items():
+            if error is not None:
+                logging.error("Object `%s` bulk %s failed: %s", uid, callback_data.action, error)
+        logging.info("Bulk %s: %d of %d objects", callback_data.action, len(uids) - len(failed), len(uids))
+
+        render = call.bot.render
+        await call.message.edit_text(
+            render(
+                BULK_RESULT_MESSAGE_FORMAT,
+                pattern=render.code(snapshot.pattern),
+                state=STATE_STRING_MAP[state],
+                done=len(uids) - len(failed),
+                total=len(uids),
+                failed=render(
+                    BULK_FAILED_FORMAT, names=render.escape(", ".join(failed))
+                ) if failed else "",
+                datetime=render.now(),
+                user=render.escape(call.from_user.username),
+            )
+        )
+        await call.answer()
+    except Exception as e:
+        await on_call_error(call, e)
+
+
 # @dp.message(Command("lookup"))
 # async def command_lookup_handler(message: WialonBlockMessage) -> None:
 #     message_text = message.text
@@ -504,18 +725,17 @@ async def refresh_call_handler(call: WialonBlockCallbackQuery):
     try:
         objects = await call.bot.wialon_worker.list_by_tg_group_id(call.message.chat.id)
         if not objects:
-            logging.error("No objects found for call `%s`" % call.id)
-            await call.answer(NO_OBJECTS_MESSAGE)
+            logging.error("No objects found for call `%s`", call.id)
+            # the alert text is not parsed
+            await call.answer(NO_OBJECTS_MESSAGE.source)
             return
 
-        # Escape the dynamic parts before formatting
-        current_datetime_str = escape_markdown_v2(datetime.now().strftime("%d.%m.%Y %H:%M:%S"))
-        username_escaped = escape_markdown_v2(call.message.from_user.username)
-
+        render = call.bot.render
         await call.message.answer(
-            LIST_RESULT_MESSAGE_FORMAT.format(
-                datetime=current_datetime_str,
-                user=username_escaped,
+            render(
+                LIST_RESULT_MESSAGE_FORMAT,
+                datetime=render.now(),
+                user=render.escape(call.message.from_user.username),
             ),
             reply_markup=kb.search_result(objects)
         )
@@ -529,17 +749,19 @@ async def refresh_call_handler(call: WialonBlockCallbackQuery):
         await on_call_error(call, e)
 
 
-async def update_lock_state(unit, lock_state, call: WialonBlockCallbackQuery, as_answer=False):
-    u_name = unit.get('item', {}).get('nm', "Невідомий об'єкт")
-    dt = escape_markdown_v2(datetime.now().strftime("%d.%m.%Y %H:%M:%S"))
-    message_text = UNIT_MESSAGE_FORMAT.format(
-        name=escape_markdown_v2(u_name),
+async def update_lock_state(unit: Unit, call: WialonBlockCallbackQuery, as_answer=False):
+    u_name = unit.name or UNKNOWN_UNIT_NAME
+    lock_state = unit.lock
+    render = call.bot.render
+    message_text = render(
+        UNIT_MESSAGE_FORMAT,
+        name=render.escape(u_name),
         lock=lock_state,
         state=STATE_STRING_MAP.get(lock_state, ObjState.UNKNOWN),
-        user=escape_markdown_v2(call.from_user.username),
-        datetime=dt
+        user=render.escape(call.from_user.username),
+        datetime=render.now()
     )
-    u_id = unit.get('item', {}).get('id', None)
+    u_id = unit.id
 
     message = call.message
     message_action = message.answer if as_answer else message.edit_text
@@ -556,29 +778,26 @@ async def update_lock_state(unit, lock_state, call: WialonBlockCallbackQuery, as
 async def show_unit_call_handler(call: WialonBlockCallbackQuery, callback_data: kb.GetUnitCallback):
     try:
         u_id = callback_data.unit_id
-        unit, lock_state = await call.bot.wialon_worker.get_unit_and_lock_state(call.message.chat.id, u_id)
-        await update_lock_state(unit, lock_state, call, as_answer=True)
+        unit = await call.bot.wialon_worker.get_unit_and_lock_state(call.message.chat.id, u_id)
+        await update_lock_state(unit, call, as_answer=True)
         await call.answer()
     except Exception as e:
         await on_call_error(call, e)
 
-    await delete_message(call.message)
+    delete_message(call.message)
 
 
 async def lock_unit_call_handler(call: WialonBlockCallbackQuery, callback_data: kb.LockUnitCallback):
     try:
         u_id = callback_data.unit_id
-        logging.info("Attempt to lock uid: `%s`" % u_id)
-        unit, lock_state = await call.bot.wialon_worker.lock(call.message.chat.id, u_id)
-        match lock_state:
+        logging.info("Attempt to lock uid: `%s`", u_id)
+        unit = await call.bot.wialon_worker.lock(call.message.chat.id, u_id)
+        match unit.lock:
             case ObjState.LOCKED:
-                logging.info(
-                    f'Object `%s` (`%s`) locking success'
-                    % (unit.get('item', {}).get('nm', "Невідомий об'єкт"), u_id)
-                )
+                logging.info('Object `%s` (`%s`) locking success', unit.name or UNKNOWN_UNIT_NAME, u_id)
             case _:
                 raise ValueError("Object `%s` was not locked" % u_id)
-        await update_lock_state(unit, lock_state, call)
+        await update_lock_state(unit, call)
         await call.answer()
     except Exception as e:
         await on_call_error(call, e)
@@ -588,17 +807,14 @@ async def lock_unit_call_handler(call: WialonBlockCallbackQuery, callback_data:
 async def unlock_unit_call_handler(call: WialonBlockCallbackQuery, callback_data: kb.UnlockUnitCallback):
     try:
         u_id = callback_data.unit_id
-        logging.info("Attempt to unlock uid: `%s`" % u_id)
-        unit, lock_state = await call.bot.wialon_worker.unlock(call.message.chat.id, u_id)
-        match lock_state:
+        logging.info("Attempt to unlock uid: `%s`", u_id)
+        unit = await call.bot.wialon_worker.unlock(call.message.chat.id, u_id)
+        match unit.lock:
             case ObjState.UNLOCKED:
-                logging.info(
-                    f'Object `%s` (`%s`) unlocking success'
-                    % (unit.get('item', {}).get('nm', "Невідомий об'єкт"), u_id)
-                )
+                logging.info('Object `%s` (`%s`) unlocking success', unit.name or UNKNOWN_UNIT_NAME, u_id)
             case _:
                 raise ValueError("Object `%s` was not unlocked" % u_id)
-        await update_lock_state(unit, lock_state, call)
+        await update_lock_state(unit, call)
         await call.answer()
     except Exception as e:
         await on_call_error(call, e)
@@ -606,30 +822,55 @@ async def unlock_unit_call_handler(call: WialonBlockCallbackQuery, callback_data
 
 # @dp.callback_query()
 async def any_call_handler(call: WialonBlockCallbackQuery):
-    logging.info("unknown call: %s" % call.data)
+    logging.info("unknown call: %s", call.data, extra=sample(UNKNOWN_CALL_LOG_SAMPLING))
 
 
 # @dp.message()  # listens all messages and log it out
 async def any_message_handler(message: WialonBlockMessage):
-    logging.info('undefined message %s by @%s (%s)' % (message.from_user.id,
-                                                       message.from_user.username,
-                                                       message.text))
-
-
-async def run_bot(config_path: Path = DEFAULT_CONFIG_PATH) -> None:
-    config: Config = load_config(config_path)
-    wialon_worker = WialonWorker(
-        config.wialon.host,
-        config.wialon.token,
-        {str(group.chat_id): group for group in config.tg.groups}
-    )
+    logging.info('undefined message %s by @%s (%s)', message.from_user.id,
+                 message.from_user.username, message.text)
+
+
+def create_bot(config: Config, groups: List[TelegramGroup], expiry_path: Path,
+               flood_control: FloodControlMiddleware) -> WialonBlockBot:
+    """Bot serving the given chats, with a Wialon worker for each backend they use"""
+    snapshot = SnapshotStore(config.storage.snapshot_path) if config.storage.snapshot_path else None
+    wialon_worker = WialonWorkerRegistry({
+        name: WialonWorker(
+            backend.host,
+            backend.token,
+            {str(group.chat_id): group for group in groups if group.wialon == name},
+            max_connections=backend.max_connections,
+            snapshot=snapshot,
+        )
+        for name, backend in config.wialon.all_backends().items()
+        if any(group.wialon == name for group in groups)
+    })
 
     bot = WialonBlockBot(token=config.tg.bot_token, wialon_worker=wialon_worker,
-                         default=DefaultBotProperties(**config.tg.bot_props.model_dump()))
-
-    dp.startup.register(set_default_commands)
+                         default=DefaultBotProperties(**config.tg.bot_props.model_dump()),
+                         expiry=ExpiryScheduler(expiry_path))
+    bot.session.middleware(flood_control)
+    return bot
+
+
+def setup_dispatcher(set_commands: bool = True, prewarm: bool = True) -> Dispatcher:
+    """Registers the lifecycle hooks and the handlers, once per process"""
+    if prewarm:
+        dp.startup.register(prewarm_wialon_worker)
+    if set_commands:
+        dp.startup.register(set_default_commands)
+    dp.startup.register(start_expiry_scheduler)
+    dp.shutdown.register(stop_expiry_scheduler)
+    dp.shutdown.register(close_wialon_worker)
+
+    dp.update.outer_middleware(CorrelationMiddleware())
+    handler_metrics = HandlerMetricsMiddleware()
+    dp.message.middleware(handler_metrics)
+    dp.callback_query.middleware(handler_metrics)
 
     dp.message(Command("list"))(command_pages_handler)
+    dp.message(Command("lock_all", "unlock_all"))(command_bulk_handler)
     dp.message(Command("get_group_id"))(command_get_group_id_handler)
     dp.message(Command("i"))(command_ignore_handler)
     dp.message(Command("pkill"))(kill_switch)
@@ -641,14 +882,97 @@ async def run_bot(config_path: Path = DEFAULT_CONFIG_PATH) -> None:
     dp.callback_query(kb.GetUnitCallback.filter())(show_unit_call_handler)
     dp.callback_query(kb.LockUnitCallback.filter())(lock_unit_call_handler)
     dp.callback_query(kb.UnlockUnitCallback.filter())(unlock_unit_call_handler)
+    dp.callback_query(kb.BulkMoveCallback.filter())(bulk_move_call_handler)
 
     dp.callback_query()(any_call_handler)
     dp.message()(any_message_handler)
+    return dp
 
-    # Start polling
+
+async def start_metrics(metrics: MetricsConfig, port_offset: int = 0) -> Optional[web.AppRunner]:
+    if not metrics.enabled:
+        return None
     try:
-        logging.info("Starting bot...")
-        await dp.start_polling(bot)
+        return await start_metrics_server(metrics.host, metrics.port + port_offset)
+    except OSError as e:
+        # the bot works without metrics
+        logging.error("Failed to start metrics server on %s:%d: %s", metrics.host, metrics.port + port_offset, e)
+        return None
+
+
+async def run_bot(config_path: Path = DEFAULT_CONFIG_PATH) -> None:
+    config: Config = load_config(config_path)
+    flood_control = FloodControlMiddleware()
+    bot = create_bot(config, config.tg.groups, config.storage.expiry_path, flood_control)
+    setup_dispatcher()
+    metrics = await start_metrics(config.metrics)
+    STARTUP.mark("setup")
+
+    try:
+        # the chats are answered from the snapshot until Wialon is refreshed
+        await bot.wialon_worker.warm_start()
+        STARTUP.mark("snapshot")
+        logging.info("Starting bot in %s mode...", config.tg.mode)
+        if config.tg.mode == "webhook":
+            STARTUP.await_phases("webhook", "prefetch")
+            await run_webhook(bot, config.tg.webhook)
+        else:
+            STARTUP.await_phases("first getUpdates", "prefetch")
+            bot.session.middleware(FirstUpdatesMiddleware())
+            # getUpdates is refused while a webhook is set
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
     finally:
+        if metrics is not None:
+            await metrics.cleanup()
+        await flood_control.close()
         await bot.session.close()
         logging.info("Bot stopped.")
+
+
+async def run_webhook(bot: WialonBlockBot, webhook: WebhookConfig) -> None:
+    """
+    Serves updates with an aiohttp web server until SIGINT/SIGTERM,
+    then stops accepting new ones and lets the accepted ones finish.
+    """
+    in_flight = InFlightLimitMiddleware(webhook.max_in_flight)
+    dp.update.outer_middleware(in_flight)
+
+    async def set_webhook(bot: WialonBlockBot):
+        await bot.set_webhook(
+            webhook.url,
+            secret_token=webhook.secret_token,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logging.info("Webhook set to %s", webhook.url)
+
+    dp.startup.register(set_webhook)
+
+    app = web.Application()
+    # dispatcher shutdown goes first, the request handler closes the bot session after it
+    setup_application(app, dp, bot=bot)
+    SimpleRequestHandler(
+        dispatcher=dp, bot=bot, secret_token=webhook.secret_token, handle_in_background=True
+    ).register(app, path=webhook.path)
+
+    runner = web.AppRunner(app, handle_signals=False)
+    await runner.setup()
+    site = web.TCPSite(runner, webhook.host, webhook.port)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await site.start()
+        STARTUP.mark("webhook")
+        logging.info("Listening for webhook updates on %s:%d%s", webhook.host, webhook.port, webhook.path)
+        await stop.wait()
+        logging.info("Stopping webhook server, in-flight updates: %d", in_flight.in_flight)
+        await site.stop()
+        if not await in_flight.wait_idle(webhook.shutdown_timeout):
+            logging.error("Shutdown timeout, dropping %d in-flight updates", in_flight.in_flight)
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+        await runner.cleanup()
@@ -0,0 +1,99 @@
+import secrets
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Generic, Hashable, List, Optional, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+# Snapshots kept for the pages navigation
+PAGES_CACHE_SIZE = 128
+# Total objects in all the snapshots, bounds the memory on big fleets
+PAGES_CACHE_MAX_ITEMS = 100_000
+
+
+class LRUCache(Generic[K, V]):
+    """
+    Dict-like cache bounded by the number of entries and optionally
+    by their total weight, evicts the least recently used entries first.
+    """
+
+    def __init__(self, maxsize: int, max_weight: Optional[int] = None,
+                 weigh: Callable[[V], int] = lambda value: 1):
+        self.maxsize = maxsize
+        self.max_weight = max_weight
+        self._weigh = weigh
+        self._data: OrderedDict[K, V] = OrderedDict()
+        self._weight = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._data
+
+    def get(self, key: K, default: Any = None) -> Optional[V]:
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return default
+        return self._data[key]
+
+    def put(self, key: K, value: V):
+        self.pop(key)
+        self._data[key] = value
+        self._weight += self._weigh(value)
+        self._evict()
+
+    def pop(self, key: K, default: Any = None) -> Optional[V]:
+        value = self._data.pop(key, None)
+        if value is None:
+            return default
+        self._weight -= self._weigh(value)
+        return value
+
+    def clear(self):
+        self._data.clear()
+        self._weight = 0
+
+    def _evict(self):
+        # the newest entry is kept even if it alone exceeds the weight limit
+        while len(self._data) > 1 and (
+                len(self._data) > self.maxsize
+                or (self.max_weight is not None and self._weight > self.max_weight)
+        ):
+            _, value = self._data.popitem(last=False)
+            self._weight -= self._weigh(value)
+
+
+@dataclass
+class PagesSnapshot:
+    chat_id: int
+    pattern: str
+    items: List[Any]
+
+
+class PagesCache(LRUCache[str, PagesSnapshot]):
+    """
+    Search results shown by the pages keyboards,
+    stored under short keys passed in the `PagesCallback`
+    """
+
+    def __init__(self, maxsize: int = PAGES_CACHE_SIZE, max_items: int = PAGES_CACHE_MAX_ITEMS):
+        super().__init__(maxsize, max_items, weigh=lambda snapshot: len(snapshot.items))
+
+    @staticmethod
+    def new_key() -> str:
+        # 6 url-safe chars, never contains the callback data separator
+        return secrets.token_urlsafe(4)
+
+    def store(self, chat_id: int, pattern: str, items: List[Any], key: Optional[str] = None) -> str:
+        key = key or self.new_key()
+        self.put(key, PagesSnapshot(chat_id, pattern, items))
+        return key
+
+    def lookup(self, key: str, chat_id: int) -> Optional[PagesSnapshot]:
+        snapshot = self.get(key)
+        if snapshot is None or snapshot.chat_id != chat_id:
+            return None
+        return snapshot
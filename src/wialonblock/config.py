@@ -1,9 +1,9 @@
 import re
 import tomllib
 from pathlib import Path
-from typing import Optional, List, Literal
+from typing import Optional, List, Literal, Dict
 
-from pydantic import BaseModel, field_validator  # Updated imports for v2 validators
+from pydantic import BaseModel, field_validator, model_validator  # Updated imports for v2 validators
 
 DEFAULT_CONFIG_PATH = Path(".env.toml")
 
@@ -13,6 +13,12 @@ TELEGRAM_TOKEN_PATTERN = r'^\d+:[a-zA-Z0-9_-]{35}$'
 # Regular expression for Wialon token
 WIALON_TOKEN_PATTERN = r'^[a-fA-F0-9]{72}$'
 
+# Name of the backend configured directly in the `[wialon]` section
+DEFAULT_WIALON_BACKEND = "default"
+
+# Regular expression for Telegram webhook secret token
+WEBHOOK_SECRET_TOKEN_PATTERN = r'^[A-Za-z0-9_-]{1,256}$'
+
 # Regular expression for Telegram username
 # Starts with a letter, can contain letters, numbers, underscores, length 5-32
 TELEGRAM_USERNAME_PATTERN = r'^t.me/[a-zA-Z][a-zA-Z0-9_]{4,31}$'
@@ -32,6 +38,32 @@ class TelegramGroup(BaseModel):
     wln_group_locked: str
     wln_group_unlocked: str
     wln_group_ignored: Optional[str] = ""
+    wialon: str = DEFAULT_WIALON_BACKEND  # Name of the Wialon backend the groups belong to
+
+
+class WebhookConfig(BaseModel):
+    """Модель для конфігурації вебхука."""
+    url: str  # Public URL Telegram sends updates to, e.g. https://bot.example.com/webhook
+    path: str = "/webhook"  # Route of the local web server
+    host: str = "0.0.0.0"
+    port: int = 8080
+    secret_token: Optional[str] = None
+    max_in_flight: int = 100  # Max updates handled at the same time
+    shutdown_timeout: float = 30  # Seconds to finish the accepted updates on shutdown
+
+    @field_validator('secret_token')
+    @classmethod
+    def validate_secret_token(cls, v: Optional[str]):
+        if v is not None and not re.fullmatch(WEBHOOK_SECRET_TOKEN_PATTERN, v):
+            raise ValueError('Invalid webhook secret token format')
+        return v
+
+    @field_validator('max_in_flight')
+    @classmethod
+    def validate_max_in_flight(cls, v: int):
+        if v < 1:
+            raise ValueError('max_in_flight must be positive')
+        return v
 
 
 class TelegramConfig(BaseModel):
@@ -44,6 +76,15 @@ class TelegramConfig(BaseModel):
     bot_props: BotProps
     groups: List[TelegramGroup]
 
+    mode: Literal["polling", "webhook"] = "polling"
+    webhook: Optional[WebhookConfig] = None
+
+    @model_validator(mode='after')
+    def validate_webhook_mode(self):
+        if self.mode == "webhook" and self.webhook is None:
+            raise ValueError('`tg.webhook` section is required in webhook mode')
+        return self
+
     # Pydantic v2 uses @field_validator instead of @validator
     @field_validator('bot_name')
     @classmethod  # @classmethod is required for field_validator
@@ -60,10 +101,11 @@ class TelegramConfig(BaseModel):
         return v
 
 
-class WialonConfig(BaseModel):
-    """Модель для конфігурації Wialon."""
+class WialonBackendConfig(BaseModel):
+    """Модель для конфігурації сервера Wialon."""
     host: str  # HttpUrl works great in Pydantic v2
     token: str
+    max_connections: int = 10  # HTTP connections kept open to the host
 
     @field_validator('token')
     @classmethod  # @classmethod is required for field_validator
@@ -72,11 +114,79 @@ class WialonConfig(BaseModel):
             raise ValueError('Invalid Wialon token format')
         return v
 
+    @field_validator('max_connections')
+    @classmethod
+    def validate_max_connections(cls, v: int):
+        if v < 1:
+            raise ValueError('max_connections must be positive')
+        return v
+
+
+class WialonConfig(WialonBackendConfig):
+    """
+    Модель для конфігурації Wialon.
+    Сам розділ описує сервер за замовчуванням, інші сервери задаються в `[wialon.backends.<name>]`.
+    """
+    backends: Dict[str, WialonBackendConfig] = {}
+
+    @field_validator('backends')
+    @classmethod
+    def validate_backends(cls, v: Dict[str, WialonBackendConfig]):
+        if DEFAULT_WIALON_BACKEND in v:
+            raise ValueError(f'Backend name `{DEFAULT_WIALON_BACKEND}` is reserved for the `[wialon]` section')
+        return v
+
+    def all_backends(self) -> Dict[str, WialonBackendConfig]:
+        return {DEFAULT_WIALON_BACKEND: self, **self.backends}
+
+
+class StorageConfig(BaseModel):
+    """Модель для локального сховища стану бота."""
+    expiry_path: Path = Path("wialonblock_expiry.json")
+    snapshot_path: Optional[Path] = Path("wialonblock_snapshot.sqlite3")  # Fleet snapshot for warm starts, shared by the shards
+
+
+class LoggingConfig(BaseModel):
+    """Модель для налаштувань логування."""
+    format: Literal["json", "text"] = "json"  # JSON object per line or the plain text lines
+    level: Literal["DEBUG", "INFO", "WARNING", "ERROR"] = "INFO"
+
+
+class MetricsConfig(BaseModel):
+    """Модель для локального сервера метрик Prometheus."""
+    enabled: bool = False
+    host: str = "127.0.0.1"
+    port: int = 9100  # Shards listen on `port + shard index`
+
+
+class ShardingConfig(BaseModel):
+    """Модель для розподілу чатів між процесами."""
+    workers: int = 1  # Worker processes, more than 1 runs the supervisor mode
+
+    @field_validator('workers')
+    @classmethod
+    def validate_workers(cls, v: int):
+        if v < 1:
+            raise ValueError('workers must be positive')
+        return v
+
 
 class Config(BaseModel):
     """Головна модель конфігурації."""
     tg: TelegramConfig
     wialon: WialonConfig
+    storage: StorageConfig = StorageConfig()
+    sharding: ShardingConfig = ShardingConfig()
+    metrics: MetricsConfig = MetricsConfig()
+    logging: LoggingConfig = LoggingConfig()
+
+    @model_validator(mode='after')
+    def validate_group_backends(self):
+        backends = self.wialon.all_backends()
+        for group in self.tg.groups:
+            if group.wialon not in backends:
+                raise ValueError(f'Unknown Wialon backend `{group.wialon}` of the group `{group.chat_id}`')
+        return self
 
 
 def load_config(path: Path = DEFAULT_CONFIG_PATH) -> Config:
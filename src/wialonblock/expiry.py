@@ -0,0 +1,133 @@
+import asyncio
+import heapq
+import json
+import logging
+import os
+import time
+from enum import StrEnum
+from pathlib import Path
+from typing import Awaitable, Callable, List, NamedTuple, Optional
+
+# Pending expiries are written to disk no more often than this many seconds
+PERSIST_INTERVAL = 5
+# Max expiries passed to the handler at once
+EXPIRY_BATCH_SIZE = 100
+
+
+class ExpiryAction(StrEnum):
+    OUTDATE = "outdate"
+    DELETE = "delete"
+
+
+class Expiry(NamedTuple):
+    deadline: float  # unix time, so it stays valid across restarts
+    chat_id: int
+    message_id: int
+    action: ExpiryAction
+
+
+ExpiryHandler = Callable[[List[Expiry]], Awaitable[None]]
+
+
+class ExpiryScheduler:
+    """
+    Single background task that fires message expiries from a heap
+    ordered by deadline, instead of a sleeping coroutine per message.
+    Due expiries are passed to the handler in batches, pending ones
+    are persisted to `path` so they survive restarts.
+    """
+
+    def __init__(self, path: Optional[Path] = None,
+                 persist_interval: float = PERSIST_INTERVAL,
+                 batch_size: int = EXPIRY_BATCH_SIZE):
+        self.path = Path(path) if path else None
+        self.persist_interval = persist_interval
+        self.batch_size = batch_size
+        self._heap: List[Expiry] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._dirty = False
+        self._saved_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def schedule(self, chat_id: int, message_id: int, delay: float, action: ExpiryAction):
+        expiry = Expiry(time.time() + delay, int(chat_id), int(message_id), ExpiryAction(action))
+        heapq.heappush(self._heap, expiry)
+        self._dirty = True
+        if self._heap[0] is expiry:
+            # the new one is due earlier than the task sleeps
+            self._wakeup.set()
+
+    def load(self):
+        if not self.path or not self.path.exists():
+            return
+        try:
+            with open(self.path, encoding="utf-8") as fp:
+                records = json.load(fp)
+            self._heap.extend(Expiry(float(d), int(c), int(m), ExpiryAction(a)) for d, c, m, a in records)
+            heapq.heapify(self._heap)
+            logging.info("Loaded %d pending message expiries from `%s`", len(records), self.path)
+        except (OSError, ValueError, TypeError) as e:
+            logging.error("Failed to load message expiries from `%s`: %s", self.path, e)
+
+    def _write(self, records: List[Expiry]):
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as fp:
+            json.dump(records, fp)
+        os.replace(tmp_path, self.path)
+
+    async def save(self):
+        if not self.path:
+            return
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        try:
+            await asyncio.to_thread(self._write, list(self._heap))
+        except OSError as e:
+            self._dirty = True
+            logging.error("Failed to save message expiries to `%s`: %s", self.path, e)
+
+    def start(self, handler: ExpiryHandler):
+        self.load()
+        self._task = asyncio.create_task(self._run(handler), name="message-expiry")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.save()
+
+    def _pop_due(self) -> List[Expiry]:
+        now = time.time()
+        due = []
+        while self._heap and self._heap[0].deadline <= now and len(due) < self.batch_size:
+            due.append(heapq.heappop(self._heap))
+        return due
+
+    async def _run(self, handler: ExpiryHandler):
+        while True:
+            if due := self._pop_due():
+                self._dirty = True
+                try:
+                    await handler(due)
+                except Exception as e:
+                    logging.exception(e)
+                continue
+
+            if self._dirty and time.monotonic() - self._saved_at >= self.persist_interval:
+                await self.save()
+
+            timeout = self.persist_interval
+            if self._heap:
+                timeout = min(timeout, max(0.0, self._heap[0].deadline - time.time()))
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except TimeoutError:
+                pass
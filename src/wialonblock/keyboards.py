@@ -1,11 +1,13 @@
 import itertools  # Import itertools
 from enum import StrEnum
-from typing import Dict
+from functools import lru_cache
+from typing import List, Tuple
 
 from aiogram import types
 from aiogram.filters.callback_data import CallbackData
 
-from wialonblock.worker import ObjState
+from wialonblock.cache import LRUCache
+from wialonblock.worker import ObjState, Unit
 
 
 class RefreshCallback(CallbackData, prefix="refresh"):
@@ -24,6 +26,17 @@ class UnlockUnitCallback(CallbackData, prefix="unlock_unit"):
     unit_id: int
 
 
+class BulkAction(StrEnum):
+    LOCK = "lock"
+    UNLOCK = "unlock"
+    CANCEL = "cancel"
+
+
+class BulkMoveCallback(CallbackData, prefix="bulk"):
+    action: BulkAction
+    key: str  # Key of the confirmed units snapshot in the bot's pages cache
+
+
 REFRESH_BUTTON = types.InlineKeyboardButton(
     text="🔄 Оновити",
     callback_data=RefreshCallback().pack()
@@ -36,23 +49,51 @@ def refresh():
     )
 
 
-def search_result(items, refresh=True):
-    keyboard_buttons = []
+# Unit buttons kept for rendering, about a fleet or two
+UNIT_BUTTONS_CACHE_SIZE = 50_000
+# Navigation rows kept for rendering, a few per cached pages snapshot
+PAGES_NAVIGATION_CACHE_SIZE = 1024
+
+
+class UnitButtonsCache:
+    """
+    Unit buttons built once and reused by every keyboard showing the unit,
+    with the callback data packed once. An entry is kept per unit id and
+    replaced when the lock state or the name of the unit has changed.
+    """
+
+    def __init__(self, maxsize: int = UNIT_BUTTONS_CACHE_SIZE):
+        self._buttons: LRUCache[int, Tuple[ObjState, str, types.InlineKeyboardButton]] = LRUCache(maxsize)
 
+    def __len__(self) -> int:
+        return len(self._buttons)
+
+    def get(self, unit: Unit) -> types.InlineKeyboardButton:
+        entry = self._buttons.get(unit.id)
+        if entry is not None and entry[0] == unit.lock and entry[1] == unit.name:
+            return entry[2]
+        button = types.InlineKeyboardButton(
+            text=f"{unit.lock} {unit.name}",
+            callback_data=GetUnitCallback(unit_id=unit.id).pack()
+        )
+        self._buttons.put(unit.id, (unit.lock, unit.name, button))
+        return button
+
+    def clear(self):
+        self._buttons.clear()
+
+
+unit_buttons = UnitButtonsCache()
+
+
+def units_rows(items: List[Unit]) -> List[List[types.InlineKeyboardButton]]:
     # Use itertools.batched to group items into chunks of 2
-    for batch in itertools.batched(items, 2):
-        row = []
-        for i in batch:
-            lock = i.get("_lock_", ObjState.UNKNOWN)
-            uid = i["id"]
-            uname = i["nm"]
-            button = types.InlineKeyboardButton(
-                # text=f"{lock} {uname} ...............................",
-                text=f"{lock} {uname}",
-                callback_data=GetUnitCallback(unit_id=uid).pack()
-            )
-            row.append(button)
-        keyboard_buttons.append(row)
+    get = unit_buttons.get
+    return [[get(unit) for unit in batch] for batch in itertools.batched(items, 2)]
+
+
+def search_result(items: List[Unit], refresh=True):
+    keyboard_buttons = units_rows(items)
 
     if refresh:
         keyboard_buttons.append([REFRESH_BUTTON])
@@ -70,8 +111,10 @@ class PagesCallback(CallbackData,
                     prefix="page"):  # Changed prefix to 'page' for clarity, adjust if 'refresh' is specifically needed
     start: int
     end: int
-    pattern: str  # You have a 'pattern' field, ensure it's handled if it affects pagination logic
     action: PagesAction
+    # Key of the result snapshot in the bot's pages cache, the pattern is kept there,
+    # a Cyrillic one doesn't fit the 64 bytes of the callback data
+    key: str
 
 
 ITEMS_PER_PAGE = 20
@@ -95,12 +138,11 @@ def next_page_button(current_page_data: PagesCallback, total_items_count: int):
     new_end = min(new_start + ITEMS_PER_PAGE, total_items_count)
 
     # Create a NEW PagesCallback instance with the updated data
-    # The 'pattern' field is carried over as it's part of the CallbackData
     next_data = PagesCallback(
         start=new_start,
         end=new_end,
-        pattern=current_page_data.pattern,
-        action=PagesAction.NEXT
+        action=PagesAction.NEXT,
+        key=current_page_data.key
     )
 
     return types.InlineKeyboardButton(
@@ -130,11 +172,10 @@ def back_page_button(current_page_data: PagesCallback):
     back_data = PagesCallback(
         start=new_start,
         end=new_end,
-        pattern=current_page_data.pattern,
-        action=PagesAction.BACK
+        action=PagesAction.BACK,
+        key=current_page_data.key
     )
 
-    print(f"Back button data: {back_data}")
     return types.InlineKeyboardButton(
         text=f"{PagesAction.BACK} Назад",
         callback_data=back_data.pack()
@@ -147,18 +188,16 @@ def refresh_page_button(current_page_data: PagesCallback):
     refresh_data = PagesCallback(
         start=current_page_data.start,
         end=current_page_data.end,
-        pattern=current_page_data.pattern,
-        action=PagesAction.REFRESH
+        action=PagesAction.REFRESH,
+        key=current_page_data.key
     )
-    print(f"Refresh button data: {refresh_data}")
     return types.InlineKeyboardButton(
         text="🔄 Оновити",
         callback_data=refresh_data.pack()
     )
 
 
-def pages_result(items: Dict, prev_data: PagesCallback):
-    keyboard_buttons = []
+def pages_result(items: List[Unit], prev_data: PagesCallback):
     total_items = len(items)
 
     # Determine the actual start and end for the current page being displayed.
@@ -188,23 +227,19 @@ def pages_result(items: Dict, prev_data: PagesCallback):
         current_end = min(ITEMS_PER_PAGE, total_items)
     # --- MODIFICATION ENDS HERE ---
 
-    print(f"ITEMS LEN: {total_items}, Displaying from: {current_start} to {current_end}")
+    keyboard_buttons = units_rows(items[current_start:current_end])
+    keyboard_buttons.extend(pages_navigation(prev_data.key, current_start, current_end, total_items))
+    return types.InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
 
-    items_to_display = items[current_start:current_end]
 
-    for batch in itertools.batched(items_to_display, 2):
-        row = []
-        for i in batch:
-            lock = i.get("_lock_", ObjState.UNKNOWN)
-            uid = i["id"]
-            uname = i["nm"]
-            button = types.InlineKeyboardButton(
-                # text=f"{lock} {uname} ...............................",
-                text=f"{lock} {uname}",
-                callback_data=GetUnitCallback(unit_id=uid).pack()
-            )
-            row.append(button)
-        keyboard_buttons.append(row)
+@lru_cache(maxsize=PAGES_NAVIGATION_CACHE_SIZE)
+def pages_navigation(key: str, current_start: int, current_end: int,
+                     total_items: int) -> Tuple[List[types.InlineKeyboardButton], ...]:
+    """
+    Navigation and refresh rows of a page, the same for every render of the page,
+    so the callbacks are built and packed once. The rows are shared, don't change them.
+    """
+    keyboard_buttons = []
 
     # --- Pagination navigation buttons ---
     nav_buttons = []
@@ -213,8 +248,8 @@ def pages_result(items: Dict, prev_data: PagesCallback):
     temp_prev_data_for_buttons = PagesCallback(
         start=current_start,
         end=current_end,
-        pattern=prev_data.pattern,
-        action=PagesAction.REFRESH  # Action here reflects the current view for generating buttons
+        action=PagesAction.REFRESH,  # Action here reflects the current view for generating buttons
+        key=key
     )
 
     if temp_prev_data_for_buttons.start > 0:
@@ -231,7 +266,7 @@ def pages_result(items: Dict, prev_data: PagesCallback):
         keyboard_buttons.append(nav_buttons)
     keyboard_buttons.append([refresh_page_button(temp_prev_data_for_buttons)])
 
-    return types.InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+    return tuple(keyboard_buttons)
 
 
 # def pages_result(items: list, prev_data: PagesCallback):
@@ -317,6 +352,7 @@ def pages_result(items: Dict, prev_data: PagesCallback):
 #     return types.InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
 
 
+@lru_cache(maxsize=UNIT_BUTTONS_CACHE_SIZE)
 def locked(u_id):
     return types.InlineKeyboardMarkup(inline_keyboard=[
         [
@@ -328,6 +364,7 @@ def locked(u_id):
     ])
 
 
+@lru_cache(maxsize=UNIT_BUTTONS_CACHE_SIZE)
 def unlocked(u_id):
     return types.InlineKeyboardMarkup(inline_keyboard=[
         [
@@ -337,3 +374,19 @@ def unlocked(u_id):
             )
         ]
     ])
+
+
+def bulk_confirm(action: BulkAction, key: str):
+    text = f'{ObjState.LOCKED} Заборонити виїзд' if action == BulkAction.LOCK else f'{ObjState.UNLOCKED} Дозволити виїзд'
+    return types.InlineKeyboardMarkup(inline_keyboard=[
+        [
+            types.InlineKeyboardButton(
+                text=text,
+                callback_data=BulkMoveCallback(action=action, key=key).pack()
+            ),
+            types.InlineKeyboardButton(
+                text="❌ Скасувати",
+                callback_data=BulkMoveCallback(action=BulkAction.CANCEL, key=key).pack()
+            ),
+        ]
+    ])
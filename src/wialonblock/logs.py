@@ -0,0 +1,154 @@
+"""
+Logging pipeline: the records are put to an in-memory queue by a `QueueHandler`
+and written by a background thread, so a slow stdout (e.g. redirected to a file
+on a busy disk) never blocks the event loop.
+
+The messages are formatted lazily by the writer thread, so the log calls should
+pass the arguments separately, `logging.info("Unit %s locked", uid)`, instead of
+formatting the string in place. Every record gets the correlation id of the update
+being handled, records of the noisy paths can be sampled with `extra=sample(n)`.
+"""
+
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from wialonblock.config import LoggingConfig
+
+# Records waiting for the writer thread, new ones are dropped when it is full
+LOG_QUEUE_SIZE = 10_000
+
+TEXT_FORMAT = "%(levelname)s:%(name)s:%(correlation_id)s:%(message)s"
+
+# Correlation id of the update handled by the current task
+correlation_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("correlation_id", default=None)
+
+# Attributes every `LogRecord` has, the rest came with `extra`
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def new_correlation_id() -> str:
+    return uuid.uuid4().hex
+
+
+def sample(every: int) -> Dict[str, int]:
+    """`extra` of a record written only once per `every` records of its call site"""
+    return {"sample_every": every}
+
+
+class ContextFilter(logging.Filter):
+    """
+    Runs in the logging task before the record is queued: attaches the correlation id
+    and drops the sampled out records, so they cost nothing further
+    """
+
+    def __init__(self, shard: Optional[int] = None):
+        super().__init__()
+        self.shard = shard
+        self._counters: Dict[Tuple[str, int], int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        every = getattr(record, "sample_every", None)
+        if every is not None and every > 1:
+            site = (record.pathname, record.lineno)
+            seen = self._counters.get(site, 0)
+            self._counters[site] = seen + 1
+            if seen % every:
+                return False
+        if (current := correlation_id.get()) is not None:
+            record.correlation_id = current
+        if self.shard is not None:
+            record.shard = self.shard
+        return True
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues the record as is, the message and the traceback are formatted by the writer thread.
+    The arguments are read there later, so the logged objects must not be changed in place after the call.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # losing a record is better than blocking the event loop
+            sys.stderr.write("Logging queue is full, record dropped\n")
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, correlation id and the `extra` fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class CorrelationMiddleware(BaseMiddleware):
+    """
+    Outer update middleware, assigns a correlation id to every update,
+    the records logged while it is handled carry it and the error answers show it
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        token = correlation_id.set(new_correlation_id())
+        try:
+            return await handler(event, data)
+        finally:
+            correlation_id.reset(token)
+
+
+def setup_logging(config: LoggingConfig, shard: Optional[int] = None) -> logging.handlers.QueueListener:
+    """
+    Replaces the root handlers with the queue one and starts the writer thread,
+    the returned listener has to be stopped on exit to flush the queue
+    """
+    stream = logging.StreamHandler(sys.stdout)
+    if config.format == "json":
+        stream.setFormatter(JsonFormatter())
+    else:
+        prefix = f"[shard {shard}] " if shard is not None else ""
+        stream.setFormatter(logging.Formatter(prefix + TEXT_FORMAT, defaults={"correlation_id": "-"}))
+
+    handler = LazyQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(ContextFilter(shard))
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+        old.close()
+    root.addHandler(handler)
+    root.setLevel(config.level)
+
+    listener = logging.handlers.QueueListener(handler.queue, stream, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,305 @@
+import asyncio
+import bisect
+import contextvars
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.types import TelegramObject
+from aiohttp import web
+
+# Upper bounds of the latency histogram buckets, seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{%s}" % ",".join(pairs) if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines += self.samples()
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+                for labels, value in sorted(self._values.items())]
+
+
+class Gauge(Metric):
+    """Value set by the code or read from `collect` on every scrape"""
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 collect: Optional[Callable[[], Dict[Labels, float]]] = None):
+        super().__init__(name, documentation, labels)
+        # a gauge without labels is reported as 0 before the first update
+        self._values: Dict[Labels, float] = {} if self.labels else {(): 0}
+        self._collect = collect
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+    def remove(self, *labels: str):
+        """Drops the series, e.g. of a finished request"""
+        self._values.pop(labels, None)
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> List[str]:
+        values = dict(self._values)
+        if self._collect is not None:
+            try:
+                values.update(self._collect())
+            except Exception as e:
+                logging.error("Failed to collect `%s`: %s", self.name, e)
+        return [f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+                for labels, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    """
+    Cumulative histogram with fixed buckets, an observation costs
+    a bisect and two additions, the cumulative counts are built on scrape
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [counts per bucket + the +Inf one, sum]
+        self._values: Dict[Labels, List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def count(self, *labels: str) -> int:
+        series = self._values.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, series in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), series[:-1]):
+                cumulative += count
+                le = 'le="%s"' % _format_value(float(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Metrics of the process, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric `{metric.name}` is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = (),
+              collect: Optional[Callable[[], Dict[Labels, float]]] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, labels, collect))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+HANDLER_LATENCY = REGISTRY.histogram(
+    "wialonblock_handler_duration_seconds", "Time spent in the update handlers", ("handler",)
+)
+HANDLER_ERRORS = REGISTRY.counter(
+    "wialonblock_handler_errors_total", "Update handlers failed with an exception, raised or answered with an error",
+    ("handler",)
+)
+HANDLERS_IN_FLIGHT = REGISTRY.gauge(
+    "wialonblock_handlers_in_flight", "Update handlers running at the moment"
+)
+WIALON_LATENCY = REGISTRY.histogram(
+    "wialonblock_wialon_request_duration_seconds", "Wialon API requests, including the rate limiter wait",
+    ("host", "method"),
+)
+WIALON_ERRORS = REGISTRY.counter(
+    "wialonblock_wialon_request_errors_total", "Failed Wialon API requests", ("host", "method", "error")
+)
+WIALON_IN_FLIGHT = REGISTRY.gauge(
+    "wialonblock_wialon_requests_in_flight", "Wialon API requests sent or waiting for the rate limiter",
+    ("host",),
+)
+WIALON_TIMEOUTS = REGISTRY.counter(
+    "wialonblock_wialon_deadline_exceeded_total", "Wialon calls cut off by their deadline", ("host", "method")
+)
+WIALON_RETRIES = REGISTRY.counter(
+    "wialonblock_wialon_retries_total", "Retried Wialon reads", ("host", "method")
+)
+WIALON_HEDGED = REGISTRY.counter(
+    "wialonblock_wialon_hedged_total", "Wialon reads duplicated after exceeding the recent p95", ("host", "method")
+)
+WIALON_BREAKER_STATE = REGISTRY.gauge(
+    "wialonblock_wialon_circuit_state", "Circuit breaker of the Wialon host: 0 closed, 1 open, 2 half-open",
+    ("host",),
+)
+WIALON_BREAKER_REJECTED = REGISTRY.counter(
+    "wialonblock_wialon_circuit_rejected_total", "Wialon calls rejected by the open circuit breaker",
+    ("host", "method"),
+)
+WIALON_FALLBACK_READS = REGISTRY.counter(
+    "wialonblock_wialon_fallback_reads_total", "Listings served from the last known data, the host being unavailable",
+    ("host",),
+)
+
+SINGLEFLIGHT_WAITERS = REGISTRY.gauge(
+    "wialonblock_singleflight_waiters", "Callers waiting for each in-flight coalesced Wialon request",
+    ("flight", "key"),
+)
+SINGLEFLIGHT_SHARED = REGISTRY.counter(
+    "wialonblock_singleflight_shared_total", "Calls served by an identical request already in flight",
+    ("flight",),
+)
+SINGLEFLIGHT_CALLS = REGISTRY.counter(
+    "wialonblock_singleflight_requests_total", "Wialon requests actually made by the coalescing layer",
+    ("flight",),
+)
+SNAPSHOT_READS = REGISTRY.counter(
+    "wialonblock_snapshot_reads_total", "Listings served from the local fleet snapshot before the Wialon refresh",
+    ("host",),
+)
+STARTUP_PHASE = REGISTRY.gauge(
+    "wialonblock_startup_phase_seconds", "Time spent in each startup phase of the process", ("phase",)
+)
+STARTUP_READY = REGISTRY.gauge(
+    "wialonblock_startup_ready_seconds",
+    "Time from the first import until the updates are polled and the chats are prefetched",
+)
+TELEGRAM_PENDING = REGISTRY.gauge(
+    "wialonblock_telegram_requests_pending", "Outgoing Telegram requests queued by the flood control"
+)
+ASYNCIO_TASKS = REGISTRY.gauge(
+    "wialonblock_asyncio_tasks", "Tasks of the event loop, including the idle background ones",
+    collect=lambda: {(): len(asyncio.all_tasks())},
+)
+
+
+# Function name of the update handler run by the current task
+current_handler: contextvars.ContextVar[str] = contextvars.ContextVar("current_handler", default="unknown")
+
+
+def record_handler_error():
+    """Counts an exception the handler has caught and answered itself"""
+    HANDLER_ERRORS.inc(current_handler.get())
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """
+    Inner middleware of the message and callback query observers,
+    records the latency of every handler under its function name
+    and the exceptions raised out of it
+    """
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object is not None else "unknown"
+        token = current_handler.set(name)
+        HANDLERS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except SkipHandler:
+            raise
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - start, name)
+            HANDLERS_IN_FLIGHT.dec()
+            current_handler.reset(token)
+
+
+async def start_metrics_server(host: str, port: int, registry: MetricsRegistry = REGISTRY) -> web.AppRunner:
+    """Serves `GET /metrics` on a separate local web server, returns its runner for cleanup"""
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(body=registry.render().encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, handle_signals=False, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("Serving metrics on http://%s:%d/metrics", host, port)
+    return runner
@@ -0,0 +1,322 @@
+import asyncio
+import logging
+import time
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Set, Tuple, Union, TYPE_CHECKING
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject
+
+from wialonblock.cache import LRUCache
+from wialonblock.metrics import TELEGRAM_PENDING
+
+if TYPE_CHECKING:
+    from aiogram import Bot
+
+
+class InFlightLimitMiddleware(BaseMiddleware):
+    """
+    Outer update middleware, bounds the number of updates handled at the same time
+    and lets the shutdown wait until the accepted ones are done.
+    """
+
+    def __init__(self, limit: int):
+        self._semaphore = asyncio.Semaphore(limit)
+        self._in_flight = 0  # accepted updates, handled or waiting for a slot
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any],
+    ) -> Any:
+        self._in_flight += 1
+        self._idle.clear()
+        try:
+            async with self._semaphore:
+                return await handler(event, data)
+        finally:
+            self._in_flight -= 1
+            if not self._in_flight:
+                self._idle.set()
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """Waits until all the accepted updates are handled, returns False on timeout"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except TimeoutError:
+            return False
+
+
+# Telegram Bot API flood limits, messages per second
+GLOBAL_RATE = 30
+GROUP_CHAT_RATE = 20 / 60
+PRIVATE_CHAT_RATE = 1
+# Messages sent at once to a chat before the rate applies
+CHAT_BURST = 3
+# Chat buckets kept, idle ones are evicted first
+CHAT_BUCKETS_SIZE = 10_000
+RETRY_AFTER_ATTEMPTS = 3
+
+
+class RequestPriority(IntEnum):
+    CALLBACK_ANSWER = 0
+    MESSAGE = 1
+    EDIT = 2
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated_at")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        if now > self.updated_at:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+    def ready_in(self, now: float) -> float:
+        """Seconds until a token is available"""
+        self._refill(now)
+        if now < self.updated_at:
+            # blocked by `block`
+            return self.updated_at - now + max(0.0, 1 - self.tokens) / self.rate
+        return max(0.0, 1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        """Empties the bucket and stops the refill for `seconds`"""
+        self.tokens = 0
+        self.updated_at = max(self.updated_at, time.monotonic() + seconds)
+
+
+class _Ticket:
+    __slots__ = ("make_request", "bot", "method", "priority", "seq", "chat_id",
+                 "edit_key", "attempts", "result", "followers")
+
+    def __init__(self, make_request: NextRequestMiddlewareType, bot: "Bot", method: TelegramMethod,
+                 priority: RequestPriority, seq: int, chat_id: Optional[Union[int, str]],
+                 edit_key: Optional[Hashable]):
+        self.make_request = make_request
+        self.bot = bot
+        self.method = method
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.edit_key = edit_key
+        self.attempts = 0
+        self.result: asyncio.Future = asyncio.get_running_loop().create_future()
+        # results of the superseded edits of the same message
+        self.followers: List[asyncio.Future] = []
+
+    def resolve(self, response: Optional[Response] = None, error: Optional[BaseException] = None):
+        for future in (self.result, *self.followers):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(response)
+
+    def cancel(self):
+        for future in (self.result, *self.followers):
+            future.cancel()
+
+
+class FloodControlMiddleware(BaseRequestMiddleware):
+    """
+    Outgoing request scheduler for the bot session, keeps the sent messages
+    within the per-chat and global Telegram limits instead of running into
+    `TelegramRetryAfter`.
+
+    Callback answers go first, then new messages and deletions, then edits.
+    A pending edit of a message is replaced by a newer edit of the same message,
+    both callers get the response of the newer one.
+    `TelegramRetryAfter` blocks the chat (or all the chats) for the given time
+    and the request is queued again.
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE,
+                 group_chat_rate: float = GROUP_CHAT_RATE,
+                 private_chat_rate: float = PRIVATE_CHAT_RATE,
+                 chat_burst: int = CHAT_BURST,
+                 retry_attempts: int = RETRY_AFTER_ATTEMPTS):
+        self.group_chat_rate = group_chat_rate
+        self.private_chat_rate = private_chat_rate
+        self.chat_burst = chat_burst
+        self.retry_attempts = retry_attempts
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: LRUCache[Union[int, str], TokenBucket] = LRUCache(CHAT_BUCKETS_SIZE)
+        self._pending: List[_Ticket] = []
+        self._edits: Dict[Hashable, _Ticket] = {}
+        self._seq = 0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._sending: Set[asyncio.Task] = set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    @staticmethod
+    def _classify(method: TelegramMethod) -> Optional[RequestPriority]:
+        name = method.__api_method__
+        if name == "answerCallbackQuery":
+            return RequestPriority.CALLBACK_ANSWER
+        if name.startswith("edit"):
+            return RequestPriority.EDIT
+        if name.startswith(("send", "copy", "forward", "delete")) and name != "deleteWebhook":
+            return RequestPriority.MESSAGE
+        # getUpdates, setWebhook, getMe and the like are not throttled
+        return None
+
+    def _chat_bucket(self, chat_id: Union[int, str]) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # negative ids and @usernames are groups and channels
+            is_private = isinstance(chat_id, int) and chat_id > 0
+            bucket = TokenBucket(self.private_chat_rate if is_private else self.group_chat_rate,
+                                 self.chat_burst)
+            self._chats.put(chat_id, bucket)
+        return bucket
+
+    async def __call__(
+            self,
+            make_request: NextRequestMiddlewareType[TelegramType],
+            bot: "Bot",
+            method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        priority = self._classify(method)
+        if priority is None:
+            return await make_request(bot, method)
+
+        chat_id = None
+        # deletions do not show up in the chat, only the global limit applies
+        if priority != RequestPriority.CALLBACK_ANSWER and not method.__api_method__.startswith("delete"):
+            chat_id = getattr(method, "chat_id", None)
+        edit_key = None
+        if priority == RequestPriority.EDIT:
+            edit_key = (type(method), getattr(method, "chat_id", None),
+                        getattr(method, "message_id", None), getattr(method, "inline_message_id", None))
+
+        self._seq += 1
+        ticket = _Ticket(make_request, bot, method, priority, self._seq, chat_id, edit_key)
+        self._enqueue(ticket)
+        return await ticket.result
+
+    def _enqueue(self, ticket: _Ticket):
+        if ticket.edit_key is not None:
+            pending = self._edits.get(ticket.edit_key)
+            if pending is not None and pending in self._pending:
+                if ticket.attempts:
+                    # a retried edit is older than the pending one, the pending one wins
+                    pending.followers += (ticket.result, *ticket.followers)
+                    self._wakeup.set()
+                    return
+                self._pending.remove(pending)
+                ticket.followers += (pending.result, *pending.followers)
+                logging.debug("Edit of %s superseded by a newer one", ticket.edit_key[1:])
+            self._edits[ticket.edit_key] = ticket
+        self._pending.append(ticket)
+        TELEGRAM_PENDING.set(len(self._pending))
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="flood-control")
+        self._wakeup.set()
+
+    def _next_ready(self) -> Tuple[Optional[_Ticket], Optional[float]]:
+        """The first ticket in order of priority that can be sent now or the time to wait for one"""
+        now = time.monotonic()
+        global_wait = self._global.ready_in(now)
+        best, wait = None, None
+        for ticket in list(self._pending):
+            if all(future.done() for future in (ticket.result, *ticket.followers)):
+                # all the callers are cancelled
+                self._forget(ticket)
+                continue
+            ticket_wait = global_wait
+            if ticket.chat_id is not None:
+                ticket_wait = max(ticket_wait, self._chat_bucket(ticket.chat_id).ready_in(now))
+            if ticket_wait > 0:
+                wait = ticket_wait if wait is None else min(wait, ticket_wait)
+            elif best is None or (ticket.priority, ticket.seq) < (best.priority, best.seq):
+                best = ticket
+        return best, wait
+
+    def _forget(self, ticket: _Ticket):
+        self._pending.remove(ticket)
+        TELEGRAM_PENDING.set(len(self._pending))
+        if ticket.edit_key is not None and self._edits.get(ticket.edit_key) is ticket:
+            del self._edits[ticket.edit_key]
+
+    async def _run(self):
+        while True:
+            ticket, wait = self._next_ready()
+            if ticket is not None:
+                self._forget(ticket)
+                self._global.take()
+                if ticket.chat_id is not None:
+                    self._chat_bucket(ticket.chat_id).take()
+                task = asyncio.create_task(self._send(ticket))
+                self._sending.add(task)
+                task.add_done_callback(self._sending.discard)
+                continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except TimeoutError:
+                pass
+
+    async def _send(self, ticket: _Ticket):
+        try:
+            response = await ticket.make_request(ticket.bot, ticket.method)
+        except TelegramRetryAfter as e:
+            if ticket.attempts >= self.retry_attempts:
+                ticket.resolve(error=e)
+                return
+            ticket.attempts += 1
+            logging.warning("Flood control: retry %s in %d s (attempt %d)",
+                            ticket.method.__api_method__, e.retry_after, ticket.attempts)
+            if ticket.chat_id is not None:
+                self._chat_bucket(ticket.chat_id).block(e.retry_after)
+            else:
+                self._global.block(e.retry_after)
+            self._enqueue(ticket)
+        except asyncio.CancelledError:
+            ticket.cancel()
+            raise
+        except Exception as e:
+            ticket.resolve(error=e)
+        else:
+            ticket.resolve(response)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for ticket in self._pending:
+            ticket.cancel()
+        self._pending.clear()
+        self._edits.clear()
+        TELEGRAM_PENDING.set(0)
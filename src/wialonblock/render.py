@@ -0,0 +1,174 @@
+"""
+Message rendering for the parse mode of the bot.
+
+Templates are written in MarkdownV2 and converted once per parse mode into a format string,
+Markdown gets the markup as is without the escapes it doesn't know, HTML gets the tags.
+The values are escaped with the `util` escapers, HTML with `html.escape`.
+The current time is formatted and escaped once per second.
+"""
+
+import html
+import time
+from datetime import datetime
+from string import Formatter
+from typing import Callable, Dict, List, Optional
+
+from wialonblock.util import escape_markdown_legacy, escape_markdown_v2
+
+# Parse mode of a bot without one, the templates are written for it
+DEFAULT_PARSE_MODE = "MarkdownV2"
+
+TIMESTAMP_FORMAT = "%d.%m.%Y %H:%M:%S"
+
+# MarkdownV2 entities of the templates and their HTML tags
+HTML_TAGS = {"*": "b", "_": "i", "`": "code", "~": "s"}
+# Escapes Telegram's legacy Markdown understands outside of the entities
+MARKDOWN_ESCAPES = "_*`["
+
+
+def escape_html(text: str) -> str:
+    return html.escape(text, quote=False)
+
+
+ESCAPERS: Dict[str, Callable[[str], str]] = {
+    "MarkdownV2": escape_markdown_v2,
+    "Markdown": escape_markdown_legacy,
+    "HTML": escape_html,
+}
+
+
+def escape_code_markdown_v2(text: str) -> str:
+    # inside `pre` and `code` only the backtick and the backslash are escaped
+    return text.replace("\\", "\\\\").replace("`", "\\`")
+
+
+def escape_code_markdown(text: str) -> str:
+    # legacy Markdown has no escapes inside a code span, a backtick would close it
+    return text.replace("`", "")
+
+
+# Escapers of the values put inside a code span, e.g. `{pattern}`
+CODE_ESCAPERS: Dict[str, Callable[[str], str]] = {
+    "MarkdownV2": escape_code_markdown_v2,
+    "Markdown": escape_code_markdown,
+    "HTML": escape_html,
+}
+
+
+def _to_markdown(literals: List[str]) -> List[str]:
+    converted = []
+    for literal in literals:
+        chars = iter(literal)
+        chunk = []
+        for char in chars:
+            if char == "\\":
+                escaped = next(chars, "")
+                chunk.append("\\" + escaped if escaped in MARKDOWN_ESCAPES else escaped)
+            else:
+                chunk.append(char)
+        converted.append("".join(chunk))
+    return converted
+
+
+def _to_html(literals: List[str]) -> List[str]:
+    # an entity may span the fields, e.g. `*{name}*`
+    converted = []
+    opened: List[str] = []
+    for literal in literals:
+        chars = iter(literal)
+        chunk = []
+        for char in chars:
+            if char == "\\":
+                chunk.append(escape_html(next(chars, "")))
+            elif char in HTML_TAGS and (not opened or opened[-1] == char or opened[-1] != "`"):
+                if opened and opened[-1] == char:
+                    chunk.append(f"</{HTML_TAGS[opened.pop()]}>")
+                else:
+                    chunk.append(f"<{HTML_TAGS[char]}>")
+                    opened.append(char)
+            else:
+                chunk.append(escape_html(char))
+        converted.append("".join(chunk))
+    if opened:
+        raise ValueError(f"Unclosed `{opened[-1]}` in the template")
+    return converted
+
+
+def _format_literal(text: str) -> str:
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+class Template:
+    """
+    MarkdownV2 message template with `str.format` fields, e.g. `*{name}*`,
+    converted once for every parse mode into a format string, the fields are rendered as they are given
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        literals: List[str] = []
+        fields: List[str] = []
+        names: List[str] = []
+        for literal, name, spec, conversion in Formatter().parse(source):
+            literals.append(literal)
+            if name is None:
+                continue
+            if not name.isidentifier():
+                raise ValueError(f"Unsupported template field `{name}`")
+            names.append(name)
+            fields.append("{%s%s%s}" % (name, f"!{conversion}" if conversion else "", f":{spec}" if spec else ""))
+        if len(literals) == len(fields):
+            literals.append("")
+        self.fields = tuple(dict.fromkeys(names))
+        self._formats: Dict[str, str] = {
+            "MarkdownV2": self._join(literals, fields),
+            "Markdown": self._join(_to_markdown(literals), fields),
+            "HTML": self._join(_to_html(literals), fields),
+        }
+
+    @staticmethod
+    def _join(literals: List[str], fields: List[str]) -> str:
+        return "".join(_format_literal(literal) + field for literal, field in zip(literals, fields)) + \
+            _format_literal(literals[-1])
+
+    def render(self, parse_mode: str, **fields) -> str:
+        return self._formats[parse_mode].format_map(fields)
+
+
+class Timestamps:
+    """Formatted and escaped local time, the current one is formatted once per second"""
+
+    def __init__(self, escape: Callable[[str], str], fmt: str = TIMESTAMP_FORMAT):
+        self.escape = escape
+        self.fmt = fmt
+        self._second: Optional[int] = None
+        self._now = ""
+
+    def at(self, timestamp: float) -> str:
+        return self.escape(datetime.fromtimestamp(timestamp).strftime(self.fmt))
+
+    def now(self) -> str:
+        second = int(time.time())
+        if second != self._second:
+            self._now = self.at(second)
+            self._second = second
+        return self._now
+
+
+class Renderer:
+    """Escapes the values and renders the templates for the parse mode of the bot"""
+
+    def __init__(self, parse_mode: Optional[str] = None):
+        self.parse_mode = parse_mode or DEFAULT_PARSE_MODE
+        self.escape = ESCAPERS[self.parse_mode]
+        self.code = CODE_ESCAPERS[self.parse_mode]
+        self.timestamps = Timestamps(self.escape)
+
+    def __call__(self, template: Template, **fields) -> str:
+        return template.render(self.parse_mode, **fields)
+
+    def now(self) -> str:
+        return self.timestamps.now()
+
+    def timestamp(self, timestamp: float) -> str:
+        return self.timestamps.at(timestamp)
@@ -0,0 +1,263 @@
+"""
+Deadlines, retries, hedging and a circuit breaker for the Wialon calls of a host.
+
+Reads are idempotent: a failed attempt is retried after a jittered exponential backoff,
+and an attempt slower than the recent p95 of its method gets a duplicate, the first
+answer wins. Writes get only the deadline, an interrupted write may have been applied.
+While the host is failing the breaker rejects the calls at once with `CircuitOpenError`,
+after `reset_timeout` a single probe call decides whether to close it again.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+import aiohttp
+from aiowialon import WialonError
+from aiowialon.exceptions import (WialonErrorPerformingRequest, WialonExecutionTimeExceededError,
+                                  WialonReachedConcurrentRequestLimit, WialonRequestLimitExceededError)
+
+from wialonblock.metrics import (WIALON_BREAKER_STATE, WIALON_BREAKER_REJECTED, WIALON_RETRIES, WIALON_HEDGED,
+                                 WIALON_TIMEOUTS)
+
+# Seconds a whole call may take, the retries and the hedged duplicates included
+READ_DEADLINE = 10
+WRITE_DEADLINE = 15
+# Attempts of a read, the first one included
+READ_ATTEMPTS = 3
+# Backoff before the n-th retry is random up to min(BACKOFF_MAX, BACKOFF_BASE * 2 ** n)
+BACKOFF_BASE = 0.2
+BACKOFF_MAX = 2.0
+
+# A read is duplicated when it takes longer than this quantile of the recent latencies of its method
+HEDGE_QUANTILE = 0.95
+# Latencies kept per method and needed before hedging starts
+LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 50
+# Never hedge sooner than this, seconds
+HEDGE_MIN_DELAY = 0.05
+
+# Consecutive failed requests that open the breaker and seconds before the probe
+BREAKER_FAILURES = 5
+BREAKER_RESET_TIMEOUT = 30
+
+# Wialon errors meaning the host itself is in trouble, the rest are answers of a healthy host
+_UNHEALTHY_WIALON_ERRORS = (WialonErrorPerformingRequest, WialonExecutionTimeExceededError,
+                            WialonReachedConcurrentRequestLimit, WialonRequestLimitExceededError)
+
+
+class CircuitOpenError(ConnectionError):
+    """The call was rejected without a request, the host is considered unavailable"""
+
+
+def is_unavailable(error: BaseException) -> bool:
+    """The error tells about the host health, not about the call"""
+    if isinstance(error, WialonError):
+        return isinstance(error, _UNHEALTHY_WIALON_ERRORS)
+    # connection errors are OSError, `asyncio.timeout` raises TimeoutError
+    return isinstance(error, (aiohttp.ClientError, OSError, TimeoutError))
+
+
+class BreakerState(IntEnum):
+    CLOSED = 0
+    OPEN = 1
+    HALF_OPEN = 2
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive failed requests and rejects the calls for `reset_timeout` seconds,
+    then lets a single probe through: its success closes the breaker, its failure opens it again
+    """
+
+    def __init__(self, host: str, failures: int = BREAKER_FAILURES, reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.host = host
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self._state = BreakerState.CLOSED
+        self._failed = 0
+        self._opened_at = 0.0
+        self._probing = False
+        WIALON_BREAKER_STATE.set(BreakerState.CLOSED, host)
+
+    @property
+    def state(self) -> BreakerState:
+        if self._state is BreakerState.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._set_state(BreakerState.HALF_OPEN)
+        return self._state
+
+    def _set_state(self, state: BreakerState):
+        self._state = state
+        WIALON_BREAKER_STATE.set(state, self.host)
+
+    def acquire(self, method: str) -> bool:
+        """
+        Raises `CircuitOpenError` if the call is not allowed,
+        returns whether it is the probe, whose outcome must be reported with `release`
+        """
+        state = self.state
+        if state is BreakerState.CLOSED:
+            return False
+        if state is BreakerState.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        WIALON_BREAKER_REJECTED.inc(self.host, method)
+        raise CircuitOpenError(f"Wialon host {self.host} is unavailable")
+
+    def release(self, probe: bool, healthy: Optional[bool]):
+        """Outcome of a call, None if it was cancelled before the host answered"""
+        if probe:
+            self._probing = False
+        if healthy is None:
+            return
+        if not healthy:
+            self.failed()
+        elif self._failed or self._state is not BreakerState.CLOSED:
+            self._failed = 0
+            if self._state is not BreakerState.CLOSED:
+                logging.warning("Wialon host %s is available again, circuit closed", self.host)
+                self._set_state(BreakerState.CLOSED)
+
+    def failed(self):
+        """A failed request, e.g. the one cut off by its deadline"""
+        self._failed += 1
+        if self._state is BreakerState.CLOSED:
+            if self._failed < self.failures:
+                return
+            logging.error("Wialon host %s failed %d times in a row, circuit opened", self.host, self._failed)
+        self._opened_at = time.monotonic()
+        self._set_state(BreakerState.OPEN)
+
+
+class LatencyWindow:
+    """Latencies of the last `size` calls, the quantile is recomputed every `size // 10` of them"""
+
+    def __init__(self, size: int = LATENCY_WINDOW):
+        self._samples: Deque[float] = deque(maxlen=size)
+        self._recompute = max(1, size // 10)
+        self._added = 0
+        self._quantiles: Dict[float, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, latency: float):
+        self._samples.append(latency)
+        self._added += 1
+        if self._added % self._recompute == 0:
+            self._quantiles.clear()
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        if q not in self._quantiles:
+            ordered = sorted(self._samples)
+            self._quantiles[q] = ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+        return self._quantiles[q]
+
+
+class CallPolicy:
+    """Resilient calls to a single Wialon host, `call` creates a new request on every invocation"""
+
+    def __init__(self, host: str, breaker: Optional[CircuitBreaker] = None,
+                 read_deadline: float = READ_DEADLINE, write_deadline: float = WRITE_DEADLINE,
+                 read_attempts: int = READ_ATTEMPTS):
+        self.host = host
+        self.breaker = breaker if breaker is not None else CircuitBreaker(host)
+        self.read_deadline = read_deadline
+        self.write_deadline = write_deadline
+        self.read_attempts = read_attempts
+        self._latencies: Dict[str, LatencyWindow] = {}
+
+    def hedge_delay(self, method: str) -> Optional[float]:
+        window = self._latencies.get(method)
+        if window is None or len(window) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_DELAY, window.quantile(HEDGE_QUANTILE))
+
+    async def _attempt(self, method: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """A single request through the breaker"""
+        probe = self.breaker.acquire(method)
+        healthy = None
+        start = time.perf_counter()
+        try:
+            result = await call()
+        except Exception as e:
+            healthy = not is_unavailable(e)
+            raise
+        else:
+            healthy = True
+            self._latencies.setdefault(method, LatencyWindow()).add(time.perf_counter() - start)
+            return result
+        finally:
+            self.breaker.release(probe, healthy)
+
+    async def _hedged(self, method: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """The attempt and, if it is slow and the host is healthy, its duplicate, the first success wins"""
+        delay = self.hedge_delay(method)
+        tasks = [asyncio.create_task(self._attempt(method, call))]
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done and self.breaker.state is BreakerState.CLOSED:
+                    WIALON_HEDGED.inc(self.host, method)
+                    tasks.append(asyncio.create_task(self._attempt(method, call)))
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def read(self, method: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Idempotent call: deadline, retries with backoff and hedging"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.read_deadline
+        attempt = 0
+        while True:
+            timeout = asyncio.timeout_at(deadline)
+            try:
+                async with timeout:
+                    return await self._hedged(method, call)
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                if timeout.expired():
+                    self._timed_out(method)
+                    raise
+                attempt += 1
+                if not is_unavailable(e) or attempt >= self.read_attempts:
+                    raise
+                backoff = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+                if loop.time() + backoff >= deadline:
+                    raise
+                WIALON_RETRIES.inc(self.host, method)
+                logging.warning("Wialon %s to %s failed, retry in %.2fs: %r", method, self.host, backoff, e)
+                await asyncio.sleep(backoff)
+
+    async def write(self, method: str, call: Callable[[], Awaitable[Any]]) -> Any:
+        """Not idempotent call: deadline only"""
+        timeout = asyncio.timeout(self.write_deadline)
+        try:
+            async with timeout:
+                return await self._attempt(method, call)
+        except TimeoutError:
+            if timeout.expired():
+                self._timed_out(method)
+            raise
+
+    def _timed_out(self, method: str):
+        # the cancelled attempts don't report themselves
+        WIALON_TIMEOUTS.inc(self.host, method)
+        self.breaker.failed()
+        logging.error("Wialon %s to %s exceeded its deadline", method, self.host)
@@ -0,0 +1,190 @@
+import logging
+import operator
+import re
+from functools import lru_cache
+from typing import Callable, Collection, Dict, Iterable, List, Optional, Set, Tuple
+
+from aiowialon.types import AvlEvent
+from aiowialon.types.avl_events import AvlEventType
+
+# Characters that turn a search into a Wialon mask, otherwise it is a substring search
+MASK_CHARACTERS = "*|><=!"
+TRIGRAM = 3
+
+_COMPARISONS = (
+    (">=", operator.ge),
+    ("<=", operator.le),
+    (">", operator.gt),
+    ("<", operator.lt),
+    ("=", operator.eq),
+)
+
+# (case-folded name, comparison key) -> matches
+Matcher = Callable[[str, Tuple], bool]
+
+
+def is_mask(pattern: str) -> bool:
+    return any(char in MASK_CHARACTERS for char in pattern)
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + TRIGRAM] for i in range(len(text) - TRIGRAM + 1)}
+
+
+def _compare_key(value: str) -> Tuple:
+    # numbers are compared as numbers, like Wialon does for numeric names
+    try:
+        return 0, float(value)
+    except ValueError:
+        return 1, value
+
+
+def _glob_matcher(mask: str) -> Matcher:
+    parts = mask.split("*")
+    if len(parts) == 3 and not parts[0] and not parts[2]:
+        needle = parts[1]
+        return lambda name, key: needle in name
+    if len(parts) == 2 and not parts[1]:
+        prefix = parts[0]
+        return lambda name, key: name.startswith(prefix)
+    if len(parts) == 1:
+        return lambda name, key: name == mask
+    regex = re.compile(".*".join(re.escape(part) for part in parts), re.DOTALL)
+    return lambda name, key: regex.fullmatch(name) is not None
+
+
+@lru_cache(maxsize=1024)
+def _compile_alternative(mask: str) -> Tuple[Matcher, Tuple[str, ...]]:
+    """
+    Matcher of a single (already case-folded) `|` alternative and the trigrams
+    every matching name contains, empty when the index can't narrow it down.
+    """
+    negate = mask.startswith("!")
+    if negate:
+        mask = mask[1:]
+
+    for prefix, compare in _COMPARISONS:
+        if mask.startswith(prefix):
+            value = _compare_key(mask[len(prefix):])
+            match = lambda name, key, compare=compare: compare(key, value)
+            required = ()
+            break
+    else:
+        match = _glob_matcher(mask)
+        required = tuple(sorted(set().union(*(_trigrams(part) for part in mask.split("*")))))
+
+    if negate:
+        return (lambda name, key: not match(name, key)), ()
+    return match, required
+
+
+class UnitNamesIndex:
+    """
+    Names of the units kept in memory with a trigram index over the case-folded names,
+    so the searches of the chats are answered locally with the Wialon mask semantics:
+    `|` separates alternatives, `*` matches any characters, `>`, `<`, `>=`, `<=`, `=`
+    compare the whole name, `!` negates; a plain text is searched as a substring.
+    Names are updated from the `avl_evts` stream of the subscribed units.
+    """
+
+    def __init__(self):
+        self._names: Dict[int, str] = {}
+        self._folded: Dict[int, str] = {}
+        self._keys: Dict[int, Tuple] = {}
+        self._trigrams: Dict[str, Set[int]] = {}
+        # units not returned by Wialon, e.g. not visible to the token user
+        self._absent: Set[int] = set()
+        self._subscribed: Set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def name(self, uid: int) -> Optional[str]:
+        return self._names.get(uid)
+
+    def missing(self, uids: Iterable[int]) -> List[int]:
+        return [uid for uid in uids if uid not in self._names and uid not in self._absent]
+
+    def put(self, uid: int, name: str):
+        if self._names.get(uid) == name:
+            return
+        self.remove(uid)
+        folded = name.casefold()
+        self._names[uid] = name
+        self._folded[uid] = folded
+        self._keys[uid] = _compare_key(folded)
+        for trigram in _trigrams(folded):
+            self._trigrams.setdefault(trigram, set()).add(uid)
+
+    def put_absent(self, uids: Iterable[int]):
+        self._absent.update(uid for uid in uids if uid not in self._names)
+
+    def remove(self, uid: int):
+        self._names.pop(uid, None)
+        self._absent.discard(uid)
+        self._keys.pop(uid, None)
+        folded = self._folded.pop(uid, None)
+        if folded is None:
+            return
+        for trigram in _trigrams(folded):
+            postings = self._trigrams.get(trigram)
+            if postings is not None:
+                postings.discard(uid)
+                if not postings:
+                    del self._trigrams[trigram]
+
+    def unsubscribed(self, uids: Iterable[int]) -> List[int]:
+        return [uid for uid in uids if uid not in self._subscribed]
+
+    def subscribed(self, uids: Iterable[int]):
+        self._subscribed.update(uids)
+
+    def detach(self) -> "UnitNamesIndex":
+        """Moves the names to a new index and resets this one"""
+        detached = UnitNamesIndex()
+        detached._names, detached._folded, detached._keys, detached._trigrams = \
+            self._names, self._folded, self._keys, self._trigrams
+        self._names, self._folded, self._keys, self._trigrams = {}, {}, {}, {}
+        self.reset()
+        return detached
+
+    def reset(self):
+        """Drops all names and subscriptions, e.g. on a new session"""
+        self._names.clear()
+        self._folded.clear()
+        self._keys.clear()
+        self._trigrams.clear()
+        self._absent.clear()
+        self._subscribed.clear()
+
+    def _candidates(self, required: Tuple[str, ...], uids: Collection[int]) -> Iterable[int]:
+        if not required:
+            return uids
+        postings = sorted((self._trigrams.get(trigram, set()) for trigram in required), key=len)
+        candidates = postings[0].intersection(*postings[1:])
+        return candidates & uids if isinstance(uids, (set, frozenset)) else candidates.intersection(uids)
+
+    def search(self, pattern: str, uids: Collection[int]) -> List[Tuple[int, str]]:
+        """Units of `uids` matching the pattern as (uid, name) pairs sorted by name"""
+        mask = pattern.casefold()
+        if not is_mask(mask):
+            mask = f"*{mask}*"
+        folded, keys = self._folded, self._keys
+        found: Set[int] = set()
+        for alternative in mask.split("|"):
+            match, required = _compile_alternative(alternative)
+            found.update(
+                uid for uid in self._candidates(required, uids)
+                if uid in folded and uid not in found and match(folded[uid], keys[uid])
+            )
+        return [(uid, self._names[uid]) for uid in sorted(found, key=lambda uid: (folded[uid], uid))]
+
+    def on_avl_event(self, event: AvlEvent):
+        uid = event.data.i
+        if uid not in self._names:
+            return
+        if event.data.t == AvlEventType.UPDATE and 'nm' in event.data.d:
+            logging.info("Unit %s renamed to `%s` by event", uid, event.data.d['nm'])
+            self.put(uid, event.data.d['nm'])
+        elif event.data.t == AvlEventType.DELETE:
+            self.remove(uid)
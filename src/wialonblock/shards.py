@@ -0,0 +1,291 @@
+"""
+Supervisor mode: the chats are split between worker processes by a consistent hash of `chat_id`.
+
+The supervisor is the only process that receives updates (long polling or webhook),
+it routes every raw update to the queue of the shard owning its chat and restarts
+dead shards. Each shard runs the usual dispatcher and handlers over `dp.feed_raw_update`
+and owns all the state of its chats, nothing is shared between the processes:
+
+- Wialon sessions, membership caches and names index: only the groups of the owned chats
+- pages cache: callbacks of a chat always come back to the same shard
+- message expiries: persisted to a file per shard, `<expiry_path stem>.<shard><suffix>`
+- fleet snapshot: a single SQLite file in WAL mode, each shard upserts the groups of its chats
+- flood control: per-chat buckets as usual, the global limit is split evenly between the shards
+- metrics: served by every shard on `metrics.port + shard index`
+
+Changing the number of workers moves some chats to another shard, their caches are
+simply rebuilt there. Pending expiries stay in the old shard file and are still fired
+by the shard with that index, while it exists. A crashed shard is restarted
+with an empty queue, the updates waiting for it are lost.
+"""
+
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import queue
+import signal
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot
+from aiohttp import web
+
+from wialonblock.bot import create_bot, setup_dispatcher, set_default_commands, start_metrics, dp
+from wialonblock.config import Config, load_config, WebhookConfig
+from wialonblock.logs import setup_logging
+from wialonblock.middlewares import FloodControlMiddleware, GLOBAL_RATE
+from wialonblock.startup import STARTUP, FirstUpdatesMiddleware
+
+# Points of every shard on the hash ring, evens out the partitions
+RING_REPLICAS = 64
+# Updates waiting for a shard, new ones are dropped when it is full
+SHARD_QUEUE_SIZE = 1000
+POLLING_TIMEOUT = 30
+# Seconds for the shards to finish the accepted updates on shutdown
+SHUTDOWN_TIMEOUT = 30
+HEALTH_CHECK_INTERVAL = 5
+
+# Update types that belong to a chat, see `Update` fields
+CHAT_UPDATE_TYPES = (
+    "message", "edited_message", "channel_post", "edited_channel_post",
+    "my_chat_member", "chat_member", "chat_join_request",
+)
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class ShardRing:
+    """Consistent hash ring, maps a chat to one of `shards` shards"""
+
+    def __init__(self, shards: int, replicas: int = RING_REPLICAS):
+        points = sorted((_hash(f"shard-{index}-{replica}"), index)
+                        for index in range(shards) for replica in range(replicas))
+        self._hashes = [point for point, index in points]
+        self._shards = [index for point, index in points]
+
+    def shard_for(self, chat_id) -> int:
+        position = bisect.bisect(self._hashes, _hash(str(chat_id))) % len(self._hashes)
+        return self._shards[position]
+
+
+def update_chat_id(update: Dict[str, Any]) -> Optional[int]:
+    """Chat of a raw update, the user for the updates without a chat"""
+    for update_type in CHAT_UPDATE_TYPES:
+        if update_type in update:
+            return update[update_type]["chat"]["id"]
+    if callback_query := update.get("callback_query"):
+        if message := callback_query.get("message"):
+            return message["chat"]["id"]
+        return callback_query["from"]["id"]
+    for event in update.values():
+        if isinstance(event, dict) and "from" in event:
+            return event["from"]["id"]
+    return None
+
+
+def shard_path(path: Path, index: int) -> Path:
+    return path.with_name(f"{path.stem}.{index}{path.suffix}")
+
+
+async def run_shard(config_path: Path, index: int, count: int, updates: multiprocessing.Queue) -> None:
+    config: Config = load_config(config_path)
+    ring = ShardRing(count)
+    groups = [group for group in config.tg.groups if ring.shard_for(group.chat_id) == index]
+    flood_control = FloodControlMiddleware(global_rate=GLOBAL_RATE / count)
+    bot = create_bot(config, groups, shard_path(config.storage.expiry_path, index), flood_control)
+    # the commands are set once by the supervisor
+    setup_dispatcher(set_commands=False)
+    logging.info("Shard %d of %d owns %d chats", index, count, len(groups))
+    metrics = await start_metrics(config.metrics, port_offset=index)
+    STARTUP.mark("setup")
+
+    handling = set()
+
+    async def handle(update: Dict[str, Any]):
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception as e:
+            logging.exception(e)
+
+    await bot.wialon_worker.warm_start()
+    STARTUP.mark("snapshot")
+    # the updates come from the supervisor, the shard is ready with its chats prefetched
+    STARTUP.await_phases("startup", "prefetch")
+    await dp.emit_startup(bot=bot)
+    STARTUP.mark("startup")
+    try:
+        while (update := await asyncio.to_thread(updates.get)) is not None:
+            task = asyncio.create_task(handle(update))
+            handling.add(task)
+            task.add_done_callback(handling.discard)
+    finally:
+        if handling:
+            _, pending = await asyncio.wait(handling, timeout=SHUTDOWN_TIMEOUT)
+            if pending:
+                logging.error("Shutdown timeout, dropping %d in-flight updates", len(pending))
+        await dp.emit_shutdown(bot=bot)
+        if metrics is not None:
+            await metrics.cleanup()
+        await flood_control.close()
+        await bot.session.close()
+        logging.info("Shard %d stopped.", index)
+
+
+def shard_main(config_path: Path, index: int, count: int, updates: multiprocessing.Queue) -> None:
+    """Entry point of a shard process"""
+    # replaces the logging configured by the main module, which the spawned process imports again
+    listener = setup_logging(load_config(config_path).logging, shard=index)
+    # the supervisor stops the shards through their queues
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    try:
+        asyncio.run(run_shard(config_path, index, count, updates))
+    finally:
+        listener.stop()
+
+
+class Supervisor:
+    """Runs the shard processes and routes the updates to them"""
+
+    def __init__(self, config_path: Path, workers: int):
+        self.config_path = config_path
+        self.workers = workers
+        self.ring = ShardRing(workers)
+        self._context = multiprocessing.get_context("spawn")
+        self._queues: List[multiprocessing.Queue] = [
+            self._context.Queue(SHARD_QUEUE_SIZE) for _ in range(workers)
+        ]
+        self._processes: List[Optional[multiprocessing.Process]] = [None] * workers
+
+    def _start_shard(self, index: int):
+        process = self._context.Process(
+            target=shard_main, name=f"wialonblock-shard-{index}",
+            args=(self.config_path, index, self.workers, self._queues[index]),
+        )
+        process.start()
+        self._processes[index] = process
+        logging.info("Shard %d started, pid %d", index, process.pid)
+
+    def start(self):
+        for index in range(self.workers):
+            self._start_shard(index)
+
+    def restart_dead(self):
+        for index, process in enumerate(self._processes):
+            if process is not None and not process.is_alive():
+                logging.error("Shard %d exited with code %s, restarting", index, process.exitcode)
+                # a process killed inside `get` leaves the queue locked, the updates in it are lost
+                self._queues[index].close()
+                self._queues[index] = self._context.Queue(SHARD_QUEUE_SIZE)
+                self._start_shard(index)
+
+    def route(self, update: Dict[str, Any]):
+        chat_id = update_chat_id(update)
+        index = self.ring.shard_for(chat_id if chat_id is not None else update.get("update_id", 0))
+        try:
+            self._queues[index].put_nowait(update)
+        except queue.Full:
+            logging.error("Shard %d queue is full, update %s dropped", index, update.get("update_id"))
+
+    async def stop(self):
+        for updates in self._queues:
+            updates.put(None)
+        for index, process in enumerate(self._processes):
+            if process is None:
+                continue
+            await asyncio.to_thread(process.join, SHUTDOWN_TIMEOUT + 5)
+            if process.is_alive():
+                # the shards ignore SIGTERM
+                logging.error("Shard %d did not stop in time, killing", index)
+                process.kill()
+
+    async def poll(self, bot: Bot, stop: asyncio.Event):
+        # getUpdates is refused while a webhook is set
+        await bot.delete_webhook()
+        allowed_updates = dp.resolve_used_update_types()
+        offset = None
+        while not stop.is_set():
+            request = asyncio.create_task(bot.get_updates(
+                offset=offset, timeout=POLLING_TIMEOUT, allowed_updates=allowed_updates,
+                request_timeout=POLLING_TIMEOUT + 10,
+            ))
+            stopping = asyncio.create_task(stop.wait())
+            await asyncio.wait((request, stopping), return_when=asyncio.FIRST_COMPLETED)
+            stopping.cancel()
+            if not request.done():
+                request.cancel()
+                break
+            try:
+                updates = request.result()
+            except Exception as e:
+                logging.error("Failed to get updates: %s", e)
+                await asyncio.sleep(1)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                self.route(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+
+    async def serve_webhook(self, bot: Bot, webhook: WebhookConfig, stop: asyncio.Event):
+        async def handle(request: web.Request) -> web.Response:
+            if webhook.secret_token and \
+                    request.headers.get("X-Telegram-Bot-Api-Secret-Token") != webhook.secret_token:
+                return web.Response(status=401)
+            self.route(await request.json())
+            return web.Response()
+
+        app = web.Application()
+        app.router.add_post(webhook.path, handle)
+        runner = web.AppRunner(app, handle_signals=False)
+        await runner.setup()
+        site = web.TCPSite(runner, webhook.host, webhook.port)
+        try:
+            await site.start()
+            await bot.set_webhook(webhook.url, secret_token=webhook.secret_token,
+                                  allowed_updates=dp.resolve_used_update_types())
+            logging.info("Listening for webhook updates on %s:%d%s", webhook.host, webhook.port, webhook.path)
+            await stop.wait()
+        finally:
+            await runner.cleanup()
+
+    async def watch(self, stop: asyncio.Event):
+        """Restarts the dead shards until stopped"""
+        while not stop.is_set():
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+            self.restart_dead()
+
+
+async def run_supervisor(config_path: Path, workers: int) -> None:
+    config: Config = load_config(config_path)
+    # handlers are only registered to resolve the used update types
+    setup_dispatcher()
+    supervisor = Supervisor(config_path, workers)
+    bot = Bot(token=config.tg.bot_token)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    supervisor.start()
+    watch = asyncio.create_task(supervisor.watch(stop))
+    try:
+        await set_default_commands(bot)
+        logging.info("Starting supervisor with %d shards in %s mode...", workers, config.tg.mode)
+        if config.tg.mode == "webhook":
+            await supervisor.serve_webhook(bot, config.tg.webhook, stop)
+        else:
+            # the chats are prefetched and reported by the shards
+            STARTUP.await_phases("first getUpdates")
+            bot.session.middleware(FirstUpdatesMiddleware())
+            await supervisor.poll(bot, stop)
+    finally:
+        watch.cancel()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+        await supervisor.stop()
+        await bot.session.close()
+        logging.info("Supervisor stopped.")
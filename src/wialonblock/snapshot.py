@@ -0,0 +1,104 @@
+"""
+Local snapshot of the fleet: members of the Wialon groups the chats are bound to
+and the names of their units, kept in a SQLite file in WAL mode, so the readers
+never wait for a writer and the shards can share a single file.
+
+The rows are only upserted, every process writes the groups of its own chats
+and leaves the rest as they are. The methods are blocking, run them in a thread.
+"""
+
+import json
+import sqlite3
+import time
+from contextlib import closing
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Sequence, Tuple
+
+# Seconds a writer waits for the lock held by another process
+BUSY_TIMEOUT = 5
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS groups (
+        host TEXT NOT NULL,
+        name TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        uids TEXT NOT NULL,
+        saved_at REAL NOT NULL,
+        PRIMARY KEY (host, name)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS units (
+        host TEXT NOT NULL,
+        id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        PRIMARY KEY (host, id)
+    ) WITHOUT ROWID
+    """,
+)
+
+
+@dataclass
+class SnapshotGroup:
+    id: int
+    uids: Tuple[int, ...]
+    saved_at: float  # unix time the members were loaded from Wialon
+
+
+@dataclass
+class FleetSnapshot:
+    groups: Dict[str, SnapshotGroup]
+    names: Dict[int, str]
+
+
+class SnapshotStore:
+    """Fleet snapshots of the Wialon hosts in a single SQLite file"""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # a lost last write only makes the next start a bit colder
+        connection.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            connection.execute(statement)
+        return connection
+
+    def load(self, host: str, group_names: Iterable[str]) -> FleetSnapshot:
+        """Saved members of the groups and the names of their units"""
+        group_names = set(group_names)
+        groups = {}
+        with closing(self._connect()) as connection:
+            for name, group_id, uids, saved_at in connection.execute(
+                    "SELECT name, id, uids, saved_at FROM groups WHERE host = ?", (host,)
+            ):
+                if name in group_names:
+                    groups[name] = SnapshotGroup(group_id, tuple(json.loads(uids)), saved_at)
+            members = {uid for group in groups.values() for uid in group.uids}
+            names = {
+                uid: name for uid, name in connection.execute("SELECT id, name FROM units WHERE host = ?", (host,))
+                if uid in members
+            }
+        return FleetSnapshot(groups, names)
+
+    def save(self, host: str, groups: Iterable[Tuple[str, int, Sequence[int], float]],
+             names: Iterable[Tuple[int, str]]):
+        """Upserts the (name, id, uids, saved_at) groups and the (uid, name) units in one transaction"""
+        with closing(self._connect()) as connection, connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO groups (host, name, id, uids, saved_at) VALUES (?, ?, ?, ?, ?)",
+                [(host, name, group_id, json.dumps(list(uids)), saved_at) for name, group_id, uids, saved_at in groups]
+            )
+            connection.executemany(
+                "INSERT OR REPLACE INTO units (host, id, name) VALUES (?, ?, ?)",
+                [(host, uid, name) for uid, name in names]
+            )
+
+
+def wall_time(monotonic: float) -> float:
+    """Unix time of a `time.monotonic()` reading"""
+    return time.time() - (time.monotonic() - monotonic)
@@ -0,0 +1,83 @@
+"""
+Time to ready of the process, broken down by the startup phases.
+
+The sequential phases (imports, config, setup, ...) are marked as they end and took the time
+since the previous mark. The background ones, the Wialon login and the prefetch of the chats,
+are recorded with their own durations when they finish. Once all the awaited phases are in,
+the breakdown is logged as a single line and the time to ready is set as a gauge.
+"""
+
+import logging
+import time
+from typing import Dict, Set, TYPE_CHECKING
+
+# imported by `__main__` first, the imports of the bot are measured from here
+STARTED = time.perf_counter()
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType  # noqa: E402
+from aiogram.methods import GetUpdates, Response, TelegramMethod  # noqa: E402
+from aiogram.methods.base import TelegramType  # noqa: E402
+
+from wialonblock.metrics import STARTUP_PHASE, STARTUP_READY  # noqa: E402
+
+if TYPE_CHECKING:
+    from aiogram import Bot
+
+
+class StartupProfile:
+    def __init__(self, started: float):
+        self.started = started
+        self.phases: Dict[str, float] = {}
+        self._last_mark = started
+        self._awaited: Set[str] = set()
+        self._reported = False
+
+    def mark(self, phase: str):
+        """Ends a sequential phase"""
+        now = time.perf_counter()
+        self.record(phase, now - self._last_mark)
+        self._last_mark = now
+
+    def record(self, phase: str, seconds: float):
+        self.phases[phase] = seconds
+        STARTUP_PHASE.set(seconds, phase)
+        self._check()
+
+    def await_phases(self, *phases: str):
+        """The process is ready once these phases are recorded"""
+        self._awaited.update(phases)
+        self._check()
+
+    def _check(self):
+        if self._reported or not self._awaited or not self._awaited <= self.phases.keys():
+            return
+        self._reported = True
+        ready = time.perf_counter() - self.started
+        STARTUP_READY.set(ready)
+        logging.info("Ready in %.3fs: %s", ready,
+                     ", ".join(f"{phase} {seconds:.3f}s" for phase, seconds in self.phases.items()))
+
+
+STARTUP = StartupProfile(STARTED)
+
+
+class FirstUpdatesMiddleware(BaseRequestMiddleware):
+    """
+    Marks the `first getUpdates` phase when the first `getUpdates` is sent,
+    the request itself long-polls until an update comes, so it is not waited for
+    """
+
+    def __init__(self, profile: StartupProfile = STARTUP):
+        self.profile = profile
+        self.sent = False
+
+    async def __call__(
+            self,
+            make_request: NextRequestMiddlewareType[TelegramType],
+            bot: "Bot",
+            method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if not self.sent and isinstance(method, GetUpdates):
+            self.sent = True
+            self.profile.mark("first getUpdates")
+        return await make_request(bot, method)
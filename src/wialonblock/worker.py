@@ -1,32 +1,110 @@
+import asyncio
+import json
 import logging
-from dataclasses import dataclass
+import sqlite3
+import time
+from dataclasses import dataclass, field
 from enum import StrEnum
-from typing import Dict, Any, Tuple, Optional, Type
+from typing import (Dict, Any, Tuple, Optional, Type, Callable, Awaitable, List, Iterable, Sequence, AsyncIterator,
+                    Hashable)
 
-from aiowialon import Wialon
-from aiowialon.types import flags
+import aiohttp
+from aiowialon import Wialon, WialonError
+from aiowialon.exceptions import WialonInvalidSession, WialonSessionExpiredOrIPChangedError
+from aiowialon.logger import aiohttp_trace_config
+from aiowialon.types import flags, AvlEvent
+from aiowialon.types.avl_events import AvlEventType
 from aiowialon.types.flags import UnitsDataFlag
+from aiowialon.validators import WialonCallRespValidator
 
 from wialonblock.config import TelegramGroup
+from wialonblock.metrics import (WIALON_LATENCY, WIALON_ERRORS, WIALON_IN_FLIGHT, SINGLEFLIGHT_WAITERS,
+                                 SINGLEFLIGHT_SHARED, SINGLEFLIGHT_CALLS, SNAPSHOT_READS, WIALON_FALLBACK_READS)
+from wialonblock.resilience import CallPolicy, is_unavailable
+from wialonblock.search import UnitNamesIndex, is_mask
+from wialonblock.snapshot import SnapshotStore, SnapshotGroup, wall_time
+
+
+# HTTP connections kept open to a Wialon host
+MAX_CONNECTIONS = 10
 
 
 class WialonSession(Wialon):
+    """
+    Wialon client that sends all the requests through a single pool of
+    at most `max_connections` keep-alive connections to the host,
+    instead of opening a new connection for every request
+    """
+
+    def __init__(self, *args, max_connections: int = MAX_CONNECTIONS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_connections = max_connections
+        # `Wialon` caps the requests in flight at 10 regardless of the pool
+        self._Wialon__semaphore = asyncio.Semaphore(max_connections)
+        self._http: Optional[aiohttp.ClientSession] = None
 
     @property
     def base_url(self) -> str:
         return self._Wialon__base_url
 
+    def _http_session(self) -> aiohttp.ClientSession:
+        if self._http is None or self._http.closed:
+            self._http = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                trust_env=True,
+                trace_configs=[aiohttp_trace_config],
+            )
+        return self._http
+
+    async def request(self, action_name: str, url: str, payload: Any) -> Any:
+        """`Wialon.request` over the pooled connections"""
+        await self._Wialon__exclusive_session_lock.wait()
+
+        if not action_name:
+            action_name = "undefined_action"
+        host = self.base_url
+        WIALON_IN_FLIGHT.inc(host)
+        start = time.perf_counter()
+        try:
+            async with self._Wialon__limiter:
+                async with self._Wialon__semaphore:
+                    async with self._http_session().post(url=url, data=payload, timeout=self._timeout) as response:
+                        await WialonCallRespValidator.validate_headers(response)
+
+                        if await WialonCallRespValidator.has_attachment(response):
+                            return await response.content.read()
+
+                        result = json.loads(await response.read())
+                        await WialonCallRespValidator.validate_result(action_name, result)
+                        return result
+        except (aiohttp.ClientError, WialonError) as e:
+            WIALON_ERRORS.inc(host, action_name, type(e).__name__)
+            logging.error("Wialon request `%s` to %s failed: %r", action_name, self.base_url, e)
+            raise
+        except Exception as e:
+            WIALON_ERRORS.inc(host, action_name, type(e).__name__)
+            raise
+        finally:
+            WIALON_LATENCY.observe(time.perf_counter() - start, host, action_name)
+            WIALON_IN_FLIGHT.dec(host)
+
+    async def close(self):
+        """Closes the pooled connections"""
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+
     async def __aenter__(self):
         """
         Asynchronously enters the context, performing Wialon login.
         """
-        logging.info(f"Attempting Wialon login for host: {self.base_url}...")
+        logging.info("Attempting Wialon login for host: %s...", self.base_url)
         # Use the stored token and app_name for login
         try:
             await self.login()
-            logging.info(f"Successfully logged in to Wialon for host: {self.base_url}")
+            logging.info("Successfully logged in to Wialon for host: %s", self.base_url)
         except Exception as e:
-            logging.error(f"Failed to log in to Wialon for host {self.base_url}: {e}")
+            logging.error("Failed to log in to Wialon for host %s: %s", self.base_url, e)
             # Re-raise the exception to propagate login failure
             raise
         return self  # Important: return self so 'as session' works
@@ -36,16 +114,380 @@ class WialonSession(Wialon):
         Asynchronously exits the context, performing Wialon logout.
         Logs any exceptions that occurred within the 'async with' block.
         """
-        logging.info(f"Attempting Wialon logout for host: {self.base_url}...")
+        logging.info("Attempting Wialon logout for host: %s...", self.base_url)
         try:
             await self.logout()
-            logging.info(f"Successfully logged out from Wialon for host: {self.base_url}")
+            logging.info("Successfully logged out from Wialon for host: %s", self.base_url)
         except Exception as e:
-            logging.error(f"Error during Wialon logout for host {self.base_url}: {e}")
+            logging.error("Error during Wialon logout for host %s: %s", self.base_url, e)
         # If exc_type is not None, an exception occurred in the 'async with' block.
         # By not returning True, the exception will be re-raised after __aexit__.
         if exc_type:
-            logging.error(f"An exception of type {exc_type.__name__} occurred: {exc_val}")
+            logging.error("An exception of type %s occurred: %s", exc_type.__name__, exc_val)
+
+
+# Wialon drops idle sessions after 5 minutes, ping it well before that,
+# each ping also collects the pending avl events of the subscribed items
+KEEPALIVE_INTERVAL = 10
+
+# Cached group membership is refetched after this many seconds even without events
+MEMBERSHIP_TTL = 300
+
+# Data flags requested from Wialon, the bot reads only `id`, `nm` and the group `u`
+UNIT_FLAGS = UnitsDataFlag.BASE
+GROUP_FLAGS = UnitsDataFlag.BASE
+
+# Unit ids per search request when the names are loaded, keeps the requests small
+ID_MASK_CHUNK = 500
+# Chunk requests in flight at once
+ID_MASK_CONCURRENCY = 4
+
+# The fleet snapshot is saved this often, so a crash loses little of it
+SNAPSHOT_INTERVAL = 300
+# Chats whose units are loaded at once by the startup prefetch
+PREFETCH_CONCURRENCY = 4
+# Delays between the attempts of the startup prefetch
+PREFETCH_RETRY_MIN = 1
+PREFETCH_RETRY_MAX = 60
+
+SESSION_EXPIRED_ERRORS = (WialonInvalidSession, WialonSessionExpiredOrIPChangedError)
+
+
+class WialonSessionManager:
+    """
+    Keeps a single long-lived Wialon session shared by all worker calls.
+    Logs in lazily on first use, re-logins transparently when Wialon reports
+    the session as expired and keeps it alive with periodic `avl_evts` pings.
+    Events returned by the pings are passed to the event listeners,
+    reset listeners are notified when the event stream can't be trusted anymore
+    (new session or failed ping), so the subscribers have to drop their state.
+    """
+
+    def __init__(self, host: str, token: str,
+                 session: Type[WialonSession] = WialonSession,
+                 keepalive_interval: float = KEEPALIVE_INTERVAL,
+                 max_connections: int = MAX_CONNECTIONS):
+        self._session = session(token=token, host=host, max_connections=max_connections)
+        self._keepalive_interval = keepalive_interval
+        self._login_lock = asyncio.Lock()
+        self._keepalive_task: Optional[asyncio.Task] = None
+        self._event_listeners: List[Callable[[AvlEvent], Any]] = []
+        self._reset_listeners: List[Callable[[], Any]] = []
+
+    def add_event_listener(self, callback: Callable[[AvlEvent], Any]):
+        self._event_listeners.append(callback)
+
+    def add_reset_listener(self, callback: Callable[[], Any]):
+        self._reset_listeners.append(callback)
+
+    def _reset(self):
+        for callback in self._reset_listeners:
+            callback()
+
+    def _dispatch_events(self, response: Dict[str, Any]):
+        for event in AvlEvent.parse_avl_events_response(response):
+            for callback in self._event_listeners:
+                callback(event)
+
+    @property
+    def session(self) -> WialonSession:
+        return self._session
+
+    @property
+    def sid(self) -> Optional[str]:
+        return self._session._sid
+
+    async def _login(self):
+        logging.info("Attempting Wialon login for host: %s...", self._session.base_url)
+        try:
+            await self._session.login()
+            logging.info("Successfully logged in to Wialon for host: %s", self._session.base_url)
+        except Exception as e:
+            logging.error("Failed to log in to Wialon for host %s: %s", self._session.base_url, e)
+            raise
+        # subscriptions belong to the previous session
+        self._reset()
+        if self._keepalive_task is None or self._keepalive_task.done():
+            self._keepalive_task = asyncio.create_task(self._keepalive(), name="wialon-keepalive")
+
+    async def open(self) -> WialonSession:
+        """Returns the logged in session, performs login on first use"""
+        if self.sid is None:
+            async with self._login_lock:
+                if self.sid is None:
+                    await self._login()
+        return self._session
+
+    async def relogin(self, expired_sid: Optional[str]):
+        """
+        Opens a new session in place of the expired one.
+        Concurrent callers that failed on the same sid share a single login.
+        """
+        async with self._login_lock:
+            if self.sid == expired_sid:
+                logging.warning("Wialon session expired for host: %s, re-login", self._session.base_url)
+                # the session is already invalid on the server side, so don't logout
+                self._session._sid = None
+                await self._login()
+
+    async def call(self, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """
+        Awaits `func(*args, session=session, **kwargs)` with the shared session,
+        retries it once after re-login if the session has expired
+        """
+        session = await self.open()
+        sid = self.sid
+        try:
+            return await func(*args, session=session, **kwargs)
+        except SESSION_EXPIRED_ERRORS:
+            await self.relogin(sid)
+            return await func(*args, session=session, **kwargs)
+
+    async def _keepalive(self):
+        while True:
+            await asyncio.sleep(self._keepalive_interval)
+            sid = self.sid
+            if sid is None:
+                continue
+            try:
+                response = await self._session.avl_evts()
+            except SESSION_EXPIRED_ERRORS:
+                try:
+                    await self.relogin(sid)
+                except Exception as e:
+                    self._reset()
+                    logging.error("Wialon keep-alive re-login failed for host %s: %s", self._session.base_url, e)
+                continue
+            except Exception as e:
+                # events could be lost, don't trust the subscribers state
+                self._reset()
+                logging.error("Wialon keep-alive failed for host %s: %s", self._session.base_url, e)
+                continue
+            try:
+                self._dispatch_events(response)
+            except Exception as e:
+                self._reset()
+                logging.exception(e)
+
+    async def close(self):
+        """Stops keep-alive pings, logs out from Wialon and closes the connections"""
+        if self._keepalive_task is not None:
+            self._keepalive_task.cancel()
+            try:
+                await self._keepalive_task
+            except asyncio.CancelledError:
+                pass
+            self._keepalive_task = None
+        async with self._login_lock:
+            if self.sid is not None:
+                logging.info("Attempting Wialon logout for host: %s...", self._session.base_url)
+                try:
+                    await self._session.logout()
+                    logging.info("Successfully logged out from Wialon for host: %s", self._session.base_url)
+                except Exception as e:
+                    logging.error("Error during Wialon logout for host %s: %s", self._session.base_url, e)
+                finally:
+                    self._session._sid = None
+            await self._session.close()
+
+
+@dataclass
+class GroupMembership:
+    id: int
+    name: str
+    uids: Tuple[int, ...]
+    loaded_at: float
+
+
+class MembershipCache:
+    """
+    Unit ids of the Wialon groups the chats are bound to, kept in memory.
+    Entries are updated from the `avl_evts` stream of the subscribed groups,
+    so a hit costs no Wialon calls, and expire after `ttl` seconds anyway
+    in case the stream silently lost something.
+    Every write, event or invalidation bumps the generation of the group,
+    a read stores its result only if the generation is still the one it started at,
+    so a slow read can't overwrite the members written meanwhile.
+    """
+
+    def __init__(self, ttl: float = MEMBERSHIP_TTL):
+        self.ttl = ttl
+        self._groups: Dict[str, GroupMembership] = {}
+        self._generations: Dict[str, int] = {}
+        self._names: Dict[int, str] = {}
+        self._subscribed: set = set()
+        self._indexes: Dict[Tuple[str, str], "LockIndex"] = {}
+
+    def peek(self, name: str) -> Optional[GroupMembership]:
+        """The entry even if it has expired"""
+        return self._groups.get(name)
+
+    def get(self, name: str) -> Optional[GroupMembership]:
+        group = self._groups.get(name)
+        if group is None or time.monotonic() - group.loaded_at > self.ttl:
+            return None
+        return group
+
+    def entries(self) -> List[GroupMembership]:
+        """All the loaded groups, expired ones included"""
+        return list(self._groups.values())
+
+    def generation(self, name: str) -> int:
+        return self._generations.get(name, 0)
+
+    def generations(self, names: Iterable[str]) -> Tuple[int, ...]:
+        return tuple(self.generation(name) for name in names)
+
+    def put(self, group_id: int, name: str, uids: Iterable[int],
+            generation: Optional[int] = None) -> Optional[GroupMembership]:
+        """
+        Stores the members, a write or an event passes no `generation` and always wins.
+        A read passes the generation it started at, if the group has changed since,
+        its result is dropped and the newer entry is returned, None if it was invalidated.
+        """
+        if generation is not None and generation != self.generation(name):
+            return self._groups.get(name)
+        if generation is None:
+            self._generations[name] = self.generation(name) + 1
+        group = self._groups[name] = GroupMembership(group_id, name, tuple(uids), time.monotonic())
+        self._names[group_id] = name
+        return group
+
+    def lock_index(self, locked: str, unlocked: str,
+                   locked_uids: Tuple[int, ...], unlocked_uids: Tuple[int, ...]) -> "LockIndex":
+        """Returns the index for the members, rebuilds it only when they have changed"""
+        index = self._indexes.get((locked, unlocked))
+        if index is None or not index.built_from(locked_uids, unlocked_uids):
+            index = self._indexes[(locked, unlocked)] = LockIndex(locked_uids, unlocked_uids)
+        return index
+
+    def unsubscribed(self, group_ids: Iterable[int]) -> List[int]:
+        return [gid for gid in group_ids if gid not in self._subscribed]
+
+    def subscribed(self, group_ids: Iterable[int]):
+        self._subscribed.update(group_ids)
+
+    def invalidate(self, name: Optional[str] = None):
+        for name in (list(self._groups) if name is None else [name]):
+            self._generations[name] = self.generation(name) + 1
+            self._groups.pop(name, None)
+
+    def reset(self):
+        """Drops all entries and subscriptions, e.g. on a new session"""
+        self.invalidate()
+        self._subscribed.clear()
+        self._indexes.clear()
+
+    def on_avl_event(self, event: AvlEvent):
+        name = self._names.get(event.data.i)
+        if name is None or name not in self._groups:
+            return
+        if event.data.t == AvlEventType.UPDATE and 'u' in event.data.d:
+            logging.info("Group `%s` members updated by event", name)
+            self.put(event.data.i, name, event.data.d['u'])
+        else:
+            self.invalidate(name)
+
+
+@dataclass
+class GroupMove:
+    uid: int
+    from_group: str
+    to_group: str
+    future: asyncio.Future = field(default_factory=lambda: asyncio.get_running_loop().create_future())
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return tuple(sorted((self.from_group, self.to_group)))
+
+
+class GroupMovesQueue:
+    """
+    Serializes read-modify-write of the groups members per group pair.
+    Moves queued while a write of the pair is in flight are merged
+    into the next one, so concurrent clicks can't overwrite each other
+    and a burst costs a single read and a single batch write.
+    """
+
+    def __init__(self):
+        self._locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+        self._pending: Dict[Tuple[str, str], List[GroupMove]] = {}
+
+    async def submit(self, moves: List[GroupMove],
+                     write: Callable[[List[GroupMove]], Awaitable[None]]) -> List[Optional[Exception]]:
+        """
+        Queues the moves of a single group pair and waits until they are written,
+        `write` is called by whoever takes the pair lock first with all the queued moves.
+        Returns the error of each move or None if it was written.
+        """
+        key = moves[0].key
+        if any(move.key != key for move in moves):
+            raise ValueError("All the moves must belong to the same group pair")
+        self._pending.setdefault(key, []).extend(moves)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            # the moves are queued together, so a previous writer takes all of them or none
+            if not moves[0].future.done():
+                queued = self._pending.pop(key, [])
+                try:
+                    await write(queued)
+                except Exception as e:
+                    for each in queued:
+                        if not each.future.done():
+                            each.future.set_exception(e)
+                except BaseException:
+                    # the writer was cancelled, the others can't know if their moves were written
+                    for each in moves:
+                        each.future.cancel()
+                    for each in queued:
+                        if not each.future.done():
+                            each.future.set_exception(RuntimeError("Groups update was interrupted"))
+                    raise
+        return await asyncio.gather(*(move.future for move in moves), return_exceptions=True)
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: the first caller of a key starts the call,
+    the callers arriving while it is in flight wait for the same call and all of them
+    get its result or its error. The call runs in its own task, so a cancelled caller
+    doesn't cancel it for the others, it is cancelled only when no caller is left.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[Hashable, int] = {}
+
+    def waiters(self, key: Hashable) -> int:
+        return self._waiters.get(key, 0)
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+            del self._waiters[key]
+            SINGLEFLIGHT_WAITERS.remove(self.name, str(key))
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.create_task(func(), name=f"singleflight-{self.name}")
+            self._waiters[key] = 0
+            task.add_done_callback(lambda done: self._done(key, done))
+            SINGLEFLIGHT_CALLS.inc(self.name)
+        else:
+            SINGLEFLIGHT_SHARED.inc(self.name)
+        self._waiters[key] += 1
+        SINGLEFLIGHT_WAITERS.inc(self.name, str(key))
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and self._tasks.get(key) is task:
+                self._waiters[key] -= 1
+                SINGLEFLIGHT_WAITERS.dec(self.name, str(key))
+                if not self._waiters[key]:
+                    task.cancel()
+            raise
 
 
 class ObjState(StrEnum):
@@ -54,34 +496,295 @@ class ObjState(StrEnum):
     UNLOCKED = "🟢"
 
 
+@dataclass(slots=True)
+class Unit:
+    """The part of a Wialon unit the bot uses"""
+    id: int
+    name: Optional[str]
+    lock: ObjState = ObjState.UNKNOWN
+
+    @classmethod
+    def from_item(cls, item: Dict[str, Any], lock: ObjState = ObjState.UNKNOWN) -> "Unit":
+        return cls(item["id"], item.get("nm"), lock)
+
+
+class Units(List[Unit]):
+    """Units of a listing, `stale_since` is the unix time of the snapshot they were served from"""
+
+    def __init__(self, units: Iterable[Unit] = (), stale_since: Optional[float] = None):
+        super().__init__(units)
+        self.stale_since = stale_since
+
+
+@dataclass
+class StaleFleet:
+    """Groups members and units names of the local snapshot, served until the first refresh from Wialon"""
+    groups: Dict[str, SnapshotGroup]
+    names: UnitNamesIndex
+
+
+class LockIndex:
+    """
+    Lock state lookup built once from the locked and unlocked groups members,
+    answers in O(1) per uid instead of scanning the members lists
+    """
+    __slots__ = ("_sources", "_states")
+
+    def __init__(self, locked_uids: Iterable[int], unlocked_uids: Iterable[int]):
+        self._sources = (locked_uids, unlocked_uids)
+        locked = frozenset(locked_uids)
+        unlocked = frozenset(unlocked_uids)
+        states = dict.fromkeys(locked, ObjState.LOCKED)
+        states.update(dict.fromkeys(unlocked, ObjState.UNLOCKED))
+        # the unit in both groups can't be trusted
+        states.update(dict.fromkeys(locked & unlocked, ObjState.UNKNOWN))
+        self._states: Dict[int, ObjState] = states
+
+    def built_from(self, locked_uids: Iterable[int], unlocked_uids: Iterable[int]) -> bool:
+        return self._sources[0] is locked_uids and self._sources[1] is unlocked_uids
+
+    def classify(self, uid: int) -> ObjState:
+        state = self._states.get(uid)
+        if state is None:
+            logging.error("Not found, uid: `%s`", uid)
+            return ObjState.UNKNOWN
+        if state is ObjState.UNKNOWN:
+            logging.error("Device in both groups, uid: `%s`", uid)
+        return state
+
+    def classify_many(self, uids: Sequence[int]) -> List[ObjState]:
+        get = self._states.get
+        states = [get(uid, ObjState.UNKNOWN) for uid in uids]
+        if ObjState.UNKNOWN in states:
+            unknown = [uid for uid, state in zip(uids, states) if state is ObjState.UNKNOWN]
+            logging.error("Not found or in both groups, uids: `%s`", unknown)
+        return states
+
+
 @dataclass
 class WialonWorker:
     wln_host: str
     wln_token: str
     tg_groups: Dict[str, TelegramGroup]
     session: Type[WialonSession] = WialonSession
+    keepalive_interval: float = KEEPALIVE_INTERVAL
+    membership_ttl: float = MEMBERSHIP_TTL
+    max_connections: int = MAX_CONNECTIONS
+    snapshot: Optional[SnapshotStore] = None
+    snapshot_interval: float = SNAPSHOT_INTERVAL
+    _sessions: WialonSessionManager = field(init=False, repr=False)
+    _members: MembershipCache = field(init=False, repr=False)
+    _moves: GroupMovesQueue = field(init=False, repr=False)
+    _names: UnitNamesIndex = field(init=False, repr=False)
+    _group_reads: SingleFlight = field(init=False, repr=False)
+    _lists: SingleFlight = field(init=False, repr=False)
+    _calls: CallPolicy = field(init=False, repr=False)
+    _stale: Optional[StaleFleet] = field(init=False, repr=False, default=None)
+    # members and names dropped by the last session reset, the fallback while the host is unavailable
+    _last_known: Optional[StaleFleet] = field(init=False, repr=False, default=None)
+    _prewarm_task: Optional[asyncio.Task] = field(init=False, repr=False, default=None)
+    _snapshot_task: Optional[asyncio.Task] = field(init=False, repr=False, default=None)
 
-    async def _get_group_by_name(self, group_name, session: WialonSession):
-        params = {
-            "spec": {
-                "itemsType": "avl_unit_group",
-                "propName": "sys_name",
-                "propValueMask": group_name,
-                "sortType": "sys_name",
-                "propType": ""
-            },
-            "force": 1,
-            "flags": UnitsDataFlag.BASE | UnitsDataFlag.BILLING_PROPS,
-            "from": 0,
-            "to": 0
-        }
-        response = await session.core_search_items(**params)
-        items = response.get('items', [])
-        if not items:
+    def __post_init__(self):
+        self._sessions = WialonSessionManager(
+            self.wln_host, self.wln_token, self.session, self.keepalive_interval, self.max_connections
+        )
+        self._members = MembershipCache(self.membership_ttl)
+        self._moves = GroupMovesQueue()
+        self._names = UnitNamesIndex()
+        self._group_reads = SingleFlight("groups")
+        self._lists = SingleFlight("list")
+        self._calls = CallPolicy(self._sessions.session.base_url)
+        self._sessions.add_event_listener(self._members.on_avl_event)
+        self._sessions.add_event_listener(self._names.on_avl_event)
+        # before the caches are dropped
+        self._sessions.add_reset_listener(self._keep_last_known)
+        self._sessions.add_reset_listener(self._members.reset)
+        self._sessions.add_reset_listener(self._names.reset)
+
+    async def close(self):
+        for task in (self._prewarm_task, self._snapshot_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._prewarm_task = self._snapshot_task = None
+        await self.save_snapshot()
+        await self._sessions.close()
+
+    def _keep_last_known(self):
+        groups = {group.name: SnapshotGroup(group.id, group.uids, wall_time(group.loaded_at))
+                  for group in self._members.entries()}
+        if not groups:
+            return
+        names = self._names.detach()
+        if (previous := self._last_known) is not None:
+            # the groups not reloaded since the previous reset
+            for name, group in previous.groups.items():
+                if name not in groups:
+                    groups[name] = group
+                    for uid in names.missing(group.uids):
+                        if (unit_name := previous.names.name(uid)) is not None:
+                            names.put(uid, unit_name)
+        self._last_known = StaleFleet(groups, names)
+
+    def _group_names(self) -> set:
+        return {name for group in self.tg_groups.values()
+                for name in (group.wln_group_locked, group.wln_group_unlocked, group.wln_group_ignored) if name}
+
+    def _load_snapshot(self) -> Optional[StaleFleet]:
+        snapshot = self.snapshot.load(self.wln_host, self._group_names())
+        if not snapshot.groups:
             return None
-        return items[0]
+        names = UnitNamesIndex()
+        for uid, name in snapshot.names.items():
+            names.put(uid, name)
+        return StaleFleet(snapshot.groups, names)
+
+    async def warm_start(self):
+        """
+        Loads the local fleet snapshot, the listings are served from it at once,
+        until `prewarm` refreshes the groups and the names from Wialon
+        """
+        if self.snapshot is None:
+            return
+        try:
+            # the names index of a big fleet takes a while to build
+            self._stale = await asyncio.to_thread(self._load_snapshot)
+        except (sqlite3.Error, OSError, ValueError) as e:
+            logging.error("Failed to load the fleet snapshot of %s from `%s`: %s", self.wln_host, self.snapshot.path, e)
+        if self._stale is not None:
+            logging.info("Loaded the fleet snapshot of %s: %d groups, %d units",
+                         self.wln_host, len(self._stale.groups), len(self._stale.names))
+
+    def prewarm(self, concurrency: int = PREFETCH_CONCURRENCY) -> asyncio.Task:
+        """
+        Starts the prefetch of all the chats in the background, then the periodic snapshot saves.
+        The task results in the seconds spent on the Wialon login and on the prefetch.
+        """
+        self._prewarm_task = asyncio.create_task(self._prewarm(concurrency), name="wialon-prewarm")
+        return self._prewarm_task
+
+    async def _prewarm(self, concurrency: int) -> Tuple[float, float]:
+        timings = await self.prefetch(concurrency)
+        if self.snapshot is not None:
+            self._snapshot_task = asyncio.create_task(self._keep_snapshot(), name="fleet-snapshot")
+        return timings
+
+    async def _prefetch_chats(self, concurrency: int):
+        # the groups of all the chats in a single round trip
+        await self._sessions.call(self._fetch_groups, *self._group_names())
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def prefetch(group):
+            async with semaphore:
+                # a `/list` sent meanwhile joins the listing in flight
+                await self._lists.do(self._list_key(group, "*"),
+                                     lambda: self._sessions.call(self._list_by_groups, group, "*"))
+
+        # the chats bound to the same groups share the listing
+        groups = {await self.get_groups(chat_id) for chat_id in self.tg_groups}
+        async with asyncio.TaskGroup() as tasks:
+            for group in groups:
+                tasks.create_task(prefetch(group))
+
+    async def prefetch(self, concurrency: int = PREFETCH_CONCURRENCY) -> Tuple[float, float]:
+        """
+        Logs in and loads the groups and the units of every chat, `concurrency` chats at a time,
+        retries until it succeeds, then stops serving the snapshot.
+        Returns the seconds spent on the login and on the listings, the retries included.
+        """
+        start = time.perf_counter()
+        logged_in = None
+        delay = PREFETCH_RETRY_MIN
+        while True:
+            try:
+                await self._sessions.open()
+                if logged_in is None:
+                    logged_in = time.perf_counter()
+                await self._prefetch_chats(concurrency)
+                break
+            except Exception as e:
+                logging.error("Failed to prefetch the chats of %s, retry in %ss: %s", self.wln_host, delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, PREFETCH_RETRY_MAX)
+        if self._stale is not None:
+            logging.info("Fleet of %s refreshed, the snapshot is not served anymore", self.wln_host)
+        self._stale = None
+        return logged_in - start, time.perf_counter() - logged_in
 
-    async def _get_group_objects(self, *group_names, session: WialonSession):
+    async def save_snapshot(self):
+        """Upserts the loaded groups of the chats and their units names"""
+        names = self._group_names()
+        groups = [group for group in self._members.entries() if group.name in names]
+        if self.snapshot is None or not groups:
+            return
+        units = [(uid, name) for uid in {uid for group in groups for uid in group.uids}
+                 if (name := self._names.name(uid)) is not None]
+        rows = [(group.name, group.id, group.uids, wall_time(group.loaded_at)) for group in groups]
+        try:
+            await asyncio.to_thread(self.snapshot.save, self.wln_host, rows, units)
+        except (sqlite3.Error, OSError) as e:
+            logging.error("Failed to save the fleet snapshot of %s to `%s`: %s", self.wln_host, self.snapshot.path, e)
+
+    async def _keep_snapshot(self):
+        await self.save_snapshot()
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            await self.save_snapshot()
+
+    async def _subscribe_groups(self, group_ids, session: WialonSession):
+        """Adds the groups to the session, so their changes come with `avl_evts`"""
+        group_ids = self._members.unsubscribed(group_ids)
+        if not group_ids:
+            return
+        await session.core_update_data_flags(spec=[{
+            "type": "col",
+            "data": group_ids,
+            "flags": UnitsDataFlag.BASE,
+            "mode": 1,
+        }])
+        self._members.subscribed(group_ids)
+
+    async def _get_groups_members(self, *group_names, session: WialonSession) -> Dict[str, Tuple[int, ...]]:
+        """
+        Returns unit ids of the groups mapped by the group name,
+        cached groups are served from memory, the rest are fetched
+        with a single multi-mask search and subscribed for changes
+        """
+        group_names = [name for name in group_names if name]
+        members = {}
+        missing = []
+        for name in group_names:
+            if cached := self._members.get(name):
+                members[name] = cached.uids
+            else:
+                missing.append(name)
+        if missing:
+            fetched = await self._fetch_groups(*missing, session=session)
+            members.update({name: group.uids for name, group in fetched.items()})
+        return members
+
+    async def _fetch_groups(self, *group_names, session: WialonSession,
+                            shared: bool = True) -> Dict[str, GroupMembership]:
+        """
+        Fetches several groups with a single multi-mask search,
+        returns their current members mapped by the group name.
+        Concurrent fetches of the same groups share a single search unless not `shared`,
+        e.g. a read-modify-write can't use a read started before the previous write.
+        """
+        if not group_names:
+            return {}
+        if not shared:
+            return await self._search_groups(group_names, session=session)
+        names = tuple(sorted(set(group_names)))
+        # a caller doesn't join a read started before the last write to the groups
+        key = (names, self._members.generations(names))
+        return await self._group_reads.do(key, lambda: self._search_groups(names, session=session))
+
+    async def _search_groups(self, group_names: Sequence[str], session: WialonSession) -> Dict[str, GroupMembership]:
         params = {
             "spec": {
                 "itemsType": "avl_unit_group",
@@ -91,157 +794,422 @@ class WialonWorker:
                 "propType": ""
             },
             "force": 1,
-            "flags": UnitsDataFlag.BASE | UnitsDataFlag.BILLING_PROPS,
+            "flags": GROUP_FLAGS,
             "from": 0,
-            "to": len(group_names)
+            "to": 0
         }
-        response = await session.core_search_items(**params)
+        # a write finished while the request is in flight makes its result stale
+        started = {name: self._members.generation(name) for name in group_names}
+        response = await self._calls.read("core_search_items", lambda: session.core_search_items(**params))
+        # the mask can match more groups than requested, keep the requested names only,
+        # compared case-insensitively like Wialon does, a group named exactly as configured wins
         items = response.get('items', [])
-        if not items:
-            return []
-        # join all items
-        return [item for each in items for item in each.get('u', [])]
+        exact = {}
+        folded = {}
+        for item in items:
+            exact.setdefault(item.get('nm'), item)
+            folded.setdefault(str(item.get('nm', '')).casefold(), item)
+        groups = {}
+        for name in dict.fromkeys(group_names):
+            item = exact.get(name) or folded.get(name.casefold())
+            if item is not None:
+                if item['nm'] != name:
+                    logging.info("Group `%s` found as `%s` in Wialon", name, item['nm'])
+                # the entries keep the configured names
+                uids = item.get('u', [])
+                group = self._members.put(item['id'], name, uids, generation=started[name])
+                if group is None:
+                    logging.info("Group `%s` changed while it was read, the result is not cached", name)
+                    group = GroupMembership(item['id'], name, tuple(uids), time.monotonic())
+                groups[name] = group
+        group_ids = [group.id for group in groups.values()]
+        try:
+            await self._subscribe_groups(group_ids, session=session)
+        except SESSION_EXPIRED_ERRORS:
+            raise
+        except Exception as e:
+            # without subscription the entries are still refreshed by ttl
+            logging.error("Failed to subscribe groups %s: %s", group_ids, e)
+        return groups
 
-    async def _get_objects_by_ids(self, ids, pattern: str = "*", session: WialonSession = None):
-        if not ids:
-            return []
-        ids_mask = "|".join([str(i) for i in ids])
+    async def _subscribe_units(self, uids, session: WialonSession):
+        """Adds the units to the session, so their renames come with `avl_evts`"""
+        uids = self._names.unsubscribed(uids)
+        if not uids:
+            return
+        await session.core_update_data_flags(spec=[{
+            "type": "col",
+            "data": uids,
+            "flags": UnitsDataFlag.BASE,
+            "mode": 1,
+        }])
+        self._names.subscribed(uids)
 
-        if not self.has_special_character_loop(pattern):
-            pattern = f"*{pattern}*"
+    async def _iter_units_by_ids(self, ids: Sequence[int], flags_: int = UNIT_FLAGS,
+                                 session: WialonSession = None
+                                 ) -> AsyncIterator[Tuple[Sequence[int], List[Dict[str, Any]]]]:
+        """
+        Searches the units by ids in chunks of `ID_MASK_CHUNK`, at most `ID_MASK_CONCURRENCY`
+        requests at once, yields (chunk ids, found units) in order of completion
+        """
+        semaphore = asyncio.Semaphore(ID_MASK_CONCURRENCY)
 
-        params = {
-            "spec": {
-                "itemsType": "avl_unit",
-                "propName": "sys_id,sys_name",
-                # "propValueMask": "*",
-                "propValueMask": f"{ids_mask},{pattern}",
-                "sortType": "sys_name",
-                "propType": ""
-            },
-            "force": 1,
-            "flags": UnitsDataFlag.BASE | UnitsDataFlag.BILLING_PROPS,
-            "from": 0,
-            "to": 0
-        }
-        response = await session.core_search_items(**params)
-        items = response.get('items', [])
-        return items
+        async def fetch(chunk):
+            async with semaphore:
+                params = {
+                    "spec": {
+                        "itemsType": "avl_unit",
+                        "propName": "sys_id",
+                        "propValueMask": "|".join([str(i) for i in chunk]),
+                        "sortType": "sys_name",
+                        "propType": ""
+                    },
+                    "force": 1,
+                    "flags": flags_,
+                    "from": 0,
+                    "to": 0
+                }
+                response = await self._calls.read("core_search_items", lambda: session.core_search_items(**params))
+                return chunk, response.get('items', [])
+
+        tasks = [asyncio.create_task(fetch(ids[i:i + ID_MASK_CHUNK]))
+                 for i in range(0, len(ids), ID_MASK_CHUNK)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            # the consumer stopped early or a chunk failed
+            for task in tasks:
+                task.cancel()
+
+    async def _fetch_names(self, ids, session: WialonSession):
+        """Loads the names of the units not indexed yet and subscribes them for renames"""
+        ids = self._names.missing(ids)
+        if not ids:
+            return
+        async for chunk, items in self._iter_units_by_ids(ids, session=session):
+            for item in items:
+                self._names.put(item['id'], item['nm'])
+            self._names.put_absent(chunk)
+        fetched = [uid for uid in ids if self._names.name(uid) is not None]
+        try:
+            await self._subscribe_units(fetched, session=session)
+        except SESSION_EXPIRED_ERRORS:
+            raise
+        except Exception as e:
+            # renames are then missed until the next session
+            logging.error("Failed to subscribe %s units: %s", len(fetched), e)
+
+    async def _search_names(self, ids, pattern: str = "*", session: WialonSession = None) -> List[Tuple[int, str]]:
+        """(uid, name) of `ids` matching the pattern, searched in the local names index"""
+        if not ids:
+            return []
+        await self._fetch_names(ids, session=session)
+        return self._names.search(pattern, set(ids))
 
     async def get_groups(self, tg_group_id) -> Optional[Tuple[TelegramGroup, ...]]:
         if groups := self.tg_groups.get(str(tg_group_id), None):
             return groups.wln_group_locked, groups.wln_group_unlocked, groups.wln_group_ignored
-        raise Exception(f"Group `%s` not found." % tg_group_id)
+        raise Exception("Group `%s` not found." % tg_group_id)
 
-    async def _get_unit(self, uid, session):
+    async def _get_unit(self, uid, session) -> Unit:
         uid = int(uid)
-        params = {
-            "id": uid,
-            "flags": (
-                    UnitsDataFlag.BASE
-                    | UnitsDataFlag.BILLING_PROPS
-                # | UnitsDataFlag.LAST_MSG_N_POS
-                # | UnitsDataFlag.POS
-                # | UnitsDataFlag.SENSORS
-            )
-        }
-        return await session.core_search_item(**params)
+        # indexed names are kept up to date by `avl_evts`
+        if (name := self._names.name(uid)) is not None:
+            return Unit(uid, name)
+        response = await self._calls.read("core_search_item", lambda: session.core_search_item(id=uid, flags=UNIT_FLAGS))
+        return Unit.from_item(response.get('item') or {"id": uid})
 
-    async def _swap_groups(self, uid, from_group_name, to_group_name, session: WialonSession):
-        from_group = await self._get_group_by_name(from_group_name, session=session)
-        to_group = await self._get_group_by_name(to_group_name, session=session)
-        if not from_group or not to_group:
+    async def _write_moves(self, moves: List[GroupMove], session: WialonSession):
+        """
+        Applies the queued moves to freshly read members of their groups
+        and writes the changed groups back with a single batch
+        """
+        names = {name for move in moves for name in (move.from_group, move.to_group)}
+        groups = await self._fetch_groups(*names, session=session, shared=False)
+        if len(groups) != len(names):
             raise ValueError("One of the groups not found")
-        from_uids = from_group.get('u', [])
-        to_uids = to_group.get('u', [])
 
-        if not from_uids and not to_uids:
-            raise ValueError("Both groups are empty")
+        members = {name: list(group.uids) for name, group in groups.items()}
+        applied = []
+        for move in moves:
+            from_uids, to_uids = members[move.from_group], members[move.to_group]
+            if move.uid not in from_uids:
+                move.future.set_exception(ValueError(
+                    "Object `%s` not found in expected group `%s`" % (move.uid, groups[move.from_group].id)
+                ))
+                continue
+            from_uids.remove(move.uid)
+            to_uids.append(move.uid)
+            applied.append(move)
+        if not applied:
+            return
 
-        if not uid in from_uids:
-            raise ValueError("Object `%s` not found in expected group `%s`" % (uid, from_group["id"]))
+        changed = {name for move in applied for name in (move.from_group, move.to_group)}
 
-        from_uids.remove(uid)
-        to_uids.append(uid)
+        def write():
+            # the calls are only collected by the batch, so they are created per request
+            calls = [
+                session.unit_group_update_units(**{"itemId": groups[name].id, "units": members[name]})
+                for name in sorted(changed)
+            ]
+            return session.batch(*calls, flags_=flags.BatchFlag.STOP_ON_ERROR)
+
+        try:
+            await self._calls.write("core_batch", write)
+        except Exception:
+            for name in changed:
+                self._members.invalidate(name)
+            raise
+        for name in changed:
+            self._members.put(groups[name].id, name, members[name])
+        for move in applied:
+            move.future.set_result(None)
 
-        update_from_group_call = session.unit_group_update_units(
-            **{"itemId": from_group["id"], "units": from_uids}
+    async def _swap_groups(self, uid, from_group_name, to_group_name, session: WialonSession):
+        error, = await self._moves.submit(
+            [GroupMove(uid, from_group_name, to_group_name)],
+            lambda moves: self._write_moves(moves, session=session)
         )
+        if error is not None:
+            raise error
 
-        update_to_group_call = session.unit_group_update_units(
-            **{"itemId": to_group["id"], "units": to_uids}
+    async def _move_many(self, uids, from_group_name, to_group_name,
+                         session: WialonSession) -> Dict[int, Optional[Exception]]:
+        errors = await self._moves.submit(
+            [GroupMove(uid, from_group_name, to_group_name) for uid in uids],
+            lambda moves: self._write_moves(moves, session=session)
         )
+        for error in errors:
+            # nothing was written with the expired session, let the caller retry them all
+            if isinstance(error, SESSION_EXPIRED_ERRORS):
+                raise error
+        return dict(zip(uids, errors))
 
-        await session.batch(
-            update_from_group_call,
-            update_to_group_call,
-            flags_=flags.BatchFlag.STOP_ON_ERROR
+    async def _move_unit(self, group, uid, from_group_name, to_group_name, session: WialonSession) -> Unit:
+        locked, unlocked, ignored = group
+        # the unit read doesn't depend on the write, run them side by side
+        _, unit = await asyncio.gather(
+            self._swap_groups(uid, from_group_name, to_group_name, session=session),
+            self._get_unit(uid, session=session),
         )
+        # served from the cache the write has just updated, no re-read
+        members = await self._get_groups_members(locked, unlocked, session=session)
+        unit.lock = self._lock_index(group, members).classify(uid)
+        return unit
+
+    async def _lock(self, group, uid, session: WialonSession) -> Unit:
+        locked, unlocked, ignored = group
+        return await self._move_unit(group, uid, unlocked, locked, session=session)
+
+    async def _unlock(self, group, uid, session: WialonSession) -> Unit:
+        locked, unlocked, ignored = group
+        return await self._move_unit(group, uid, locked, unlocked, session=session)
+
+    async def lock_many(self, tg_group_id, uids: Iterable[int]) -> Dict[int, Optional[Exception]]:
+        """
+        Moves the units to the locked group with a single read and a single write,
+        returns the error for each uid, None if it was locked
+        """
+        uids = list(dict.fromkeys(int(uid) for uid in uids))
+        if not uids:
+            return {}
+        locked, unlocked, ignored = await self.get_groups(tg_group_id)
+        return await self._sessions.call(self._move_many, uids, unlocked, locked)
+
+    async def unlock_many(self, tg_group_id, uids: Iterable[int]) -> Dict[int, Optional[Exception]]:
+        """
+        Moves the units to the unlocked group with a single read and a single write,
+        returns the error for each uid, None if it was unlocked
+        """
+        uids = list(dict.fromkeys(int(uid) for uid in uids))
+        if not uids:
+            return {}
+        locked, unlocked, ignored = await self.get_groups(tg_group_id)
+        return await self._sessions.call(self._move_many, uids, locked, unlocked)
 
-    async def lock(self, tg_group_id, uid):
+    async def lock(self, tg_group_id, uid) -> Unit:
         uid = int(uid)
         group = await self.get_groups(tg_group_id)
-        async with WialonSession(token=self.wln_token, host=self.wln_host) as session:
-            locked, unlocked, ignored = group
-            await self._swap_groups(uid, unlocked, locked, session=session)
-            return await self._get_unit_and_lock_state(group, uid, session=session)
+        return await self._sessions.call(self._lock, group, uid)
 
-    async def unlock(self, tg_group_id, uid):
+    async def unlock(self, tg_group_id, uid) -> Unit:
         uid = int(uid)
         group = await self.get_groups(tg_group_id)
-        async with WialonSession(token=self.wln_token, host=self.wln_host) as session:
-            locked, unlocked, ignored = group
-            await self._swap_groups(uid, locked, unlocked, session=session)
-            return await self._get_unit_and_lock_state(group, uid, session=session)
-
-    async def _check_is_locked(self, uid, locked_uids, unlocked_uids):
-        if uid in locked_uids and uid in unlocked_uids:
-            logging.error("Device in both groups, uid: `%s`" % uid)
-            return ObjState.UNKNOWN
-        elif uid in locked_uids:
-            return ObjState.LOCKED
-        elif uid in unlocked_uids:
-            return ObjState.UNLOCKED
-        logging.error("Not found, uid: `%s`" % uid)
-        return ObjState.UNKNOWN
+        return await self._sessions.call(self._unlock, group, uid)
+
+    def _lock_index(self, group, members: Dict[str, Tuple[int, ...]]) -> LockIndex:
+        locked, unlocked, ignored = group
+        return self._members.lock_index(
+            locked, unlocked, members.get(locked, ()), members.get(unlocked, ())
+        )
+
+    async def _classify_many(self, group, uids, session: WialonSession) -> List[ObjState]:
+        locked, unlocked, ignored = group
+        members = await self._get_groups_members(locked, unlocked, session=session)
+        return self._lock_index(group, members).classify_many(uids)
+
+    async def classify_many(self, tg_group_id, uids: Iterable[int]) -> List[ObjState]:
+        """Lock states of the units, in the order of `uids`"""
+        group = await self.get_groups(tg_group_id)
+        uids = [int(uid) for uid in uids]
+        return await self._sessions.call(self._classify_many, group, uids)
 
     async def _get_unit_and_lock_state(self, group: Tuple[TelegramGroup, TelegramGroup, TelegramGroup],
-                                       uid, session):
+                                       uid, session) -> Unit:
         uid = int(uid)
         locked, unlocked, ignored = group
-        locked_uids = await self._get_group_objects(locked, session=session)
-        unlocked_uids = await self._get_group_objects(unlocked, session=session)
-        lock_state = await self._check_is_locked(uid, locked_uids, unlocked_uids)
-        unit = await self._get_unit(uid, session=session)
-        return unit, lock_state
+        members, unit = await asyncio.gather(
+            self._get_groups_members(locked, unlocked, session=session),
+            self._get_unit(uid, session=session),
+        )
+        unit.lock = self._lock_index(group, members).classify(uid)
+        return unit
 
-    async def get_unit_and_lock_state(self, tg_group_id, uid):
+    async def get_unit_and_lock_state(self, tg_group_id, uid) -> Unit:
         group = await self.get_groups(tg_group_id)
-        async with WialonSession(token=self.wln_token, host=self.wln_host) as session:
-            return await self._get_unit_and_lock_state(group, uid, session=session)
+        return await self._sessions.call(self._get_unit_and_lock_state, group, uid)
 
     @staticmethod
     def has_special_character_loop(input_string):
-        special_characters = "*|><=!"
-        for char in input_string:
-            if char in special_characters:
-                return True
-        return False
+        return is_mask(input_string)
 
-    async def list_by_tg_group_id(self, tg_group_id, pattern: str = "*") -> Dict[str, Any]:
-        group = await self.get_groups(tg_group_id)
-        async with WialonSession(token=self.wln_token, host=self.wln_host) as session:
-            locked, unlocked, ignored = group
-            locked_uids = await self._get_group_objects(locked, session=session)
-            unlocked_uids = await self._get_group_objects(unlocked, session=session)
-            uids = locked_uids + unlocked_uids
-            if ignored:
-                ignored_uids = await self._get_group_objects(ignored, session=session)
+    async def _list_by_groups(self, group, pattern: str, session: WialonSession) -> List[Unit]:
+        locked, unlocked, ignored = group
+        # all the chat groups in a single round trip (or none if cached), the names from the local index
+        members = await self._get_groups_members(locked, unlocked, ignored, session=session)
+        locked_uids = members.get(locked, ())
+        unlocked_uids = members.get(unlocked, ())
+        ignored_uids = members.get(ignored, ()) if ignored else ()
+
+        uids = (set(locked_uids) | set(unlocked_uids)) - set(ignored_uids)
+        found = await self._search_names(uids, pattern, session=session)
+        states = self._lock_index(group, members).classify_many([uid for uid, name in found])
+        return [Unit(uid, name, state) for (uid, name), state in zip(found, states)]
+
+    def _list_stale(self, group, pattern: str, fallback: bool = False) -> Optional[Units]:
+        """
+        Listing of the snapshot, the groups already refreshed (e.g. by a lock) are taken from the cache.
+        As a `fallback` the expired cache entries and the data dropped by the last session reset are used too.
+        None if there is nothing to serve or one of the groups is missing.
+        """
+        sources = [fleet for fleet in ((self._last_known, self._stale) if fallback else (self._stale,)) if fleet]
+        if not sources and not fallback:
+            return None
+        locked, unlocked, ignored = group
+        members = {}
+        saved_at = []
+        for name in (locked, unlocked, ignored):
+            if not name:
+                continue
+            if cached := self._members.get(name):
+                members[name] = cached.uids
+            elif fallback and (cached := self._members.peek(name)):
+                members[name] = cached.uids
+                saved_at.append(wall_time(cached.loaded_at))
+            elif saved := next((fleet.groups[name] for fleet in sources if name in fleet.groups), None):
+                members[name] = saved.uids
+                saved_at.append(saved.saved_at)
             else:
-                ignored_uids = []
+                return None
+        if not saved_at and not fallback:
+            return None
+        uids = (set(members.get(locked, ())) | set(members.get(unlocked, ()))) - set(members.get(ignored, ()))
+        indexes = [fleet.names for fleet in sources]
+        if fallback:
+            indexes.insert(0, self._names)
+        if len(indexes) == 1:
+            found = indexes[0].search(pattern, uids)
+        else:
+            names = {}
+            for index in reversed(indexes):
+                names.update(index.search(pattern, uids))
+            found = sorted(names.items(), key=lambda item: (item[1].casefold(), item[0]))
+        states = self._lock_index(group, members).classify_many([uid for uid, name in found])
+        units = (Unit(uid, name, state) for (uid, name), state in zip(found, states))
+        return Units(units, min(saved_at) if saved_at else time.time())
+
+    def _list_key(self, group, pattern: str) -> Hashable:
+        # a listing started before a lock or an unlock is not shared with the calls after it
+        return group, pattern, self._members.generations(group)
+
+    async def list_by_tg_group_id(self, tg_group_id, pattern: str = "*") -> Units:
+        group = await self.get_groups(tg_group_id)
+        if (units := self._list_stale(group, pattern)) is not None:
+            SNAPSHOT_READS.inc(self.wln_host)
+            return units
+        try:
+            # the result depends only on the groups, so the chats bound to the same groups share it too
+            units = await self._lists.do(
+                self._list_key(group, pattern), lambda: self._sessions.call(self._list_by_groups, group, pattern)
+            )
+        except Exception as e:
+            if not is_unavailable(e) or (units := self._list_stale(group, pattern, fallback=True)) is None:
+                raise
+            logging.warning("Wialon host %s is unavailable, listing from the last known data: %s", self.wln_host, e)
+            WIALON_FALLBACK_READS.inc(self.wln_host)
+            return units
+        return Units(units)
+
+
+class WialonWorkerRegistry:
+    """
+    Workers of the Wialon backends mapped by the backend name,
+    routes the calls of a chat to the worker of its backend.
+    Every worker has its own session, keep-alive and connection pool,
+    so a slow or unavailable host only delays the chats bound to it.
+    """
+
+    def __init__(self, workers: Dict[str, WialonWorker]):
+        self.workers = workers
+        self._by_chat: Dict[str, WialonWorker] = {
+            chat_id: worker for worker in workers.values() for chat_id in worker.tg_groups
+        }
+        self._prewarm: Optional[asyncio.Future] = None
+
+    def for_chat(self, tg_group_id) -> WialonWorker:
+        if worker := self._by_chat.get(str(tg_group_id)):
+            return worker
+        raise Exception("Group `%s` not found." % tg_group_id)
+
+    async def close(self):
+        results = await asyncio.gather(*(worker.close() for worker in self.workers.values()),
+                                       return_exceptions=True)
+        for name, result in zip(self.workers, results):
+            if isinstance(result, Exception):
+                logging.error("Failed to close Wialon worker `%s`: %s", name, result)
+
+    async def warm_start(self):
+        await asyncio.gather(*(worker.warm_start() for worker in self.workers.values()))
+
+    def prewarm(self, concurrency: int = PREFETCH_CONCURRENCY) -> asyncio.Future:
+        """
+        Starts the prefetch of every worker, each bounded by `concurrency`,
+        the future results in their (login, prefetch) seconds
+        """
+        self._prewarm = asyncio.gather(*(worker.prewarm(concurrency) for worker in self.workers.values()))
+        return self._prewarm
+
+    async def get_groups(self, tg_group_id) -> Optional[Tuple[TelegramGroup, ...]]:
+        return await self.for_chat(tg_group_id).get_groups(tg_group_id)
+
+    async def list_by_tg_group_id(self, tg_group_id, pattern: str = "*") -> Units:
+        return await self.for_chat(tg_group_id).list_by_tg_group_id(tg_group_id, pattern)
+
+    async def get_unit_and_lock_state(self, tg_group_id, uid) -> Unit:
+        return await self.for_chat(tg_group_id).get_unit_and_lock_state(tg_group_id, uid)
+
+    async def classify_many(self, tg_group_id, uids: Iterable[int]) -> List[ObjState]:
+        return await self.for_chat(tg_group_id).classify_many(tg_group_id, uids)
+
+    async def lock(self, tg_group_id, uid) -> Unit:
+        return await self.for_chat(tg_group_id).lock(tg_group_id, uid)
+
+    async def unlock(self, tg_group_id, uid) -> Unit:
+        return await self.for_chat(tg_group_id).unlock(tg_group_id, uid)
+
+    async def lock_many(self, tg_group_id, uids: Iterable[int]) -> Dict[int, Optional[Exception]]:
+        return await self.for_chat(tg_group_id).lock_many(tg_group_id, uids)
 
-            uids = set(uids) - set(ignored_uids)
-            objects = await self._get_objects_by_ids(uids, pattern, session=session)
-            for obj in objects:
-                obj['_lock_'] = await self._check_is_locked(obj['id'], locked_uids, unlocked_uids)
-            return objects
+    async def unlock_many(self, tg_group_id, uids: Iterable[int]) -> Dict[int, Optional[Exception]]:
+        return await self.for_chat(tg_group_id).unlock_many(tg_group_id, uids)